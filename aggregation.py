@@ -0,0 +1,119 @@
+# ---------------------------------------------------------------------
+# Copyright (c) 2018 TU Berlin, Communication Systems Group
+# Written by Tobias Senst <senst@nue.tu-berlin.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# ---------------------------------------------------------------------
+import numpy as np
+
+import result_table as rt
+import util as ut
+
+# sequences containing EXCLUDE_PATTERN are not evaluated, sequences containing DYNAMIC_PATTERN have camera motion
+EXCLUDE_PATTERN = "_dyn"
+DYNAMIC_PATTERN = "_hDyn"
+
+
+def stack_items(items, regions, measures=ut.MEASURES):
+    """
+    Stack result dicts {"FG": {"ee": ...}, ...} into an array of shape (len(items), len(regions), len(measures))
+    """
+    values = np.zeros((len(items), len(regions), len(measures)), dtype=np.float64)
+    for i, item in enumerate(items):
+        for r, region in enumerate(regions):
+            for m, measure in enumerate(measures):
+                values[i, r, m] = item[region][measure]
+    return values
+
+
+def sequence_means(sums):
+    """
+    Divide the summed ee, R1, R2 and R3 (all but the last measure) by the number of points (last measure)
+    :param sums: array (..., len(MEASURES)) of summed measures
+    :return: array of the same shape, the number of points is kept as sum
+    """
+    means = np.array(sums, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means[..., :-1] = means[..., :-1] / means[..., -1:]
+    return means
+
+
+def mean_over_sequences(means, selected):
+    """
+    Average per-sequence means over the selected sequences of every method
+    :param means: array (M, S, ...) of per-sequence means
+    :param selected: bool array (M, S)
+    :return: array (M, ...), nan for methods without selected sequence
+    """
+    selected = selected.reshape(selected.shape + (1,) * (means.ndim - 2))
+    count = selected.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(selected, means, 0).sum(axis=1) / count
+
+
+def aggregate(table, exclude_pattern=EXCLUDE_PATTERN, dynamic_pattern=DYNAMIC_PATTERN):
+    """
+    Compute per-sequence, static, dynamic and overall means of a columnar result table in one grouped reduction.
+    The table is not modified, so repeated calls return the same values.
+    :param table: columnar result table, see result_table.table_from_results
+    :param exclude_pattern: sequences containing this string are ignored
+    :param dynamic_pattern: sequences containing this string count as dynamic, all others as static
+    :return: dict with
+        "methods", "sequences", "regions": names of the axes below
+        "frames": (M, S) number of frame pairs
+        "sequence_sums": (M, S, R, len(MEASURES)) summed measures
+        "sequence_means": (M, S, R, len(MEASURES)) mean ee, R1, R2, R3 per point and number of points
+        "static", "dynamic", "overall": (M, R, len(MEASURES)) average of the sequence means
+        "evaluated": (M,) methods with at least one evaluated sequence
+    """
+    methods = [str(name) for name in table["methods"]]
+    sequences = [str(name) for name in table["sequences"]]
+    regions = [str(name) for name in table["regions"]]
+
+    sums = rt.group_sums(table, ("method", "sequence", "region"))
+    first_region = table["region"] == 0
+    frames = np.bincount(table["method"][first_region] * len(sequences) + table["sequence"][first_region],
+                         minlength=len(methods) * len(sequences)).reshape(len(methods), len(sequences))
+    means = sequence_means(sums)
+
+    excluded = np.array([name.find(exclude_pattern) >= 0 for name in sequences], dtype=bool)
+    dynamic = np.array([name.find(dynamic_pattern) >= 0 for name in sequences], dtype=bool)
+    present = (frames > 0) & ~excluded
+    return {"methods": methods,
+            "sequences": sequences,
+            "regions": regions,
+            "frames": frames,
+            "sequence_sums": sums,
+            "sequence_means": means,
+            "static": mean_over_sequences(means, present & ~dynamic),
+            "dynamic": mean_over_sequences(means, present & dynamic),
+            "overall": mean_over_sequences(means, present),
+            "evaluated": present.any(axis=1),
+            }
+
+
+def aggregate_results(result_list, **kwargs):
+    """
+    Same as aggregate for a list of (config_item, result)
+    """
+    return aggregate(rt.table_from_results(result_list), **kwargs)
+
+
+def aggregate_file(filename, **kwargs):
+    """
+    Same as aggregate for a result file, columnar tables are used directly
+    """
+    if filename.endswith(rt.TABLE_EXTENSION):
+        return aggregate(rt.load_result_table(filename), **kwargs)
+    return aggregate_results(ut.load_results(filename), **kwargs)
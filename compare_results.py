@@ -0,0 +1,406 @@
+# ---------------------------------------------------------------------
+# Copyright (c) 2018 TU Berlin, Communication Systems Group
+# Written by Tobias Senst <senst@nue.tu-berlin.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# ---------------------------------------------------------------------
+import argparse
+import json
+import os
+import sys
+import warnings
+
+import numpy as np
+
+import aggregation as ag
+import report as rp
+import result_table as rt
+import util as ut
+
+# separates sequence and frame name in the keys aligning the frame pairs of two runs
+KEY_SEPARATOR = "/"
+# measures compared between runs, the number of points is only used as weight
+COMPARE_MEASURES = ut.MEASURES[:-1]
+GROUPS = ("static", "dynamic", "overall")
+# upper bound of the resampled per-frame sums held in memory at once
+BOOTSTRAP_CHUNK_BYTES = 2 ** 26
+
+
+def parse_run(value):
+    """
+    Parse a run argument of the form name=file or file, the name then is the file name without extension
+    :return: (name, file name)
+    """
+    name, sep, filename = value.partition("=")
+    if not sep:
+        filename = value
+        name = os.path.splitext(os.path.basename(value))[0]
+    if len(name) == 0 or len(filename) == 0:
+        raise argparse.ArgumentTypeError("invalid run '{}', expected name=file or file".format(value))
+    return name, filename
+
+
+def load_table(filename):
+    """
+    Columnar result table of a pickled result file, a result store or a columnar table
+    """
+    if filename.endswith(rt.TABLE_EXTENSION):
+        return rt.load_result_table(filename)
+    return rt.table_from_results(rp.load_results(filename))
+
+
+def frame_values(table, regions):
+    """
+    Per frame pair sums of every method of a columnar result table
+    :param table: columnar result table, see result_table.table_from_results
+    :param regions: regions to extract, missing regions stay zero
+    :return: dict of method name to (keys, values) with the sorted "sequence/frame" keys and the summed measures
+    (len(keys), len(regions), len(MEASURES))
+    """
+    region_index = np.array([regions.index(str(region)) if str(region) in regions else -1
+                             for region in table["regions"]], dtype=np.intp)
+    keys = np.char.add(np.char.add(table["sequences"][table["sequence"]], KEY_SEPARATOR),
+                       table["frames"][table["frame"]])
+    out = dict()
+    for m, method in enumerate(table["methods"]):
+        rows = (table["method"] == m) & (region_index[table["region"]] >= 0)
+        method_keys, inverse = np.unique(keys[rows], return_inverse=True)
+        values = np.zeros((len(method_keys), len(regions), table["values"].shape[1]), dtype=np.float64)
+        values[inverse, region_index[table["region"][rows]]] = table["values"][rows]
+        out[str(method)] = (method_keys, values)
+    return out
+
+
+def load_runs(runs, regions=None):
+    """
+    Load the per frame pair results of several runs. A run with several methods contributes one entry per
+    method, named run:method
+    :param runs: list of (name, file name) of result files, result stores or columnar tables
+    :param regions: compared regions, by default all regions of util.REGIONS and util.EXTENDED_REGIONS found
+    in every run
+    :return: (regions, list of (entry name, keys, values)), see frame_values
+    """
+    tables = [(name, load_table(filename)) for name, filename in runs]
+    if regions is None:
+        found = [set(str(region) for region in table["regions"]) for _, table in tables]
+        regions = tuple(region for region in ut.REGIONS + ut.EXTENDED_REGIONS
+                        if all(region in names for names in found))
+    entries = list()
+    for name, table in tables:
+        methods = frame_values(table, regions)
+        for method, (keys, values) in methods.items():
+            entries.append((name if len(methods) == 1 else name + ":" + method, keys, values))
+    return regions, entries
+
+
+def align(baseline, candidate):
+    """
+    Pair the frames evaluated in both runs and sort them by sequence
+    :param baseline: (keys, values) of the baseline, see frame_values
+    :param candidate: (keys, values) of the candidate
+    :return: dict with "sequences" names, "starts" and "counts" of the frames of every sequence, "frames" names,
+    the aligned "baseline" and "candidate" values and the number of frames "only_baseline" and "only_candidate"
+    """
+    keys, base_index, cand_index = np.intersect1d(baseline[0], candidate[0], assume_unique=True,
+                                                  return_indices=True)
+    parts = np.char.partition(keys, KEY_SEPARATOR)
+    order = np.argsort(parts[:, 0], kind="stable")
+    sequences, starts, counts = np.unique(parts[order, 0], return_index=True, return_counts=True)
+    return {"sequences": [str(name) for name in sequences],
+            "starts": starts,
+            "counts": counts,
+            "frames": parts[order, 2],
+            "baseline": baseline[1][base_index[order]],
+            "candidate": candidate[1][cand_index[order]],
+            "only_baseline": len(baseline[0]) - len(keys),
+            "only_candidate": len(candidate[0]) - len(keys)}
+
+
+def group_selection(sequences, exclude_pattern=ag.EXCLUDE_PATTERN, dynamic_pattern=ag.DYNAMIC_PATTERN):
+    """
+    Sequences averaged in the static, dynamic and overall groups, see aggregation.aggregate
+    :return: dict of group name to bool array (len(sequences),)
+    """
+    excluded = np.array([name.find(exclude_pattern) >= 0 for name in sequences], dtype=bool)
+    dynamic = np.array([name.find(dynamic_pattern) >= 0 for name in sequences], dtype=bool)
+    return {"static": ~excluded & ~dynamic, "dynamic": ~excluded & dynamic, "overall": ~excluded}
+
+
+def group_means(sequence_sums, selection):
+    """
+    Average the sequence means of the selected sequences
+    :param sequence_sums: (..., S, R, len(MEASURES)) summed measures of every sequence
+    :param selection: dict of group name to bool array (S,)
+    :return: dict of group name to means (..., R, len(COMPARE_MEASURES))
+    """
+    means = ag.sequence_means(sequence_sums)[..., :len(COMPARE_MEASURES)]
+    lead = means.shape[:-3]
+    flat = means.reshape((-1,) + means.shape[-3:])
+    return {group: ag.mean_over_sequences(flat, np.broadcast_to(selected, (len(flat), len(selected))))
+            .reshape(lead + means.shape[-2:]) for group, selected in selection.items()}
+
+
+def paired_bootstrap(aligned, selection, resamples=1000, seed=0):
+    """
+    Paired bootstrap of the differences of the group means. Frame pairs are drawn with replacement within every
+    sequence and the same draw is applied to both runs, so frame difficulty cancels out
+    :param aligned: dict returned by align
+    :param selection: dict returned by group_selection
+    :param resamples: number of bootstrap resamples
+    :param seed: seed of the resampling
+    :return: dict of group name to deltas (resamples, R, len(COMPARE_MEASURES)), candidate minus baseline
+    """
+    rng = np.random.default_rng(seed)
+    counts = aligned["counts"]
+    starts = aligned["starts"]
+    sequence = np.repeat(np.arange(len(counts)), counts)
+    stacked = np.stack([aligned["baseline"], aligned["candidate"]], axis=1)
+    chunk = max(1, BOOTSTRAP_CHUNK_BYTES // max(1, stacked.nbytes))
+    deltas = {group: list() for group in selection}
+    for first in range(0, resamples, chunk):
+        n = min(chunk, resamples - first)
+        index = starts[sequence] + (rng.random((n, len(sequence))) * counts[sequence]).astype(np.intp)
+        sequence_sums = np.add.reduceat(stacked[index], starts, axis=1)
+        # (n, S, 2, R, M) -> (n, 2, S, R, M)
+        means = group_means(np.moveaxis(sequence_sums, 2, 1), selection)
+        for group, value in means.items():
+            deltas[group].append(value[:, 1] - value[:, 0])
+    return {group: np.concatenate(value) for group, value in deltas.items()}
+
+
+def worst_frames(aligned, region_index, measure_index, count=10):
+    """
+    Frame pairs with the largest increase of a measure from baseline to candidate
+    :param aligned: dict returned by align
+    :param region_index: index of the region in the aligned values
+    :param measure_index: index of the measure in COMPARE_MEASURES
+    :param count: number of frame pairs
+    :return: list of (sequence, frame, baseline mean, candidate mean)
+    """
+    values = np.stack([aligned["baseline"], aligned["candidate"]])[:, :, region_index]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = values[..., measure_index] / values[..., -1]
+    delta = means[1] - means[0]
+    order = np.argsort(-np.where(np.isnan(delta), -np.inf, delta), kind="stable")[:count]
+    sequence = np.repeat(np.arange(len(aligned["counts"])), aligned["counts"])
+    return [(aligned["sequences"][sequence[f]], str(aligned["frames"][f]), float(means[0, f]), float(means[1, f]))
+            for f in order if not np.isnan(delta[f])]
+
+
+def compare(baseline, candidate, regions, resamples=1000, seed=0, alpha=0.05, region="Total", measure="ee",
+            worst=10):
+    """
+    Compare a candidate run with a baseline on the frame pairs evaluated in both
+    :param baseline: (keys, values) of the baseline, see frame_values
+    :param candidate: (keys, values) of the candidate
+    :param regions: regions of the values, see load_runs
+    :param resamples: number of paired bootstrap resamples, 0 skips the significance test
+    :param seed: seed of the bootstrap
+    :param alpha: the confidence intervals cover 1 - alpha
+    :param region: region of the worst regressed frames
+    :param measure: measure of the worst regressed frames, one of COMPARE_MEASURES
+    :param worst: number of worst regressed frames
+    :return: dict with
+        "sequences", "frames": aligned sequences and their number of frame pairs
+        "only_baseline", "only_candidate": number of frame pairs evaluated in one of the runs only
+        "sequence_baseline", "sequence_candidate": (S, R, len(COMPARE_MEASURES)) per-sequence means
+        "baseline", "candidate", "delta", "ci_low", "ci_high", "p_value": dicts of group name to
+        (R, len(COMPARE_MEASURES)), the interval and p-value of the delta from the paired bootstrap
+        "worst_frames": see worst_frames
+    """
+    aligned = align(baseline, candidate)
+    selection = group_selection(aligned["sequences"])
+    stacked = np.stack([aligned["baseline"], aligned["candidate"]])
+    if len(aligned["frames"]) > 0:
+        sequence_sums = np.add.reduceat(stacked, aligned["starts"], axis=1)
+    else:
+        sequence_sums = np.zeros((2, 0) + stacked.shape[2:])
+    sequence_means = ag.sequence_means(sequence_sums)[..., :len(COMPARE_MEASURES)]
+    means = group_means(sequence_sums, selection)
+    out = {"sequences": aligned["sequences"],
+           "frames": aligned["counts"].tolist(),
+           "only_baseline": aligned["only_baseline"],
+           "only_candidate": aligned["only_candidate"],
+           "sequence_baseline": sequence_means[0],
+           "sequence_candidate": sequence_means[1],
+           "baseline": {group: value[0] for group, value in means.items()},
+           "candidate": {group: value[1] for group, value in means.items()},
+           "delta": {group: value[1] - value[0] for group, value in means.items()}}
+
+    for key in ("ci_low", "ci_high", "p_value"):
+        out[key] = {group: np.full((len(regions), len(COMPARE_MEASURES)), np.nan) for group in GROUPS}
+    if resamples > 0 and len(aligned["frames"]) > 0:
+        for group, deltas in paired_bootstrap(aligned, selection, resamples, seed).items():
+            valid = np.sum(~np.isnan(deltas), axis=0)
+            if valid.max() == 0:
+                continue
+            with np.errstate(divide="ignore", invalid="ignore"), warnings.catch_warnings():
+                # regions without points in any resample stay nan
+                warnings.simplefilter("ignore", RuntimeWarning)
+                low, high = np.nanpercentile(deltas, (50 * alpha, 100 - 50 * alpha), axis=0)
+                # two-sided, share of resamples on the far side of zero
+                tail = np.minimum(np.sum(deltas <= 0, axis=0), np.sum(deltas >= 0, axis=0))
+                out["ci_low"][group], out["ci_high"][group] = low, high
+                out["p_value"][group] = np.minimum(1.0, 2.0 * tail / valid)
+    out["worst_frames"] = worst_frames(aligned, regions.index(region), COMPARE_MEASURES.index(measure), worst)
+    return out
+
+
+def is_regression(comparison, regions, region="Total", measure="ee", tolerance=0.0, group="overall"):
+    """
+    True if the candidate is significantly worse than the baseline, i.e. the whole confidence interval of the
+    delta lies above tolerance. All measures are errors, lower is better. Always False for a comparison without
+    the significance test (resamples 0), its interval is NaN
+    """
+    low = comparison["ci_low"][group][regions.index(region), COMPARE_MEASURES.index(measure)]
+    return bool(low > tolerance)
+
+
+def compare_runs(entries, regions, **kwargs):
+    """
+    Compare every entry with the first one
+    :param entries: list of (entry name, keys, values), see load_runs
+    :param kwargs: see compare
+    :return: list of (baseline name, candidate name, comparison)
+    """
+    name, keys, values = entries[0]
+    return [(name, other, compare((keys, values), (other_keys, other_values), regions, **kwargs))
+            for other, other_keys, other_values in entries[1:]]
+
+
+def comparison_table(comparisons, regions, region="Total", measure="ee"):
+    """
+    Text table of the group means with the bootstrap intervals of every region, the per-sequence deltas and the
+    worst regressed frame pairs of region and measure. Ratios R1, R2, R3 are given in percent
+    :param comparisons: list returned by compare_runs
+    """
+    m = COMPARE_MEASURES.index(measure)
+    r = regions.index(region)
+    scale = 1 if measure == "ee" else 100
+    lines = list()
+    for baseline, candidate, result in comparisons:
+        lines.append("{} -> {}: {} frame pairs aligned, {} only in {}, {} only in {}".format(
+            baseline, candidate, sum(result["frames"]), result["only_baseline"], baseline,
+            result["only_candidate"], candidate))
+        lines.append("{:<8} {:<8} {:<4} {:>10} {:>10} {:>10} {:>21} {:>7}".format(
+            "group", "region", "", "baseline", "candidate", "delta", "interval", "p"))
+        for group in GROUPS:
+            for i, name in enumerate(regions):
+                for k, measure_name in enumerate(COMPARE_MEASURES):
+                    if measure_name not in ("ee", "R2") and measure_name != measure:
+                        continue
+                    factor = 1 if measure_name == "ee" else 100
+                    # the interval of the delta excludes zero
+                    significant = result["ci_low"][group][i, k] > 0 or result["ci_high"][group][i, k] < 0
+                    lines.append("{:<8} {:<8} {:<4} {:>10.3f} {:>10.3f} {:>+10.3f} [{:>+9.3f}, {:>+9.3f}] "
+                                 "{:>7.3f}{}".format(group, name, measure_name,
+                                                     factor * result["baseline"][group][i, k],
+                                                     factor * result["candidate"][group][i, k],
+                                                     factor * result["delta"][group][i, k],
+                                                     factor * result["ci_low"][group][i, k],
+                                                     factor * result["ci_high"][group][i, k],
+                                                     result["p_value"][group][i, k], " *" if significant else ""))
+        lines.append("{:<24} {:>6} {:>10} {:>10} {:>10}   ({} {})".format(
+            "sequence", "frames", "baseline", "candidate", "delta", region, measure))
+        for s, sequence in enumerate(result["sequences"]):
+            base_value = scale * result["sequence_baseline"][s, r, m]
+            cand_value = scale * result["sequence_candidate"][s, r, m]
+            lines.append("{:<24} {:>6} {:>10.3f} {:>10.3f} {:>+10.3f}".format(
+                sequence, result["frames"][s], base_value, cand_value, cand_value - base_value))
+        if len(result["worst_frames"]) > 0:
+            lines.append("worst regressed frame pairs ({} {})".format(region, measure))
+            for sequence, frame, base_value, cand_value in result["worst_frames"]:
+                lines.append("{:<24} {:<16} {:>10.3f} {:>10.3f} {:>+10.3f}".format(
+                    sequence, frame, scale * base_value, scale * cand_value, scale * (cand_value - base_value)))
+        lines.append("")
+    return "\n".join(lines)
+
+
+def comparison_json(comparisons, regions):
+    """
+    JSON serializable dict of the comparisons, arrays are nested lists indexed [region][measure] and
+    [sequence][region][measure]
+    """
+    out = {"regions": list(regions), "measures": list(COMPARE_MEASURES), "groups": list(GROUPS),
+           "comparisons": list()}
+    for baseline, candidate, result in comparisons:
+        item = {"baseline": baseline, "candidate": candidate}
+        for key, value in result.items():
+            if isinstance(value, dict):
+                item[key] = {group: array.tolist() for group, array in value.items()}
+            elif isinstance(value, np.ndarray):
+                item[key] = value.tolist()
+            else:
+                item[key] = value
+        out["comparisons"].append(item)
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the per-frame results of several runs with the first "
+                                                 "one: per-sequence deltas, paired bootstrap significance and "
+                                                 "the worst regressed frame pairs.")
+    parser.add_argument("runs", nargs="+", type=parse_run, metavar="run",
+                        help="result file (.pb), result store or columnar table (.npz) as name=file or file. "
+                             "The first run is the baseline, files with several methods are split per method")
+    parser.add_argument("--region", default="Total", help="region of the per-sequence table, the worst frame "
+                                                         "pairs and the gate (default: %(default)s)")
+    parser.add_argument("--measure", choices=COMPARE_MEASURES, default="ee",
+                        help="measure of the per-sequence table, the worst frame pairs and the gate "
+                             "(default: %(default)s)")
+    parser.add_argument("--resamples", type=int, default=1000,
+                        help="paired bootstrap resamples, 0 skips the test (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the bootstrap (default: %(default)s)")
+    parser.add_argument("--alpha", type=float, default=0.05,
+                        help="the intervals cover 1 - alpha (default: %(default)s)")
+    parser.add_argument("--worst", type=int, default=10,
+                        help="number of worst regressed frame pairs (default: %(default)s)")
+    parser.add_argument("--json", default=None, help="optional JSON output of all comparisons")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="exit with status 1 if a run is significantly worse than the baseline in the overall "
+                             "mean of region and measure")
+    parser.add_argument("--tolerance", type=float, default=0.0,
+                        help="accepted increase of the measure before a run counts as regression, R1/R2/R3 as "
+                             "ratio (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    if not 0 < args.alpha < 1 or args.resamples < 0:
+        parser.error("alpha must be in (0, 1) and resamples >= 0")
+    if args.fail_on_regression and args.resamples == 0:
+        parser.error("--fail-on-regression needs the significance test, i.e. --resamples > 0")
+    regions, entries = load_runs(args.runs)
+    if len(entries) < 2:
+        parser.error("at least two runs or methods are needed")
+    if args.region not in regions:
+        parser.error("region '{}' is not in all runs, choose one of {}".format(args.region, ", ".join(regions)))
+    comparisons = compare_runs(entries, regions, resamples=args.resamples, seed=args.seed, alpha=args.alpha,
+                               region=args.region, measure=args.measure, worst=args.worst)
+    print(comparison_table(comparisons, regions, args.region, args.measure))
+
+    regressions = [candidate for _, candidate, result in comparisons
+                   if is_regression(result, regions, args.region, args.measure, args.tolerance)]
+    if args.json is not None:
+        out = comparison_json(comparisons, regions)
+        out["regressions"] = regressions
+        with open(args.json, "w") as f:
+            json.dump(out, f, indent=1)
+    if len(regressions) > 0:
+        print("Significant regression of {} {}: {}".format(args.region, args.measure, ", ".join(regressions)))
+        if args.fail_on_regression:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
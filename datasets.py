@@ -0,0 +1,296 @@
+# ---------------------------------------------------------------------
+# Copyright (c) 2018 TU Berlin, Communication Systems Group
+# Written by Tobias Senst <senst@nue.tu-berlin.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# ---------------------------------------------------------------------
+import abc
+import os
+import sys
+
+import numpy as np
+
+import file_parser as fp
+import util as ut
+
+# registered dataset plugins by name, see register_dataset
+DATASETS = dict()
+
+
+def register_dataset(cls):
+    """
+    Class decorator registering a dataset plugin under cls.name
+    """
+    DATASETS[cls.name] = cls
+    return cls
+
+
+def get_dataset(name):
+    """
+    Create the dataset plugin registered as name
+    """
+    if name not in DATASETS:
+        raise ValueError("Unknown dataset '{}', expected one of {}".format(name, ", ".join(sorted(DATASETS))))
+    return DATASETS[name]()
+
+
+class Dataset(fp.BaseParser):
+    """
+    Dataset plugin: the directory layout of a benchmark. A plugin indexes the frame pairs into a manifest
+    (file_parser.DatasetIndex), which is cached between runs. Ground truth flow and occlusion masks are read by
+    util.readFlowFiles and util.readMask, so all datasets are scored by the same batched metric path. Plugins have
+    to implement basepaths and build_index.
+    """
+    name = None
+    # image variants of the dataset, e.g. the rendering passes, the first one is the default
+    passes = ()
+
+    def split_path(self, root):
+        """
+        Path of the evaluated split below the dataset root
+        """
+        return os.path.join(root, "training", "")
+
+    @abc.abstractmethod
+    def basepaths(self, basepath, estimate_dir, image_pass):
+        """
+        Sub paths of the dataset, see file_parser.create_filename_list
+        :param basepath: path of the evaluated split, see split_path
+        :param estimate_dir: directory of the estimates of a method
+        :param image_pass: one of passes
+        """
+
+
+@register_dataset
+class SintelDataset(Dataset):
+    """
+    MPI-Sintel: <pass>/<sequence>/frame_XXXX.png, flow/<sequence>/frame_XXXX.flo and the occlusion masks
+    occlusions/<sequence>/frame_XXXX.png
+    """
+    name = "sintel"
+    passes = ("clean", "final")
+
+    def basepaths(self, basepath, estimate_dir, image_pass):
+        return {"basepath": basepath,
+                "images": basepath + image_pass + "/",
+                "gt_flow": basepath + "flow/",
+                "estimate": estimate_dir,
+                "masks": basepath + "occlusions/",
+                }
+
+    def build_index(self, basepaths):
+        return fp.build_index(basepaths)
+
+
+class FlatIndex(fp.DatasetIndex):
+    """
+    Index of a dataset keeping all frame pairs of a split in flat directories. File names are built from the
+    TEMPLATES of the layout, estimates are read from <estimate>/<sequence>.flopack instead if it exists
+    """
+    # filename dict key: (basepaths key, file name with {name} and {next_name}), None for files the dataset lacks
+    TEMPLATES = dict()
+
+    def filename_dicts(self):
+        basepaths = self.basepaths
+        filenames_dict = list()
+        for seq, name, next_name in zip(self.sequence_id, self.names, self.next_names):
+            dirs = str(self.sequences[seq])
+            name = str(name)
+            filename_dict = dict()
+            for key, template in self.TEMPLATES.items():
+                if template is None:
+                    filename_dict[key] = ""
+                elif template[0] in basepaths:
+                    filename_dict[key] = fp.join_path(basepaths[template[0]],
+                                                      template[1].format(name=name, next_name=str(next_name)))
+            if "estimate" in basepaths and self.packed[seq]:
+                filename_dict["estflow"] = ut.flow_pack_path(
+                    fp.join_path(basepaths["estimate"], dirs + ut.FLOW_PACK_EXTENSION), name)
+            filename_dict["dir"] = dirs
+            filename_dict["filename"] = name
+            filename_dict["basepath"] = basepaths["basepath"]
+            if "estimate" in basepaths:
+                filename_dict["estimatepath"] = fp.join_path(basepaths["estimate"], "")
+            filenames_dict.append(filename_dict)
+        return filenames_dict
+
+
+class FlatDataset(Dataset):
+    """
+    Base of the datasets with flat directories, all frame pairs form one sequence named after the dataset. Plugins
+    have to implement basepaths and frame_pairs
+    """
+    index_class = FlatIndex
+
+    @abc.abstractmethod
+    def frame_pairs(self, basepaths, dir_stamps):
+        """
+        Names of the frame pairs of the split
+        :param dir_stamps: dict the scanned paths and their modification times are added to
+        :return: (names, next names), names are the ground truth file names without extension
+        """
+
+    def build_index(self, basepaths, validate=True):
+        dir_stamps = dict()
+        names, next_names = self.frame_pairs(basepaths, dir_stamps)
+        sequence = self.name
+        packed = np.zeros(1, dtype=bool)
+        missing = list()
+        if "estimate" in basepaths and os.path.isdir(basepaths["estimate"]):
+            dir_stamps[basepaths["estimate"]] = os.stat(basepaths["estimate"]).st_mtime_ns
+        pack_filename = None
+        if "estimate" in basepaths and os.path.isfile(fp.join_path(basepaths["estimate"],
+                                                                   sequence + ut.FLOW_PACK_EXTENSION)):
+            packed[0] = True
+            pack_filename = fp.join_path(basepaths["estimate"], sequence + ut.FLOW_PACK_EXTENSION)
+            dir_stamps[pack_filename] = os.stat(pack_filename).st_mtime_ns
+
+        if validate:
+            index = self.index_class(basepaths, [sequence], np.zeros(len(names), dtype=np.int32), names, next_names,
+                                     packed=packed)
+            files = index.filename_dicts()
+            for key in ("gt_flow", "mask", "estflow"):
+                paths = [filename_dict[key] for filename_dict in files if len(filename_dict.get(key, "")) > 0]
+                if key == "estflow" and pack_filename is not None:
+                    pack_names = set(ut.readFlowPackHeader(pack_filename)[0])
+                    missing.extend(path for path, name in zip(paths, names) if name not in pack_names)
+                    continue
+                # one directory listing per tree instead of a stat per file
+                listings = dict()
+                for path in paths:
+                    directory, _, filename = path.rpartition("/")
+                    if directory not in listings:
+                        listings[directory] = fp.scan_dir(directory)[1]
+                        if os.path.isdir(directory):
+                            dir_stamps[directory] = os.stat(directory).st_mtime_ns
+                    if filename not in listings[directory]:
+                        missing.append(path)
+        return self.index_class(basepaths, [sequence], np.zeros(len(names), dtype=np.int32), names, next_names,
+                                missing, dir_stamps, packed)
+
+
+class KittiIndex(FlatIndex):
+    TEMPLATES = {"prevImg": ("images", "{name}.png"),
+                 "currImg": ("images", "{next_name}.png"),
+                 "gt_flow": ("gt_flow", "{name}.png"),
+                 "estflow": ("estimate", "{name}.flo"),
+                 "mask": ("masks", "{name}.png"),
+                 }
+
+
+@register_dataset
+class KittiDataset(FlatDataset):
+    """
+    KITTI 2012 / 2015 flow: <pass>/XXXXXX_10.png and XXXXXX_11.png, sparse 16-bit PNG ground truth of all pixels
+    flow_occ/XXXXXX_10.png and of the non-occluded pixels flow_noc/XXXXXX_10.png. Pixels without ground truth are
+    invalid, pixels with ground truth in flow_occ only are occluded (BG), all others FG. The pass selects the
+    image directory, image_2 of KITTI 2015 or colored_0 of KITTI 2012.
+    """
+    name = "kitti"
+    passes = ("image_2", "colored_0")
+    index_class = KittiIndex
+
+    def basepaths(self, basepath, estimate_dir, image_pass):
+        return {"basepath": basepath,
+                "images": basepath + image_pass + "/",
+                "gt_flow": basepath + "flow_occ/",
+                "estimate": estimate_dir,
+                "masks": basepath + "flow_noc/",
+                }
+
+    def frame_pairs(self, basepaths, dir_stamps):
+        files = fp.scan_dir(basepaths["images"])[1]
+        dir_stamps[basepaths["images"]] = os.stat(basepaths["images"]).st_mtime_ns
+        names = sorted(name[:-4] for name in files if name.endswith("_10.png"))
+        next_names = [name[:-3] + "_11" for name in names]
+        pairs = [(name, next_name) for name, next_name in zip(names, next_names) if next_name + ".png" in files]
+        return [name for name, _ in pairs], [next_name for _, next_name in pairs]
+
+
+class ChairsIndex(FlatIndex):
+    TEMPLATES = {"prevImg": ("images", "{name}_img1.ppm"),
+                 "currImg": ("images", "{next_name}_img2.ppm"),
+                 "gt_flow": ("gt_flow", "{name}_flow.flo"),
+                 "estflow": ("estimate", "{name}_flow.flo"),
+                 "mask": None,
+                 }
+
+
+@register_dataset
+class ChairsDataset(FlatDataset):
+    """
+    FlyingChairs: data/XXXXX_img1.ppm, data/XXXXX_img2.ppm and data/XXXXX_flow.flo. The dataset has no occlusion
+    masks, all valid pixels are FG. The pass selects the split of FlyingChairs_train_val.txt (1 train, 2 val)
+    or all frame pairs.
+    """
+    name = "chairs"
+    passes = ("val", "train", "all")
+    index_class = ChairsIndex
+    SPLIT_FILENAME = "FlyingChairs_train_val.txt"
+    SPLIT_LABELS = {"train": 1, "val": 2}
+
+    def split_path(self, root):
+        return os.path.join(root, "")
+
+    def basepaths(self, basepath, estimate_dir, image_pass):
+        return {"basepath": basepath,
+                "images": basepath + "data/",
+                "gt_flow": basepath + "data/",
+                "estimate": estimate_dir,
+                "split": image_pass,
+                }
+
+    def frame_pairs(self, basepaths, dir_stamps):
+        files = fp.scan_dir(basepaths["images"])[1]
+        dir_stamps[basepaths["images"]] = os.stat(basepaths["images"]).st_mtime_ns
+        names = np.array(sorted((name[:-len("_img1.ppm")] for name in files if name.endswith("_img1.ppm")),
+                                key=fp.frame_number), dtype=np.str_)
+        split = basepaths.get("split", "all")
+        if split != "all":
+            split_filename = basepaths["basepath"] + self.SPLIT_FILENAME
+            if not os.path.exists(split_filename):
+                raise ValueError("Split {} needs {}".format(split, split_filename))
+            dir_stamps[split_filename] = os.stat(split_filename).st_mtime_ns
+            # one label per frame pair, in the order of the frame numbers starting at 1
+            labels = np.loadtxt(split_filename, dtype=np.int32, ndmin=1)
+            numbers = np.array([fp.frame_number(name) for name in names], dtype=np.int64)
+            known = (numbers >= 1) & (numbers <= len(labels))
+            selected = np.zeros(len(names), dtype=bool)
+            selected[known] = labels[numbers[known] - 1] == self.SPLIT_LABELS[split]
+            names = names[selected]
+        return list(names), list(names)
+
+
+def main(argv=None):
+    """
+    Build the manifest of a dataset, e.g. to check the layout: python datasets.py dataset root [pass] [manifest]
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) < 2:
+        print("Usage: python datasets.py {} root [pass] [manifest.npz]".format("|".join(sorted(DATASETS))))
+        return 1
+    dataset = get_dataset(argv[0])
+    image_pass = argv[2] if len(argv) > 2 else dataset.passes[0]
+    basepaths = dataset.basepaths(dataset.split_path(argv[1]), "", image_pass)
+    del basepaths["estimate"]
+    dataset.parsefilenames(basepaths, argv[3] if len(argv) > 3 else None)
+    print("{} {}: {} frame pairs in {} sequences".format(dataset.name, image_pass, len(dataset.index),
+                                                         len(dataset.index.sequences)))
+    if len(dataset.index.missing) > 0:
+        print("Missing {} files, e.g. {}".format(len(dataset.index.missing), dataset.index.missing[0]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
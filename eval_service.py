@@ -0,0 +1,347 @@
+# ---------------------------------------------------------------------
+# Copyright (c) 2018 TU Berlin, Communication Systems Group
+# Written by Tobias Senst <senst@nue.tu-berlin.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# ---------------------------------------------------------------------
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import itertools
+import json
+import os
+import socket
+
+import aggregation as ag
+import file_parser as fp
+import opticalflow_evaluate as oe
+import result_store as rs
+import util as ut
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# priority of submissions found in the inbox, lower values are evaluated first
+INBOX_PRIORITY = 10
+
+
+class Submission:
+    """
+    Estimate directory of one method queued for evaluation
+    """
+
+    def __init__(self, submission_id, name, directory, priority=0):
+        self.submission_id = submission_id
+        self.name = name
+        self.directory = directory
+        self.priority = priority
+        self.state = "queued"
+        self.total = 0
+        self.skipped = 0
+        self.scored = 0
+        self.error = None
+
+    def status(self):
+        return {"id": self.submission_id, "name": self.name, "directory": self.directory,
+                "priority": self.priority, "state": self.state, "total": self.total, "skipped": self.skipped,
+                "scored": self.scored, "error": self.error}
+
+
+def directory_signature(directory):
+    """
+    Number of entries and latest modification time of an estimate directory and its sequence directories, used to
+    detect directories that are still being written
+    """
+    stamps = list()
+    for path in [directory] + [os.path.join(directory, name) for name in fp.scan_dir(directory)[0]]:
+        with os.scandir(path) as it:
+            stamps.extend(entry.stat().st_mtime_ns for entry in it)
+    return len(stamps), max(stamps, default=0)
+
+
+class EvaluationService:
+    """
+    Long-running evaluator. Estimate directories are submitted over a localhost JSON-line socket or dropped into an
+    inbox directory, queued by priority and scored by a bounded pool of threads. The ground truth stays warm in
+    the in-memory cache between submissions and every scored batch is published to the result store at once.
+    """
+
+    def __init__(self, basepath, store_filename, gt_cache_dir=None, gt_cache_bytes=2 ** 30, num_workers=2,
+                 batch_size=8, image_pass="clean", index_dir=None, inbox_dir=None, poll_interval=5.0,
+                 extended=False, dataset="sintel"):
+        """
+        :param basepath: path to the evaluated split, e.g. .../MPI-Sintel/training/, see datasets.Dataset.split_path
+        :param store_filename: result store the results are published to, see result_store
+        :param gt_cache_dir: optional on-disk label store shared with opticalflow_evaluate
+        :param gt_cache_bytes: memory budget of the warm ground truth
+        :param num_workers: number of submissions scored concurrently
+        :param batch_size: number of frame pairs scored and published at once
+        :param image_pass: image variant of the dataset, e.g. the rendering pass "clean" or "final" of MPI-Sintel
+        :param index_dir: optional directory caching the dataset index between runs
+        :param inbox_dir: optional directory watched for estimate directories, each sub directory is a method
+        :param poll_interval: seconds between two scans of the inbox, a directory is submitted once it did not
+        change between two scans
+        :param extended: also compute the regions of util.EXTENDED_REGIONS
+        :param dataset: name of the dataset plugin, see datasets
+        """
+        self.basepath = basepath
+        self.store = rs.ResultStore(store_filename)
+        self.gt_cache_dir = gt_cache_dir
+        self.gt_cache_bytes = gt_cache_bytes
+        self.num_workers = max(1, num_workers)
+        self.batch_size = batch_size
+        self.image_pass = image_pass
+        self.index_dir = index_dir
+        self.inbox_dir = inbox_dir
+        self.poll_interval = poll_interval
+        self.extended = extended
+        self.dataset = dataset
+        self.submissions = collections.OrderedDict()
+        self.ids = itertools.count(1)
+        self.inbox_seen = dict()
+        self.inbox_submitted = dict()
+        self.queue = None
+        self.stopped = None
+        self.executor = None
+        # open client connections, closed on shutdown: handler task -> stream writer
+        self.clients = dict()
+
+    def submit(self, name, directory, priority=0):
+        """
+        Queue an estimate directory, must be called from the event loop
+        :return: Submission
+        """
+        submission = Submission(next(self.ids), name, directory, priority)
+        self.submissions[submission.submission_id] = submission
+        self.queue.put_nowait((priority, submission.submission_id, submission))
+        return submission
+
+    def pending_jobs(self, submission):
+        """
+        Jobs of a submission and those not yet in the result store, runs in the thread pool
+        :return: (all jobs, pending jobs, dict of (parameter index, file_index) to result key)
+        """
+        jobs = oe.create_jobs(self.basepath, "", [{"flow_method": submission.name}], self.index_dir,
+                              self.image_pass, {submission.name: submission.directory}, self.dataset)
+        keys = {(n, config_item["file_index"]): rs.result_key(config_item,
+                                                             rs.file_digest(config_item["files"]["estflow"]))
+                for n, config_item in jobs}
+        pending = list()
+        for n, config_item in jobs:
+            key = keys[(n, config_item["file_index"])]
+            if key not in self.store or (self.extended and ut.EXTENDED_REGIONS[0] not in self.store.get(key)[1]):
+                pending.append((n, config_item))
+        return jobs, pending, keys
+
+    async def evaluate(self, submission):
+        loop = asyncio.get_running_loop()
+        jobs, pending, keys = await loop.run_in_executor(self.executor, self.pending_jobs, submission)
+        submission.total = len(jobs)
+        submission.skipped = len(jobs) - len(pending)
+        for batch in oe.create_chunks(pending, 1, self.batch_size):
+            scored = await loop.run_in_executor(self.executor, oe.run_batches, batch, self.batch_size)
+            for n, config_item, result in scored:
+                self.store.append(keys[(n, config_item["file_index"])], config_item, result)
+            submission.scored += len(scored)
+
+    async def worker(self):
+        while True:
+            _, _, submission = await self.queue.get()
+            submission.state = "running"
+            try:
+                await self.evaluate(submission)
+                submission.state = "done"
+            except Exception as e:
+                submission.state = "failed"
+                submission.error = "{}: {}".format(type(e).__name__, e)
+            finally:
+                self.queue.task_done()
+
+    def scan_inbox(self):
+        """
+        Signatures of all estimate directories in the inbox, runs in the thread pool
+        """
+        signatures = dict()
+        for name in fp.scan_dir(self.inbox_dir)[0]:
+            try:
+                signatures[name] = directory_signature(os.path.join(self.inbox_dir, name))
+            except FileNotFoundError:
+                pass  # removed while scanning
+        return signatures
+
+    async def watch_inbox(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            signatures = await loop.run_in_executor(self.executor, self.scan_inbox)
+            for name, signature in signatures.items():
+                # submit directories that did not change since the last scan, again whenever they change
+                if self.inbox_seen.get(name) == signature and self.inbox_submitted.get(name) != signature:
+                    self.inbox_submitted[name] = signature
+                    self.submit(name, os.path.join(self.inbox_dir, name), INBOX_PRIORITY)
+            self.inbox_seen = signatures
+            await asyncio.sleep(self.poll_interval)
+
+    def results(self, names=None):
+        """
+        Mean EPE and R1-R3 of the Total region over all sequences of the methods in the result store
+        :param names: optional method names as submitted, all methods if None
+        """
+        results = self.store.results()
+        if len(results) == 0:
+            return dict()
+        result = ag.aggregate_results(results)
+        total = result["regions"].index("Total")
+        methods = None if names is None else {ut.parameter_to_string({"flow_method": name}) for name in names}
+        out = dict()
+        for m, method in enumerate(result["methods"]):
+            if result["evaluated"][m] and (methods is None or method in methods):
+                out[method] = {measure: float(result["overall"][m, total, k])
+                               for k, measure in enumerate(ut.MEASURES[:-1])}
+        return out
+
+    def status(self):
+        cache = oe.gt_cache
+        return {"queued": self.queue.qsize(),
+                "submissions": [submission.status() for submission in self.submissions.values()],
+                "stored": len(self.store),
+                "gt_cache": {"hits": cache.hits, "disk_hits": cache.disk_hits, "misses": cache.misses,
+                             "bytes": cache.used_bytes}}
+
+    def handle_request(self, request):
+        command = request.get("cmd")
+        if command == "submit":
+            if "dir" not in request:
+                raise ValueError("submit needs a dir")
+            directory = os.path.abspath(request["dir"])
+            if not os.path.isdir(directory):
+                raise ValueError("{} is not a directory".format(directory))
+            name = request.get("name") or os.path.basename(os.path.normpath(directory))
+            submission = self.submit(name, directory, int(request.get("priority", 0)))
+            return {"ok": True, "submission": submission.status()}
+        if command == "status":
+            return dict(ok=True, **self.status())
+        if command == "results":
+            return {"ok": True, "results": self.results(request.get("names"))}
+        if command == "shutdown":
+            self.stopped.set()
+            return {"ok": True}
+        raise ValueError("unknown command {}".format(command))
+
+    async def handle_client(self, reader, writer):
+        self.clients[asyncio.current_task()] = writer
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    response = self.handle_request(json.loads(line.decode("utf-8")))
+                except Exception as e:
+                    response = {"ok": False, "error": "{}: {}".format(type(e).__name__, e)}
+                writer.write((json.dumps(response) + "\n").encode("utf-8"))
+                await writer.drain()
+        except (asyncio.CancelledError, ConnectionError):
+            pass  # the client disconnected or the service shuts down
+        finally:
+            del self.clients[asyncio.current_task()]
+            writer.close()
+
+    async def run(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        """
+        Serve until a shutdown request, submissions still queued are dropped
+        """
+        self.queue = asyncio.PriorityQueue()
+        self.stopped = asyncio.Event()
+        oe.init_worker(self.gt_cache_dir, self.gt_cache_bytes, extended=self.extended, warm_gt=True)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.num_workers)
+        tasks = [asyncio.ensure_future(self.worker()) for _ in range(self.num_workers)]
+        if self.inbox_dir is not None:
+            os.makedirs(self.inbox_dir, exist_ok=True)
+            tasks.append(asyncio.ensure_future(self.watch_inbox()))
+        server = await asyncio.start_server(self.handle_client, host, port)
+        print("Evaluation service listening on {}:{}".format(host, port))
+        try:
+            await self.stopped.wait()
+        finally:
+            server.close()
+            # end the connections of idle clients, their handlers then see the end of the stream
+            clients = list(self.clients.items())
+            for _, writer in clients:
+                writer.close()
+            await asyncio.gather(*[task for task, _ in clients], return_exceptions=True)
+            await server.wait_closed()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.executor.shutdown(wait=True)
+            self.store.close()
+
+
+def request(message, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=60):
+    """
+    Send one request to a running service and return its response
+    :param message: dict, e.g. {"cmd": "submit", "dir": ..., "name": ..., "priority": 0}
+    """
+    with socket.create_connection((host, port), timeout=timeout) as connection:
+        connection.sendall((json.dumps(message) + "\n").encode("utf-8"))
+        with connection.makefile("rb") as f:
+            return json.loads(f.readline().decode("utf-8"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Long-running evaluation service and its client.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="run the service")
+    oe.add_dataset_arguments(serve)
+    serve.add_argument("--store", default="short_term_results.jsonl",
+                       help="result store the results are published to (default: %(default)s)")
+    serve.add_argument("--inbox", default=None, help="directory watched for estimate directories")
+    serve.add_argument("--poll", type=float, default=5.0, help="seconds between two scans of the inbox")
+    serve.add_argument("--workers", type=int, default=2, help="submissions scored concurrently")
+    serve.add_argument("--batch-size", type=int, default=8, help="frame pairs scored and published at once")
+    serve.add_argument("--gt-cache", default=None, help="directory of the preprocessed ground truth cache")
+    serve.add_argument("--gt-cache-mb", type=int, default=1024, help="memory budget of the warm ground truth")
+    serve.add_argument("--index-dir", default=None, help="directory caching the dataset index between runs")
+    serve.add_argument("--extended", action="store_true",
+                       help="also evaluate the matched/unmatched, speed and boundary distance regions")
+    submit = commands.add_parser("submit", help="queue an estimate directory")
+    submit.add_argument("dir")
+    submit.add_argument("--name", default=None, help="method name, the directory name by default")
+    submit.add_argument("--priority", type=int, default=0, help="lower values are evaluated first")
+    commands.add_parser("status", help="print the queue and the progress of all submissions")
+    results = commands.add_parser("results", help="print the mean errors of the evaluated methods")
+    results.add_argument("names", nargs="*")
+    commands.add_parser("shutdown", help="stop the service")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        _, basepath, image_pass = oe.parse_dataset(serve, args)
+        service = EvaluationService(basepath, args.store, args.gt_cache, args.gt_cache_mb * 2 ** 20, args.workers,
+                                    args.batch_size, image_pass, args.index_dir, args.inbox, args.poll,
+                                    args.extended, args.dataset_name)
+        asyncio.run(service.run(args.host, args.port))
+        return
+
+    message = {"cmd": args.command}
+    if args.command == "submit":
+        message.update({"dir": os.path.abspath(args.dir), "name": args.name, "priority": args.priority})
+    elif args.command == "results":
+        message["names"] = args.names or None
+    print(json.dumps(request(message, args.host, args.port), indent=1))
+
+
+if __name__ == '__main__':
+    main()
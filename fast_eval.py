@@ -0,0 +1,239 @@
+# ---------------------------------------------------------------------
+# Copyright (c) 2018 TU Berlin, Communication Systems Group
+# Written by Tobias Senst <senst@nue.tu-berlin.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# ---------------------------------------------------------------------
+import functools
+import json
+
+import numpy as np
+
+import aggregation as ag
+import result_table as rt
+import util as ut
+
+# two-sided 95% quantile of the normal distribution
+Z_95 = 1.959963984540054
+
+# stride: every stride-th row and column is kept
+# fraction: share of the (strided) columns kept per row, chosen at random with seed. The same pixels are sampled
+#   in every frame, so results do not depend on the evaluation order
+# frame_step: every frame_step-th frame pair of a sequence is evaluated
+# roi: optional (y0, y1, x0, x1) crop applied before sampling
+DEFAULT_SAMPLING = {"stride": 1, "fraction": 1.0, "seed": 0, "frame_step": 1, "roi": None}
+
+CI_MEASURES = ("ee", "R1", "R2", "R3")
+
+# entry of a sampled result holding the block sums of the confidence intervals, removed before results are saved
+BLOCKS_KEY = "blocks"
+
+
+@functools.lru_cache(maxsize=16)
+def sample_index(h, w, stride=1, fraction=1.0, seed=0):
+    """
+    Index of the sampled pixels of a (h, w) image
+    :return: numpy index selecting a (rows, columns) grid of pixels, e.g. flow[index] has shape (rows, columns, 2)
+    """
+    if fraction >= 1:
+        return slice(None, None, stride), slice(None, None, stride)
+    rows = np.arange(0, h, stride)
+    columns = np.arange(0, w, stride)
+    k = max(1, int(round(fraction * len(columns))))
+    rng = np.random.default_rng(seed)
+    picked = np.sort(np.argsort(rng.random((len(rows), len(columns))), axis=1)[:, :k], axis=1)
+    return rows[:, None], columns[picked]
+
+
+def select_frames(jobs, frame_step=1):
+    """
+    Keep every frame_step-th frame pair of every method and sequence
+    :param jobs: list of (parameter index, config_item), see opticalflow_evaluate.create_jobs
+    """
+    position = dict()
+    selected = list()
+    for n, config_item in jobs:
+        key = (n, config_item["files"].get("dir"))
+        if position.get(key, 0) % max(1, frame_step) == 0:
+            selected.append((n, config_item))
+        position[key] = position.get(key, 0) + 1
+    return selected
+
+
+def run_parameter(config_item, sampling=None):
+    """
+    Score the sampled pixels of a frame pair, the approximate counterpart of opticalflow_evaluate.run_parameter
+    :param sampling: dict with the keys of DEFAULT_SAMPLING
+    :return: (config_item, result), result holds the sums over the sampled pixels in the layout of
+    util.compute_error and under BLOCKS_KEY the per-block sums of util.compute_block_sums used for the confidence
+    intervals, see split_blocks
+    """
+    sampling = dict(DEFAULT_SAMPLING, **(sampling or {}))
+    roi = sampling["roi"]
+    files = config_item["files"]
+    flow_gt = ut.readFlowFiles(files["gt_flow"])
+    est_flow = ut.readFlowFiles(files["estflow"], roi=roi)
+    mask_rgb = ut.readMask(files["mask"], flow_gt.shape[:2])
+    if roi is not None:
+        flow_gt = flow_gt[roi[0]:roi[1], roi[2]:roi[3]]
+        mask_rgb = mask_rgb[roi[0]:roi[1], roi[2]:roi[3]]
+
+    index = sample_index(flow_gt.shape[0], flow_gt.shape[1], sampling["stride"], sampling["fraction"],
+                         sampling["seed"])
+    flow_gt = np.asarray(flow_gt[index])
+    labels = ut.compute_labels(flow_gt, np.ascontiguousarray(mask_rgb[index]))
+    ee = ut.compute_ee(np.asarray(est_flow[index]), flow_gt)
+    ee_sums, counts = ut.compute_block_sums(ee[None], labels[None])
+    result = ut.error_sums_to_dict(ut.reduce_block_sums(ee_sums, counts)[0])
+    result[BLOCKS_KEY] = {"ee_sums": ee_sums[0], "counts": counts[0]}
+    return config_item, result
+
+
+def split_blocks(result_list):
+    """
+    Remove the block sums from the results of a sampled evaluation
+    :param result_list: list of (config_item, result) of run_parameter
+    :return: list of (config_item, result, block_sums) as used by confidence_intervals
+    """
+    scored = list()
+    for config_item, result in result_list:
+        blocks = result.pop(BLOCKS_KEY)
+        scored.append((config_item, result, (blocks["ee_sums"], blocks["counts"])))
+    return scored
+
+
+def block_measures(ee_sums, counts):
+    """
+    Per block sums of ee, R1, R2, R3 and number of points of every region
+    :param ee_sums: (blocks, 3) ee sums, see util.compute_block_sums
+    :param counts: (blocks, 3, len(THRESHOLDS) + 1) counts
+    :return: sums (blocks, len(REGIONS), len(CI_MEASURES)) and points (blocks, len(REGIONS))
+    """
+    sums = np.zeros((len(ee_sums), len(ut.REGIONS), len(CI_MEASURES)), dtype=np.float64)
+    points = np.zeros((len(ee_sums), len(ut.REGIONS)), dtype=np.float64)
+    sums[:, :2, 0] = ee_sums[:, :2]
+    for k in range(len(ut.THRESHOLDS)):
+        sums[:, :2, k + 1] = counts[:, :2, k + 1:].sum(axis=2)
+    points[:, :2] = counts[:, :2].sum(axis=2)
+    sums[:, 2] = sums[:, 0] + sums[:, 1]
+    points[:, 2] = points[:, 0] + points[:, 1]
+    return sums, points
+
+
+def ratio_variance(sums, points):
+    """
+    Linearized variance of the ratio estimator sums.sum() / points.sum() with the blocks as sampled clusters
+    :param sums: (blocks, ...) sums of a measure
+    :param points: (blocks, ...) number of points
+    :return: variance (...), nan for less than two blocks with points
+    """
+    total = points.sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = sums.sum(axis=0) / total
+        residuals = sums - ratio * points
+        clusters = (points > 0).sum(axis=0)
+        return (residuals ** 2).sum(axis=0) / total ** 2 * clusters / (clusters - 1)
+
+
+def confidence_intervals(scored, z=Z_95):
+    """
+    Approximate confidence intervals of the aggregated means of a sampled evaluation. Every sequence mean is a
+    ratio estimator over blocks of BLOCK_ROWS sampled rows, sequences are treated as independent.
+    :param scored: list of (config_item, result, block_sums), see split_blocks
+    :param z: normal quantile of the interval
+    :return: aggregate() of the sampled results with the additional entries "static_ci", "dynamic_ci" and
+    "overall_ci": (M, R, len(CI_MEASURES)) half widths
+    """
+    result = ag.aggregate(rt.table_from_results([(config_item, res) for config_item, res, _ in scored]))
+    methods = {name: m for m, name in enumerate(result["methods"])}
+    sequences = {name: s for s, name in enumerate(result["sequences"])}
+    regions = [ut.REGIONS.index(region) for region in result["regions"]]
+
+    groups = dict()
+    for config_item, _, (ee_sums, counts) in scored:
+        key = (methods[ut.parameter_to_string(config_item["parameter"])],
+               sequences[config_item["files"].get("dir", "None")])
+        groups.setdefault(key, list()).append(block_measures(ee_sums, counts))
+
+    variance = np.full((len(methods), len(sequences), len(regions), len(CI_MEASURES)), np.nan)
+    for (m, s), blocks in groups.items():
+        sums = np.concatenate([item[0] for item in blocks])[:, regions]
+        points = np.concatenate([item[1] for item in blocks])[:, regions]
+        variance[m, s] = ratio_variance(sums, points[:, :, None])
+
+    excluded = np.array([name.find(ag.EXCLUDE_PATTERN) >= 0 for name in result["sequences"]], dtype=bool)
+    dynamic = np.array([name.find(ag.DYNAMIC_PATTERN) >= 0 for name in result["sequences"]], dtype=bool)
+    present = (result["frames"] > 0) & ~excluded
+    for group, selected in (("static", present & ~dynamic), ("dynamic", present & dynamic), ("overall", present)):
+        count = selected.sum(axis=1).reshape(-1, 1, 1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            result[group + "_ci"] = z * np.sqrt(ag.mean_over_sequences(variance, selected) / count)
+    return result
+
+
+def compare_table(sampled, full=None):
+    """
+    Text table of the sampled means with confidence intervals and, if given, the means of the full evaluation
+    :param sampled: dict returned by confidence_intervals
+    :param full: optional aggregate() of the full evaluation
+    """
+    lines = ["{:<20} {:<8} {:<6} {:<4} {:>10} {:>10} {:>10} {:>6}".format(
+        "method", "group", "region", "", "estimate", "+-95%", "full", "in CI")]
+    for m, method in enumerate(sampled["methods"]):
+        if not sampled["evaluated"][m]:
+            continue
+        fm = None
+        if full is not None and method in full["methods"]:
+            fm = full["methods"].index(method)
+        for group in ("static", "dynamic", "overall"):
+            for r, region in enumerate(sampled["regions"]):
+                for k, measure in enumerate(CI_MEASURES):
+                    scale = 1 if measure == "ee" else 100
+                    estimate = scale * sampled[group][m, r, k]
+                    half_width = scale * sampled[group + "_ci"][m, r, k]
+                    full_str, inside_str = "", ""
+                    if fm is not None:
+                        full_value = scale * full[group][fm, full["regions"].index(region), k]
+                        full_str = "{:.3f}".format(full_value)
+                        inside_str = "yes" if abs(full_value - estimate) <= half_width else "no"
+                    lines.append("{:<20} {:<8} {:<6} {:<4} {:>10.3f} {:>10.3f} {:>10} {:>6}".format(
+                        method, group, region, measure, estimate, half_width, full_str, inside_str))
+    return "\n".join(lines)
+
+
+def write_intervals(scored, sampling, full_filename=None, ci_filename=None):
+    """
+    Print the sampled means with their confidence intervals and optionally write them as JSON
+    :param scored: list of (config_item, result, block_sums), see split_blocks
+    :param sampling: dict with the keys of DEFAULT_SAMPLING
+    :param full_filename: optional results of a full evaluation the estimates are compared against
+    :param ci_filename: optional JSON output of the means and confidence intervals
+    :return: confidence interval table string
+    """
+    sampled = confidence_intervals(scored)
+    full = ag.aggregate_file(full_filename) if full_filename is not None else None
+    ci_str = compare_table(sampled, full)
+    print(ci_str)
+    if ci_filename is not None:
+        with open(ci_filename, "w") as f:
+            json.dump({"sampling": sampling,
+                       "frames": len(scored),
+                       "methods": sampled["methods"],
+                       "regions": sampled["regions"],
+                       "measures": list(CI_MEASURES),
+                       **{key: sampled[key][..., :len(CI_MEASURES)].tolist() for key in ("static", "dynamic",
+                                                                                         "overall")},
+                       **{key + "_ci": sampled[key + "_ci"].tolist() for key in ("static", "dynamic", "overall")}},
+                      f, indent=1)
+    return ci_str
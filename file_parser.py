@@ -15,66 +15,254 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 # ---------------------------------------------------------------------
-import glob
+import abc
 import os
 
+import numpy as np
 
-class BaseParser:
+import util as ut
+
+INDEX_KEYS = ("images", "gt_flow", "estimate", "masks")
+
+
+def join_path(prefix, *parts):
+    """
+    Join path components with forward slashes, independent of a trailing slash of prefix
+    """
+    return prefix.rstrip("/\\") + "/" + "/".join(parts)
+
+
+def scan_dir(path):
+    """
+    List the sub directories and files of path with a single os.scandir call
+    :return: (sorted directory names, set of file names), both empty if path does not exist
+    """
+    dirs = list()
+    files = set()
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir():
+                    dirs.append(entry.name)
+                else:
+                    files.add(entry.name)
+    except FileNotFoundError:
+        pass
+    return sorted(dirs), files
+
+
+def frame_number(name):
     """
-    Base class
+    Trailing number of a frame name, e.g. 1 for frame_0001, -1 if there is none
     """
+    digits = len(name) - len(name.rstrip("0123456789"))
+    return int(name[-digits:]) if digits > 0 else -1
+
+
+class DatasetIndex:
+    """
+    Structure-of-arrays index of all frame pairs of a dataset. Every pair is described by a sequence id and the
+    names of its first and second image, paths are built from the per-tree prefixes in basepaths. The estimates of
+    a packed sequence are read from the flow container <estimate>/<sequence>.flopack instead of .flo files.
+    """
+
+    def __init__(self, basepaths, sequences, sequence_id, names, next_names, missing=(), dir_stamps=None,
+                 packed=None):
+        self.basepaths = dict(basepaths)
+        self.sequences = np.asarray(sequences, dtype=np.str_)
+        self.sequence_id = np.asarray(sequence_id, dtype=np.int32)
+        self.names = np.asarray(names, dtype=np.str_)
+        self.next_names = np.asarray(next_names, dtype=np.str_)
+        self.frame = np.array([frame_number(name) for name in self.names], dtype=np.int32)
+        self.missing = list(missing)
+        self.dir_stamps = dict() if dir_stamps is None else dict(dir_stamps)
+        self.packed = np.zeros(len(self.sequences), dtype=bool) if packed is None else np.asarray(packed, dtype=bool)
+
+    def __len__(self):
+        return len(self.sequence_id)
+
+    def filename_dicts(self):
+        """
+        Return the list of filename dicts as created by MyParser, see create_filename_list
+        """
+        filenames_dict = list()
+        basepaths = self.basepaths
+        for seq, name, next_name in zip(self.sequence_id, self.names, self.next_names):
+            dirs = str(self.sequences[seq])
+            name = str(name)
+            filename_dict = dict()
+            filename_dict["prevImg"] = join_path(basepaths["images"], dirs, name + ".png")
+            filename_dict["currImg"] = join_path(basepaths["images"], dirs, str(next_name) + ".png")
+            if "gt_flow" in basepaths:
+                filename_dict["gt_flow"] = join_path(basepaths["gt_flow"], dirs, name + ".flo")
+            if "estimate" in basepaths and self.packed[seq]:
+                filename_dict["estflow"] = ut.flow_pack_path(
+                    join_path(basepaths["estimate"], dirs + ut.FLOW_PACK_EXTENSION), name)
+            elif "estimate" in basepaths:
+                filename_dict["estflow"] = join_path(basepaths["estimate"], dirs, name + ".flo")
+            if "masks" in basepaths:
+                filename_dict["mask"] = join_path(basepaths["masks"], dirs, name + ".png")
+
+            filename_dict["dir"] = dirs  # 连续多帧图像所在的文件夹
+            filename_dict["filename"] = name  # 当前两帧所对应光流文件的名称
+            filename_dict["basepath"] = basepaths["basepath"]
+            if "estimate" in basepaths:
+                filename_dict["estimatepath"] = join_path(basepaths["estimate"], dirs, "")
+            filenames_dict.append(filename_dict)
+        return filenames_dict
+
+    def is_current(self, basepaths):
+        """
+        True if the index was built for basepaths and no scanned directory changed since
+        """
+        if self.basepaths != dict(basepaths):
+            return False
+        for path, stamp in self.dir_stamps.items():
+            try:
+                if os.stat(path).st_mtime_ns != stamp:
+                    return False
+            except FileNotFoundError:
+                return False
+        return True
+
+    def save(self, filename):
+        """
+        Write the index as .npz file
+        """
+        keys = sorted(self.basepaths.keys())
+        dirs = sorted(self.dir_stamps.keys())
+        np.savez(filename,
+                 basepath_keys=np.array(keys, dtype=np.str_),
+                 basepath_values=np.array([self.basepaths[key] for key in keys], dtype=np.str_),
+                 sequences=self.sequences,
+                 sequence_id=self.sequence_id,
+                 names=self.names,
+                 next_names=self.next_names,
+                 missing=np.array(self.missing, dtype=np.str_),
+                 stamp_dirs=np.array(dirs, dtype=np.str_),
+                 stamp_values=np.array([self.dir_stamps[path] for path in dirs], dtype=np.int64),
+                 packed=self.packed)
+
+
+def load_index(filename, index_class=DatasetIndex):
+    """
+    Load an index written by DatasetIndex.save
+    :param index_class: DatasetIndex or a subclass of the dataset layout, see datasets
+    """
+    with np.load(filename, allow_pickle=False) as data:
+        basepaths = {str(key): str(value) for key, value in zip(data["basepath_keys"], data["basepath_values"])}
+        dir_stamps = {str(path): int(stamp) for path, stamp in zip(data["stamp_dirs"], data["stamp_values"])}
+        packed = data["packed"] if "packed" in data.files else None
+        return index_class(basepaths, data["sequences"], data["sequence_id"], data["names"], data["next_names"],
+                            [str(path) for path in data["missing"]], dir_stamps, packed)
+
+
+def build_index(basepaths, validate=True):
+    """
+    Scan the image, flow, occlusion and estimate trees once and index all pairs of consecutive images. Estimates
+    of a sequence without estimate directory are read from <estimate>/<sequence>.flopack if it exists.
+    :param basepaths: a dictionary containing sub path, see create_filename_list
+    :param validate: check that the ground truth, estimate and mask of every pair exist
+    :return: DatasetIndex, missing files are listed in DatasetIndex.missing
+    """
+    sequences, files = scan_dir(basepaths["images"])
+    dir_stamps = {basepaths["images"]: os.stat(basepaths["images"]).st_mtime_ns}
+    sequence_id = list()
+    names = list()
+    next_names = list()
+    missing = list()
+    packed = np.zeros(len(sequences), dtype=bool)
+    estimate_files = set()
+    if "estimate" in basepaths and os.path.isdir(basepaths["estimate"]):
+        estimate_files = scan_dir(basepaths["estimate"])[1]
+        dir_stamps[basepaths["estimate"]] = os.stat(basepaths["estimate"]).st_mtime_ns
+    for seq, dirs in enumerate(sequences):
+        seq_path = join_path(basepaths["images"], dirs)
+        image_names = sorted(name[:-4] for name in scan_dir(seq_path)[1] if name.endswith(".png"))
+        dir_stamps[seq_path] = os.stat(seq_path).st_mtime_ns
+        pair_names = image_names[:-1]  # 获取连续的两帧，计算光流也是如此
+        sequence_id.extend([seq] * len(pair_names))
+        names.extend(pair_names)
+        next_names.extend(image_names[1:])
+
+        pack_filename = None
+        if "estimate" in basepaths and dirs + ut.FLOW_PACK_EXTENSION in estimate_files \
+                and not os.path.isdir(join_path(basepaths["estimate"], dirs)):
+            packed[seq] = True
+            pack_filename = join_path(basepaths["estimate"], dirs + ut.FLOW_PACK_EXTENSION)
+            dir_stamps[pack_filename] = os.stat(pack_filename).st_mtime_ns
+
+        if not validate:
+            continue
+        for key, extension in (("gt_flow", ".flo"), ("estimate", ".flo"), ("masks", ".png")):
+            if key not in basepaths:
+                continue
+            if key == "estimate" and pack_filename is not None:
+                pack_names = set(ut.readFlowPackHeader(pack_filename)[0])
+                missing.extend(ut.flow_pack_path(pack_filename, name) for name in pair_names
+                               if name not in pack_names)
+                continue
+            path = join_path(basepaths[key], dirs)
+            existing = scan_dir(path)[1]
+            if os.path.isdir(path):
+                dir_stamps[path] = os.stat(path).st_mtime_ns
+            missing.extend(join_path(path, name + extension) for name in pair_names
+                           if name + extension not in existing)
+
+    return DatasetIndex(basepaths, sequences, sequence_id, names, next_names, missing, dir_stamps, packed)
+
+
+class BaseParser(abc.ABC):
+    """
+    Base class of the dataset parsers. A parser scans the layout of a dataset once into a DatasetIndex, which is
+    cached between runs. Parsers have to implement build_index
+    """
+    # class of the index built by build_index, used to load a cached index
+    index_class = DatasetIndex
 
     def __init__(self):
         self.filenames_dict = list()
+        self.index = None
+
+    @abc.abstractmethod
+    def build_index(self, basepaths):
+        """
+        Scan the dataset
+        :param basepaths: a dictionary containing sub path, see create_filename_list
+        :return: index_class instance
+        """
+
+    def parsefilenames(self, basepaths, index_filename=None):
+        """
+        Index the dataset, reusing the index stored in index_filename if it is still current
+        """
+        self.index = None
+        if index_filename is not None and os.path.exists(index_filename):
+            self.index = load_index(index_filename, self.index_class)
+            if not self.index.is_current(basepaths):
+                self.index = None
+        if self.index is None:
+            self.index = self.build_index(basepaths)
+            if index_filename is not None:
+                self.index.save(index_filename)
+        self.filenames_dict = self.index.filename_dicts()
 
 
 class MyParser(BaseParser):
     """
-    Derived class
+    Parser of the MPI-Sintel layout
     """
 
-    def __init__(self):
-        BaseParser.__init__(self)
-
-    def parsefilenames(self, basepaths):
-        self.filenames_dict = []
-        for dirpath, dirnames, filenames in os.walk(basepaths["images"]):
-            for dirs in dirnames:
-                image_paths = glob.glob(r"{}/*.png".format(dirpath + dirs))
-                image_paths = sorted(image_paths)  # assume filenames are sortable
-
-                # 将路径中的双反斜杠转化为单正斜杠
-                for index, value in enumerate(image_paths):
-                    image_paths[index] = value.replace("\\", "/")
-                iterable_curr = image_paths[1:]  # 获取连续的两帧，计算光流也是如此
-                iterable_pre = image_paths[:len(image_paths) - 1]
-                image_pairs = list(zip(iterable_pre, iterable_curr))
-
-                for image_pair in image_pairs:
-                    filename_dict = dict()
-                    filename_dict["prevImg"] = image_pair[0]
-                    filename_dict["currImg"] = image_pair[1]
-                    filename_base = os.path.relpath(filename_dict["prevImg"], dirpath + dirs)  # 获取相对路径
-                    filename_base = os.path.splitext(filename_base)[0]  # 分离文件名与扩展名
-
-                    if "gt_flow" in basepaths:
-                        filename_dict["gt_flow"] = basepaths["gt_flow"] + dirs + "/" + filename_base + ".flo"
-                    if "estimate" in basepaths:
-                        filename_dict["estflow"] = basepaths["estimate"] + dirs + "/" + filename_base + ".flo"
-                    if "masks" in basepaths:
-                        filename_dict["mask"] = basepaths["masks"] + dirs + "/" + filename_base + ".png"
-
-                    filename_dict["dir"] = dirs  # 连续多帧图像所在的文件夹
-                    filename_dict["filename"] = filename_base  # 当前两帧所对应光流文件的名称
-                    filename_dict["basepath"] = basepaths["basepath"]
-                    filename_dict["estimatepath"] = basepaths["estimate"] + dirs + "/"
-                    self.filenames_dict.append(filename_dict)
-
-
-def create_filename_list(basepath):
+    def build_index(self, basepaths):
+        return build_index(basepaths)
+
+
+def create_filename_list(basepath, index_filename=None, parser=None):
     """
     Create a list of dictionaries containing file-paths for the optical flow dataset
     :param basepath: basepath: a dictionary containing sub path.
+    :param index_filename: optional .npz file caching the dataset index between runs
+    :param parser: parser of the dataset layout, MyParser (MPI-Sintel) if None, see datasets
     :return: filenames_dict
     filename_dict[0]:
         preImg: 'D:/PythonProject/MPI-Sintel/MPI-Sintel/training/clean/alley_1/frame_0001.png'
@@ -87,6 +275,8 @@ def create_filename_list(basepath):
         basepath: 'D:/PythonProject/MPI-Sintel/MPI-Sintel/training/'
         estimatepath 'D:/PythonProject/MPI-Sintel/MPI-Sintel/estimate/ACPM/alley_1/'
     """
-    fileparser = MyParser()
-    fileparser.parsefilenames(basepath)
+    fileparser = MyParser() if parser is None else parser
+    fileparser.parsefilenames(basepath, index_filename)
+    if len(fileparser.index.missing) > 0:
+        print("Missing {} files, e.g. {}".format(len(fileparser.index.missing), fileparser.index.missing[0]))
     return fileparser.filenames_dict
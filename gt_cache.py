@@ -0,0 +1,125 @@
+# ---------------------------------------------------------------------
+# Copyright (c) 2018 TU Berlin, Communication Systems Group
+# Written by Tobias Senst <senst@nue.tu-berlin.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# ---------------------------------------------------------------------
+import collections
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+import util as ut
+
+
+def file_stamp(*filenames):
+    """
+    Short hash of modification time and size of the given files, used to detect stale cache entries. Empty
+    filenames, e.g. of datasets without occlusion masks, are skipped
+    """
+    key = hashlib.md5()
+    for filename in filenames:
+        if len(filename) == 0:
+            continue
+        st = os.stat(filename)
+        key.update("{}:{}:{};".format(filename, st.st_mtime_ns, st.st_size).encode("utf-8"))
+    return key.hexdigest()[:16]
+
+
+class GTCache:
+    """
+    Cache of the preprocessed ground truth of a frame pair (flow and region label image). Label images are
+    stored once as uint8 .npy files below cache_dir, which can be memory-mapped by every worker and every
+    later run. Recently used frames are additionally kept in memory up to max_bytes. An extended cache stores the
+    labels of util.compute_extended_labels, so the boundary distance transform runs once per frame.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=512 * 2 ** 20, extended=False):
+        self.cache_dir = cache_dir
+        self.extended = extended
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def label_filename(self, sequence, frame, stamp):
+        return os.path.join(self.cache_dir, sequence, "{}.{}{}.npy".format(frame, stamp, ".ext" if self.extended else ""))
+
+    def load_labels(self, sequence, frame, stamp, mask_filename, gt_flow):
+        if self.cache_dir is not None:
+            filename = self.label_filename(sequence, frame, stamp)
+            if os.path.exists(filename):
+                self.disk_hits += 1
+                return np.load(filename, mmap_mode="r")
+        self.misses += 1
+        if self.extended:
+            labels = ut.compute_extended_labels(gt_flow, ut.readMask(mask_filename, gt_flow.shape[:2]))
+        else:
+            labels = ut.compute_labels(gt_flow, ut.readMask(mask_filename, gt_flow.shape[:2]))
+        if self.cache_dir is not None:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            # write to a temporary file first, parallel workers may store the same frame
+            tmp_filename = "{}.{}.{}.tmp".format(filename, os.getpid(), threading.get_ident())
+            with open(tmp_filename, "wb") as f:
+                np.save(f, labels)
+            os.replace(tmp_filename, filename)
+        return labels
+
+    def get(self, sequence, frame, gt_filename, mask_filename):
+        """
+        Return the ground truth of a frame pair
+        :param sequence: sequence name, e.g. alley_1
+        :param frame: frame name, e.g. frame_0001
+        :param gt_filename: path to the ground truth .flo file
+        :param mask_filename: path to the occlusion mask
+        :return: (gt_flow, labels), see util.compute_labels and util.compute_extended_labels
+        """
+        # the stamp is part of the key, so a ground truth rewritten while the process runs is read again
+        stamp = file_stamp(gt_filename, mask_filename)
+        key = (sequence, frame, gt_filename, mask_filename, stamp)
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+
+        gt_flow = np.array(ut.readFlowFiles(gt_filename))
+        labels = np.array(self.load_labels(sequence, frame, stamp, mask_filename, gt_flow))
+        entry = (gt_flow, labels)
+        nbytes = gt_flow.nbytes + labels.nbytes
+        with self.lock:
+            if nbytes <= self.max_bytes and key not in self.entries:
+                self.entries[key] = entry
+                self.used_bytes += nbytes
+                while self.used_bytes > self.max_bytes:
+                    old_gt_flow, old_labels = self.entries.popitem(last=False)[1]
+                    self.used_bytes -= old_gt_flow.nbytes + old_labels.nbytes
+        return entry
+
+    def get_config(self, config_item):
+        """
+        Return the ground truth of the frame pair described by config_item, see util.create_config
+        """
+        files = config_item["files"]
+        return self.get(files.get("dir", "None"), files["filename"], files["gt_flow"], files["mask"])
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.used_bytes = 0
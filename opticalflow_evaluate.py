@@ -15,90 +15,709 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 # ---------------------------------------------------------------------
+import argparse
 import copy
+import functools
+import hashlib
+import math
+import multiprocessing
+import os
 import pickle
+import re
+import sys
+import tracemalloc
 
-import cv2
-import progressbar
+import numpy as np
 
+import datasets as ds
+import fast_eval as fe
 import file_parser as fp
+import gt_cache as gc
+import prefetch as pf
+import profiling as pr
+import report as rp
+import result_store as rs
+import result_table as rt
 import util as ut
 
 
+# default output names without extension, a sampled evaluation never overwrites the results of a full one
+RESULT_NAME = "short_term_results"
+SAMPLED_RESULT_NAME = "short_term_results.sampled"
+
+
+# ground truth cache of the current process, see init_worker
+gt_cache = None
+# compute the regions of util.EXTENDED_REGIONS, see init_worker
+extended_metrics = False
+# memory budget of the tiled evaluation of a frame pair, None loads whole frames, see init_worker
+tile_bytes = None
+# largest traced memory of a frame pair scored by run_tiled in this process, see init_worker
+tile_peak_bytes = 0
+# pixel sampling of the approximate evaluation, None scores all pixels, see init_worker
+pixel_sampling = None
+
+
+def init_worker(gt_cache_dir=None, gt_cache_bytes=512 * 2 ** 20, profile=False, extended=False, warm_gt=False,
+                max_memory=None, sampling=None):
+    """
+    Set up the ground truth cache of the calling process, also used as process pool initializer
+    :param gt_cache_dir: directory of the on-disk label store, None disables the ground truth cache
+    :param gt_cache_bytes: memory budget of the in-process LRU layer
+    :param profile: record per-stage measurements, see profiling
+    :param extended: also compute the matched/unmatched, speed and boundary distance regions
+    :param warm_gt: keep the ground truth in memory even without gt_cache_dir, e.g. in a long-running process
+    :param max_memory: memory budget in bytes per frame pair, if set frames are memory-mapped and scored in row
+    bands (see util.compute_error_tiled) and the ground truth cache is disabled
+    :param sampling: optional dict with the keys of fast_eval.DEFAULT_SAMPLING, if set only the sampled pixels are
+    scored (see fast_eval.run_parameter) and the ground truth cache is disabled
+    """
+    global gt_cache, extended_metrics, tile_bytes, tile_peak_bytes, pixel_sampling
+    use_cache = (gt_cache_dir is not None or warm_gt) and max_memory is None and sampling is None
+    gt_cache = gc.GTCache(gt_cache_dir, gt_cache_bytes, extended) if use_cache else None
+    extended_metrics = extended
+    tile_bytes = max_memory
+    tile_peak_bytes = 0
+    pixel_sampling = sampling
+    pr.enable(profile)
+
+
+def init_pool_worker(*args):
+    """
+    Process pool initializer, see init_worker. Events inherited from the parent process are dropped
+    """
+    init_worker(*args)
+    pr.profiler.take_events()
+
+
+def read_flow(filename, stage_name):
+    """
+    Read a .flo file into memory, measured as stage stage_name
+    """
+    with pr.stage(stage_name, file=filename) as event:
+        flow = np.array(ut.readFlowFiles(filename))
+        event.read(flow.nbytes + ut.FLOW_HEADER_SIZE)
+        event.alloc(flow)
+    return flow
+
+
+def read_mask(filename, shape=None):
+    """
+    Read an occlusion mask, see util.readMask, measured as stage read_mask
+    :param shape: (h, w) of the frame, used for datasets without occlusion masks
+    """
+    with pr.stage("read_mask", file=filename) as event:
+        mask_rgb = ut.readMask(filename, shape)
+        if len(filename) > 0:
+            event.read(os.path.getsize(filename))
+            event.alloc(mask_rgb)
+    return mask_rgb
+
+
+def read_gt_cache(config_item):
+    with pr.stage("gt_cache", sequence=config_item["files"].get("dir"), frame=config_item["files"]["filename"]):
+        return gt_cache.get_config(config_item)
+
+
 def run_parameter(config_item):
-    result = dict()
-    result["ee"] = 0
-    result["R1"] = 0
-    result["R2"] = 0
-    result["R3"] = 0
-    result["no_points"] = 0
+    if gt_cache is not None:
+        # load ground truth optical flow and region labels from the cache
+        flow_gt, labels = read_gt_cache(config_item)
+        est_flow = read_flow(config_item["files"]["estflow"], "read_estimate")
+        with pr.stage("compute_error", sequence=config_item["files"].get("dir"), frames=1):
+            return (config_item, ut.compute_error_labels(est_flow, flow_gt, labels, extended_metrics))
+
     # load ground truth optical flow
-    flow_gt = ut.readFlowFiles(config_item["files"]["gt_flow"])
+    flow_gt = read_flow(config_item["files"]["gt_flow"], "read_gt")
     # load ground truth mask indicating foreground and background flow vectors
-    mask_rgb = cv2.imread(config_item["files"]["mask"])
+    mask_rgb = read_mask(config_item["files"]["mask"], flow_gt.shape[:2])
     #  load estimated optical flow
-    est_flow = ut.readFlowFiles(config_item["files"]["estflow"])
+    est_flow = read_flow(config_item["files"]["estflow"], "read_estimate")
     # compute short term errors
-    result = ut.compute_error(est_flow, flow_gt, mask_rgb)
+    with pr.stage("compute_error", sequence=config_item["files"].get("dir"), frames=1):
+        if extended_metrics:
+            result = ut.compute_error_extended(est_flow, flow_gt, mask_rgb)
+        else:
+            result = ut.compute_error(est_flow, flow_gt, mask_rgb)
 
     return (config_item, result)
 
 
-def main():
-    # if len(sys.argv) < 2:
-    #     print("Please provide the first argument that is the root path of the CrowdFlow dataset.")
-    #     return
-    # basepath = sys.argv[1]
-    #
-    # parameter_list = list()
-    #
-    # for n in range(2, len(sys.argv)):
-    #     parameter_list.append({"flow_method": "/" + sys.argv[n] + "/"})
+def run_tiled(config_item):
+    """
+    Score a frame pair in row bands within the memory budget tile_bytes. Ground truth and estimate are
+    memory-mapped, only the mask is read as a whole. The memory allocated for the frame pair is traced and its
+    peak kept in tile_peak_bytes
+    :return: (config_item, result)
+    """
+    global tile_peak_bytes
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    start_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    flow_gt = ut.readFlowFiles(config_item["files"]["gt_flow"])
+    mask_rgb = read_mask(config_item["files"]["mask"], flow_gt.shape[:2])
+    est_flow = ut.readFlowFiles(config_item["files"]["estflow"])
+    with pr.stage("compute_error", sequence=config_item["files"].get("dir"), frames=1):
+        sums = ut.compute_error_tiled(est_flow, flow_gt, mask_rgb, tile_bytes, extended_metrics)
+    del mask_rgb
+    tile_peak_bytes = max(tile_peak_bytes, tracemalloc.get_traced_memory()[1] - start_bytes)
+    if not tracing:
+        tracemalloc.stop()
+    return config_item, ut.error_sums_to_dict(sums)
+
 
-    basepath = "D:/PythonProject/MPI-Sintel/MPI-Sintel/training/"
-    estpath = "D:/PythonProject/MPI-Sintel/MPI-Sintel/estimate/"
+def read_ground_truth(config_item):
+    """
+    Read the ground truth flow and mask of a frame pair and compute its region labels
+    :return: (flow_gt, labels), see util.compute_labels
+    """
+    flow_gt = read_flow(config_item["files"]["gt_flow"], "read_gt")
+    mask_rgb = read_mask(config_item["files"]["mask"], flow_gt.shape[:2])
+    with pr.stage("labels", sequence=config_item["files"].get("dir"), frame=config_item["files"]["filename"]) as event:
+        if extended_metrics:
+            labels = ut.compute_extended_labels(flow_gt, mask_rgb)
+        else:
+            labels = ut.compute_labels(flow_gt, mask_rgb)
+        event.alloc(labels)
+    return flow_gt, labels
 
-    parameter_list = list()
-    parameter_list.append({"flow_method": "ACPM"})
 
-    latex_filename = "short_term_results.tex"
-    result_filename = "short_term_results.pb"
+def load_pairs(config_items):
+    """
+    Read estimates and ground truth of several frame pairs into memory. The ground truth of a frame pair evaluated
+    for several methods is read only once. Frames of different size, e.g. of KITTI, are padded to the largest
+    one with invalid ground truth, which leaves the sums of the FG and BG regions unchanged.
+    :param config_items: list of config_item
+    :return: (est_flow, flow_gt, labels, gt_index), gt_index maps every estimate to its ground truth
+    """
+    est_list = [read_flow(config_item["files"]["estflow"], "read_estimate") for config_item in config_items]
+    gt_keys = dict()
+    gt_items = list()
+    gt_index = list()
+    for config_item in config_items:
+        key = (config_item["files"]["gt_flow"], config_item["files"]["mask"])
+        if key not in gt_keys:
+            gt_keys[key] = len(gt_items)
+            gt_items.append(config_item)
+        gt_index.append(gt_keys[key])
+
+    if gt_cache is not None:
+        gt_list = [read_gt_cache(config_item) for config_item in gt_items]
+    else:
+        gt_list = [read_ground_truth(config_item) for config_item in gt_items]
+    for config_item, est, index in zip(config_items, est_list, gt_index):
+        if est.shape != gt_list[index][0].shape:
+            raise ValueError("Estimate {} has shape {}, expected {}".format(
+                config_item["files"]["estflow"], est.shape, gt_list[index][0].shape))
+    est_flow = ut.stack_padded(est_list)
+    flow_gt = ut.stack_padded([item[0] for item in gt_list], ut.UNKNOWN_FLOW)
+    labels = ut.stack_padded([item[1] for item in gt_list], ut.LABEL_INVALID)
+    return est_flow, flow_gt, labels, np.array(gt_index, dtype=np.intp)
+
+
+def score_pairs(config_items, pairs):
+    """
+    Score frame pairs loaded by load_pairs with the batched metric kernel
+    :return: list of (config_item, result)
+    """
+    est_flow, flow_gt, labels, gt_index = pairs
+    with pr.stage("compute_error", sequence=config_items[0]["files"].get("dir"), frames=len(config_items)):
+        sums = ut.compute_error_batch(est_flow, flow_gt, labels=labels, gt_index=gt_index, extended=extended_metrics)
+    return [(config_item, ut.error_sums_to_dict(sums[i])) for i, config_item in enumerate(config_items)]
+
+
+def run_sequence(config_items):
+    """
+    Evaluate several frame pairs of one sequence with a single call of the batched metric kernel
+    :param config_items: list of config_item of the same sequence and resolution
+    :return: list of (config_item, result)
+    """
+    return score_pairs(config_items, load_pairs(config_items))
+
+
+def split_batches(chunk, batch_size):
+    """
+    Split frame-major sorted jobs into batches holding all methods of up to batch_size consecutive frame pairs
+    """
+    batches = list()
+    frames = set()
+    for n, config_item in chunk:
+        if len(batches) == 0 or (len(frames) >= max(1, batch_size) and config_item["file_index"] not in frames):
+            batches.append(list())
+            frames = set()
+        frames.add(config_item["file_index"])
+        batches[-1].append((n, config_item))
+    return batches
+
+
+def run_batches(chunk, batch_size, prefetch_depth=0, prefetch_bytes=512 * 2 ** 20):
+    """
+    Evaluate a chunk of (parameter index, config_item) jobs, batch_size frame pairs per call. All methods of a
+    frame pair are scored together, so its ground truth is loaded once.
+    :param chunk: list of (parameter index, config_item) sorted by file_index
+    :param batch_size: number of frame pairs evaluated per call of the metric kernel
+    :param prefetch_depth: number of batches read ahead by background threads, 0 reads synchronously
+    :param prefetch_bytes: memory cap of the batches read ahead
+    :return: list of (parameter index, config_item, result)
+    """
+    if pixel_sampling is not None:
+        # one frame pair at a time, the sampled pixels are read from memory-mapped files
+        return [(n, config_item, fe.run_parameter(config_item, pixel_sampling)[1]) for n, config_item in chunk]
+    if tile_bytes is not None:
+        # one frame pair at a time, reading ahead would exceed the memory budget
+        return [(n, config_item, run_tiled(config_item)[1]) for n, config_item in chunk]
+    batches = split_batches(chunk, batch_size)
+    config_batches = [[config_item for n, config_item in batch] for batch in batches]
+    if prefetch_depth > 0:
+        loaded = pf.prefetch(load_pairs, config_batches, prefetch_depth, min(prefetch_depth, 4), prefetch_bytes)
+    else:
+        loaded = (load_pairs(config_items) for config_items in config_batches)
+    scored_batches = (score_pairs(config_items, pairs) for config_items, pairs in zip(config_batches, loaded))
+
+    out = list()
+    for batch, scored in zip(batches, scored_batches):
+        out.extend((n, config_item, result) for (n, _), (config_item, result) in zip(batch, scored))
+    return out
+
+
+def run_chunk(chunk, batch_size=1, prefetch_depth=0, prefetch_bytes=512 * 2 ** 20):
+    """
+    Score a chunk of jobs inside a worker process
+    :param chunk: list of (parameter index, config_item) tuples belonging to one sequence
+    :param batch_size: number of frame pairs evaluated per call of the metric kernel
+    :param prefetch_depth: number of batches read ahead, see run_batches
+    :param prefetch_bytes: memory cap of the batches read ahead
+    :return: list of (parameter index, file_index, result)
+    """
+    return [(n, config_item["file_index"], result)
+            for n, config_item, result in run_batches(chunk, batch_size, prefetch_depth, prefetch_bytes)]
+
+
+def run_worker_chunk(chunk, **kwargs):
+    """
+    Same as run_chunk, additionally returns the profiling events recorded by the worker process and its traced
+    peak memory of the tiled evaluation
+    :return: (list of (parameter index, file_index, result), list of events, tile_peak_bytes)
+    """
+    return run_chunk(chunk, **kwargs), pr.profiler.take_events(), tile_peak_bytes
+
 
+def create_chunks(jobs, num_workers, chunk_size=None):
+    """
+    Split the frame-major job list into chunks that never cross a sequence boundary, so a worker keeps reading
+    from the same directory and neighbouring frames stay in the page cache. All methods of a frame pair end up
+    in the same chunk.
+    :param jobs: list of (parameter index, config_item) tuples sorted by file_index
+    :param num_workers: number of worker processes
+    :param chunk_size: maximal number of jobs per chunk, chosen automatically if None
+    :return: list of chunks
+    """
+    if chunk_size is None:
+        chunk_size = max(1, int(math.ceil(len(jobs) / float(4 * max(1, num_workers)))))
+
+    chunks = list()
+    chunk = list()
+    chunk_key = None
+    for n, config_item in jobs:
+        key = config_item["files"].get("dir")
+        if len(chunk) > 0 and (key != chunk_key or (len(chunk) >= chunk_size
+                                                    and config_item["file_index"] != chunk[-1][1]["file_index"])):
+            chunks.append(chunk)
+            chunk = list()
+        chunk_key = key
+        chunk.append((n, config_item))
+    if len(chunk) > 0:
+        chunks.append(chunk)
+    return chunks
+
+
+def merge_result(result):
+    """
+    Rebuild a result dict received from a worker. Keys are re-interned so the pickled output shares the same
+    string objects as the serial path and is therefore byte-identical
+    """
+    return {sys.intern(key): {sys.intern(key1): value for key1, value in item.items()}
+            for key, item in result.items()}
+
+
+def run_jobs(jobs, num_workers=1, chunk_size=None, bar=None, batch_size=1, gt_cache_dir=None, on_result=None,
+             prefetch_depth=0, prefetch_bytes=512 * 2 ** 20, extended=False, max_memory=None, sampling=None):
+    """
+    Evaluate all (config_item, method) jobs either serially or with a process pool
+    :param jobs: list of (parameter index, config_item) tuples
+    :param num_workers: number of worker processes, <= 1 runs in the calling process
+    :param chunk_size: maximal number of jobs per chunk sent to a worker
+    :param bar: optional progressbar
+    :param batch_size: number of frame pairs of a sequence evaluated per call of the metric kernel
+    :param gt_cache_dir: directory of the ground truth cache, None disables it
+    :param on_result: optional callback on_result(parameter index, config_item, result), called as soon as a
+    frame pair is scored
+    :param prefetch_depth: number of batches read ahead by background threads while the current one is scored
+    :param prefetch_bytes: memory cap of the batches read ahead
+    :param extended: also compute the regions of util.EXTENDED_REGIONS
+    :param max_memory: optional memory budget in bytes per frame pair, see init_worker
+    :param sampling: optional pixel sampling, see init_worker
+    :return: list of (config_item, result) in (parameter index, file_index) order. With max_memory,
+    tile_peak_bytes afterwards holds the largest traced peak of a frame pair over all processes
+    """
+    global tile_peak_bytes
+    # frame-major order, all methods of a frame pair are scored while its ground truth is loaded
+    jobs = sorted(jobs, key=lambda job: (job[1]["file_index"], job[0]))
     result_list = list()
-    bar = progressbar.ProgressBar()
+    if num_workers <= 1:
+        init_worker(gt_cache_dir, profile=pr.profiler.enabled, extended=extended, max_memory=max_memory,
+                    sampling=sampling)
+        scored = list()
+        # whole sequences, so reading ahead continues across batches
+        for chunk in create_chunks(jobs, 1, len(jobs)):
+            for n, config_item, result in run_batches(chunk, batch_size, prefetch_depth, prefetch_bytes):
+                scored.append((n, config_item, result))
+                if on_result is not None:
+                    on_result(n, config_item, result)
+                if bar is not None:
+                    bar.update(len(scored))
+        scored.sort(key=lambda item: (item[0], item[1]["file_index"]))
+        for n, config_item, result in scored:
+            result_list.append(copy.deepcopy((config_item, result)))
+        return result_list
+
+    config_dict = {(n, config_item["file_index"]): config_item for n, config_item in jobs}
+    scored = list()
+    tile_peak_bytes = 0
+    chunks = create_chunks(jobs, num_workers, chunk_size)
+    init_args = (gt_cache_dir, 512 * 2 ** 20, pr.profiler.enabled, extended, False, max_memory, sampling)
+    with multiprocessing.Pool(processes=num_workers, initializer=init_pool_worker, initargs=init_args) as pool:
+        worker = functools.partial(run_worker_chunk, batch_size=batch_size, prefetch_depth=prefetch_depth,
+                                   prefetch_bytes=prefetch_bytes)
+        for chunk_result, events, peak_bytes in pool.imap_unordered(worker, chunks):
+            pr.profiler.extend(events)
+            tile_peak_bytes = max(tile_peak_bytes, peak_bytes)
+            scored.extend(chunk_result)
+            if on_result is not None:
+                for n, file_index, result in chunk_result:
+                    on_result(n, config_dict[(n, file_index)], merge_result(result))
+            if bar is not None:
+                bar.update(len(scored))
+
+    # merge back in deterministic order, independent of the worker scheduling
+    scored.sort(key=lambda item: (item[0], item[1]))
+    for n, file_index, result in scored:
+        result_list.append(copy.deepcopy((config_dict[(n, file_index)], merge_result(result))))
+    return result_list
+
 
+def index_filename(index_dir, method, variant):
+    """
+    File of the cached dataset index of a method. Characters of the method name that are not safe in a file name,
+    e.g. path separators of a name=directory argument, are replaced and a hash of the name keeps the file unique
+    """
+    name = re.sub(r"[^\w.\-]", "_", method)
+    if name != method:
+        name = "{}.{}".format(name, hashlib.md5(method.encode("utf-8")).hexdigest()[:8])
+    return os.path.join(index_dir, "{}.{}.index.npz".format(name, variant))
+
+
+def create_jobs(basepath, estpath, parameter_list, index_dir=None, image_pass="clean", estimate_dirs=None,
+                dataset="sintel"):
+    """
+    Create the list of (parameter index, config_item) jobs for all methods
+    :param index_dir: optional directory caching the dataset index of every method between runs
+    :param image_pass: image variant of the dataset, e.g. the rendering pass "clean" or "final" of MPI-Sintel
+    :param estimate_dirs: optional dict of method name to estimate directory, defaults to estpath + method name
+    :param dataset: name of the dataset plugin, see datasets
+    """
+    plugin = ds.get_dataset(dataset)
+    jobs = list()
     for n, parameter in enumerate(parameter_list):
-        basepath_dict = {"basepath": basepath,
-                         "images": basepath + "clean/",
-                         "gt_flow": basepath + "flow/",
-                         "estimate": estpath + parameter["flow_method"] + "/",
-                         "masks": basepath + "occlusions/",
-                         }
-
-        filenames = fp.create_filename_list(basepath_dict)
-        config_list = ut.create_config(parameter, filenames)
-
-        bar.start(max_value=len(config_list) * len(parameter_list))
-        for c, config_item in enumerate(config_list):
-            result = run_parameter(config_item)
-            result_list.append(copy.deepcopy(result))
-            bar.update(c + n * len(config_list))
+        if estimate_dirs is not None and parameter["flow_method"] in estimate_dirs:
+            estimate_dir = os.path.join(estimate_dirs[parameter["flow_method"]], "")
+        else:
+            estimate_dir = estpath + parameter["flow_method"] + "/"
+        basepath_dict = plugin.basepaths(basepath, estimate_dir, image_pass)
+
+        method_index = None
+        if index_dir is not None:
+            os.makedirs(index_dir, exist_ok=True)
+            variant = image_pass if dataset == "sintel" else "{}.{}".format(dataset, image_pass)
+            method_index = index_filename(index_dir, parameter["flow_method"], variant)
+        with pr.stage("parse", method=parameter["flow_method"]):
+            filenames = fp.create_filename_list(basepath_dict, method_index, plugin)
+            config_list = ut.create_config(parameter, filenames)
+        jobs.extend((n, config_item) for config_item in config_list)
+    return jobs
+
+
+def evaluate(basepath, estpath, parameter_list, result_filename, latex_filename="", num_workers=1, chunk_size=None,
+             batch_size=1, gt_cache_dir=None, store_filename=None, table_filename=None, prefetch_depth=0,
+             prefetch_bytes=512 * 2 ** 20, index_dir=None, profile_filename=None, image_pass="clean",
+             estimate_dirs=None, extended=False, max_memory=None, dataset="sintel", sampling=None,
+             full_filename=None, ci_filename=None):
+    """
+    Evaluate all methods of parameter_list and write the pickled results and the latex table. All methods are
+    scored against a ground truth frame while it is loaded, so every ground truth and mask is read once per run
+    :param basepath: path to the training split, e.g. .../MPI-Sintel/training/
+    :param estpath: path containing one sub directory with estimates per method
+    :param parameter_list: list of dicts, each with a "flow_method" entry
+    :param result_filename: output file of the pickled results
+    :param latex_filename: output file of the latex table, skipped if empty
+    :param num_workers: number of worker processes, <= 1 evaluates serially
+    :param chunk_size: maximal number of frame pairs per worker task
+    :param batch_size: number of frame pairs of a sequence evaluated per call of the metric kernel
+    :param gt_cache_dir: directory of the ground truth cache shared by all methods and runs, None disables it
+    :param store_filename: per-frame result store, frame pairs already scored with the same estimate are skipped
+    and new results are appended as soon as they are computed. None disables the store
+    :param table_filename: optional output file of the results in the columnar .npz format
+    :param prefetch_depth: number of batches read ahead by background threads while the current one is scored
+    :param prefetch_bytes: memory cap of the batches read ahead per process
+    :param index_dir: optional directory caching the dataset index between runs
+    :param profile_filename: if set, per-stage measurements are recorded, printed as table and written to this
+    file as Chrome trace JSON
+    :param image_pass: image variant of the dataset, e.g. the rendering pass "clean" or "final" of MPI-Sintel
+    :param estimate_dirs: optional dict of method name to estimate directory, overrides estpath
+    :param extended: also compute the matched/unmatched, s0-10/s10-40/s40+ and d0-10/d10-60/d60-140 regions of
+    the official Sintel breakdown, the latex output then contains a second table
+    :param max_memory: optional memory budget in bytes per frame pair and process. Frames are then memory-mapped
+    and scored in row bands with bit-identical totals, for high resolution data or long sequences. Raises
+    ValueError if the budget is too small for the frame size, see util.tiled_memory. The estimated and the
+    measured peak are printed
+    :param dataset: name of the dataset plugin, e.g. "sintel", "kitti" or "chairs", see datasets
+    :param sampling: optional dict with keys of fast_eval.DEFAULT_SAMPLING. Only the sampled pixels and frame pairs
+    are scored, e.g. to rank training checkpoints quickly, and the confidence intervals of the means are printed.
+    Not combinable with store_filename, extended and max_memory
+    :param full_filename: optional results of a full evaluation the sampled means are compared against
+    :param ci_filename: optional JSON output of the sampled means and their confidence intervals
+    :return: latex table string
+    """
+    if sampling is not None:
+        if store_filename is not None or extended or max_memory is not None:
+            raise ValueError("A sampled evaluation supports neither the result store, the extended regions nor a "
+                             "memory budget")
+        sampling = dict(fe.DEFAULT_SAMPLING, **sampling)
+    if profile_filename is not None:
+        pr.enable()
+        pr.profiler.take_events()
+    jobs = create_jobs(basepath, estpath, parameter_list, index_dir, image_pass, estimate_dirs, dataset)
+    if sampling is not None:
+        jobs = fe.select_frames(jobs, sampling["frame_step"])
+
+    store = None
+    pending_jobs = jobs
+    if store_filename is not None:
+        store = rs.ResultStore(store_filename)
+        keys = dict()
+        for n, config_item in jobs:
+            keys[(n, config_item["file_index"])] = rs.result_key(config_item,
+                                                                 rs.file_digest(config_item["files"]["estflow"]))
+
+        def is_stored(job):
+            key = keys[(job[0], job[1]["file_index"])]
+            # results stored without the extended regions are scored again in an extended run
+            return key in store and (not extended or ut.EXTENDED_REGIONS[0] in store.get(key)[1])
+
+        pending_jobs = [job for job in jobs if not is_stored(job)]
+        print("Found {} of {} frame pairs in {}".format(len(jobs) - len(pending_jobs), len(jobs), store_filename))
+
+        def on_result(n, config_item, result):
+            store.append(keys[(n, config_item["file_index"])], config_item, result)
+    else:
+        on_result = None
 
+    if max_memory is not None and len(pending_jobs) > 0:
+        height, width = ut.readFlowFiles(pending_jobs[0][1]["files"]["gt_flow"]).shape[:2]
+        band_rows, peak_bytes = ut.tiled_memory(height, width, max_memory, extended)
+        print("Tiled evaluation of {}x{} frames: {} rows per band, estimated peak {:.1f} MB of {:.1f} MB per process"
+              .format(width, height, band_rows, peak_bytes / 2 ** 20, max_memory / 2 ** 20))
+
+    import progressbar
+    bar = progressbar.ProgressBar()
+    bar.start(max_value=len(pending_jobs))
+    result_list = run_jobs(pending_jobs, num_workers, chunk_size, bar, batch_size, gt_cache_dir, on_result,
+                           prefetch_depth, prefetch_bytes, extended, max_memory, sampling)
     bar.finish()
+    if max_memory is not None and len(pending_jobs) > 0:
+        print("Tiled evaluation: measured peak {:.1f} MB of {:.1f} MB per process (traced allocations)".format(
+            tile_peak_bytes / 2 ** 20, max_memory / 2 ** 20))
+    scored = fe.split_blocks(result_list) if sampling is not None else None
+    if store is not None:
+        store.close()
+        regions = ut.REGIONS + ut.EXTENDED_REGIONS if extended else ut.REGIONS
+        result_list = list()
+        for n, config_item in jobs:
+            result = store.get(keys[(n, config_item["file_index"])])[1]
+            result_list.append(copy.deepcopy((config_item, {region: result[region] for region in regions})))
     print("\n")
     print("\n")
     print("Save short term evaluation file ", result_filename)
     out_dict = {"result": result_list}
-    pickle.dump(out_dict, open(result_filename, "wb"))
+    if sampling is not None:
+        out_dict["sampling"] = sampling
+    with pr.stage("save"):
+        with open(result_filename, "wb") as f:
+            pickle.dump(out_dict, f)
+        if table_filename is not None:
+            print("Save columnar result table ", table_filename)
+            rt.save_result_table(table_filename, result_list, sampling)
 
-    # Test
-    ut.avg_measures_test(result_filename)
+    with pr.stage("report"):
+        # Test
+        rp.avg_measures_test(result_filename)
 
-    result_str = ut.getLatexTable(result_filename)
+        result_str = rp.getLatexTable(result_filename)
     print(result_str)
     if len(latex_filename) > 0:
         with open(latex_filename, "w") as f:
             f.write(result_str)
+    if sampling is not None:
+        fe.write_intervals(scored, sampling, full_filename, ci_filename)
+
+    if profile_filename is not None:
+        print(pr.profiler.summary_table())
+        print("Save profile ", profile_filename)
+        pr.profiler.dump(profile_filename)
+        pr.enable(False)
+    return result_str
+
+
+def parse_method(value):
+    """
+    Parse a method argument of the form name=directory or directory, the name then is the directory name
+    :return: (name, directory)
+    """
+    name, sep, directory = value.partition("=")
+    if not sep:
+        directory = value
+        name = os.path.basename(os.path.normpath(value))
+    if len(name) == 0 or len(directory) == 0:
+        raise argparse.ArgumentTypeError("invalid method '{}', expected name=directory or directory".format(value))
+    return name, directory
+
+
+def add_dataset_arguments(parser):
+    """
+    Add the dataset root and the --dataset and --pass options to parser, see parse_dataset
+    """
+    parser.add_argument("dataset", help="root path of the dataset, i.e. the directory containing training/ (data/ "
+                                        "for FlyingChairs)")
+    parser.add_argument("--dataset", dest="dataset_name", choices=sorted(ds.DATASETS), default="sintel",
+                        help="layout of the dataset (default: %(default)s)")
+    parser.add_argument("--pass", dest="image_pass", default=None,
+                        help="image variant: clean or final (sintel), image_2 or colored_0 (kitti), val, train or "
+                             "all (chairs split), by default the first one")
+
+
+def parse_dataset(parser, args):
+    """
+    Resolve the dataset given by the options of add_dataset_arguments through its plugin
+    :return: (plugin, path of the evaluated split, image pass)
+    """
+    plugin = ds.get_dataset(args.dataset_name)
+    image_pass = plugin.passes[0] if args.image_pass is None else args.image_pass
+    if image_pass not in plugin.passes:
+        parser.error("--pass of {} must be one of {}".format(plugin.name, ", ".join(plugin.passes)))
+    basepath = plugin.split_path(args.dataset)
+    if not os.path.isdir(plugin.basepaths(basepath, "", image_pass)["images"]):
+        parser.error("{} does not contain the {} images".format(basepath, image_pass))
+    return plugin, basepath, image_pass
+
+
+def create_argument_parser():
+    parser = argparse.ArgumentParser(description="Evaluate optical flow estimates of several methods on the "
+                                                 "training set of MPI-Sintel, KITTI or FlyingChairs in one pass "
+                                                 "over the dataset.")
+    add_dataset_arguments(parser)
+    parser.add_argument("methods", nargs="+", type=parse_method, metavar="method",
+                        help="estimate directory of a method as name=directory or directory, the method is then "
+                             "named after the directory")
+    parser.add_argument("--result", default=None,
+                        help="pickled results (default: {}.pb, {}.pb of a sampled evaluation)".format(
+                            RESULT_NAME, SAMPLED_RESULT_NAME))
+    parser.add_argument("--latex", default=None,
+                        help="latex table, empty to skip (default: {}.tex, {}.tex of a sampled evaluation)".format(
+                            RESULT_NAME, SAMPLED_RESULT_NAME))
+    parser.add_argument("--table", default=None, help="optional columnar .npz result table")
+    parser.add_argument("--store", default=None,
+                        help="optional per-frame result store, a rerun only scores new or changed estimates")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes (default: %(default)s)")
+    parser.add_argument("--chunk-size", type=int, default=None, help="maximal number of jobs per worker task")
+    parser.add_argument("--batch-size", type=int, default=8,
+                        help="frame pairs scored per call of the metric kernel (default: %(default)s)")
+    parser.add_argument("--prefetch", type=int, default=2,
+                        help="batches decoded ahead while the current one is scored, 0 disables it "
+                             "(default: %(default)s)")
+    parser.add_argument("--gt-cache", default=None, help="directory of the preprocessed ground truth cache")
+    parser.add_argument("--index-dir", default=None, help="directory caching the dataset index between runs")
+    parser.add_argument("--extended", action="store_true",
+                        help="also evaluate the matched/unmatched, speed and boundary distance regions")
+    parser.add_argument("--max-memory", type=float, default=None, metavar="MB",
+                        help="memory budget per frame pair and process, frames are then memory-mapped and scored "
+                             "in row bands")
+    parser.add_argument("--profile", default=None, help="write per-stage timings as Chrome trace JSON to this file")
+    group = parser.add_argument_group("approximate evaluation",
+                                      "score only a sample of the pixels and frame pairs, e.g. to rank training "
+                                      "checkpoints, and print the confidence intervals of the means. Enabled by "
+                                      "any of --stride, --fraction, --frame-step and --roi")
+    group.add_argument("--stride", type=int, default=None, help="keep every stride-th row and column")
+    group.add_argument("--fraction", type=float, default=None,
+                       help="share of the strided pixels of a row sampled at random")
+    group.add_argument("--seed", type=int, default=0, help="seed of the random pixel sampling")
+    group.add_argument("--frame-step", type=int, default=None,
+                       help="evaluate every frame-step-th frame pair of a sequence")
+    group.add_argument("--roi", type=int, nargs=4, default=None, metavar=("Y0", "Y1", "X0", "X1"),
+                       help="evaluate only this crop of every frame")
+    group.add_argument("--full", default=None, help="results of a full evaluation to compare the sampled means "
+                                                    "against")
+    group.add_argument("--ci", default=None, help="optional JSON output of the confidence intervals")
+    return parser
+
+
+def parse_sampling(parser, args):
+    """
+    Sampling of the approximate evaluation given on the command line, see fast_eval.DEFAULT_SAMPLING
+    :return: dict or None to score all pixels
+    """
+    if args.stride is None and args.fraction is None and args.frame_step is None and args.roi is None:
+        if args.full is not None or args.ci is not None:
+            parser.error("--full and --ci need --stride, --fraction, --frame-step or --roi")
+        return None
+    if args.store is not None or args.extended or args.max_memory is not None or args.gt_cache is not None:
+        parser.error("a sampled evaluation does not support --store, --extended, --max-memory and --gt-cache")
+    sampling = dict(fe.DEFAULT_SAMPLING, seed=args.seed, roi=None if args.roi is None else tuple(args.roi))
+    for key in ("stride", "fraction", "frame_step"):
+        if getattr(args, key) is not None:
+            sampling[key] = getattr(args, key)
+    if sampling["stride"] < 1 or not 0 < sampling["fraction"] <= 1 or sampling["frame_step"] < 1:
+        parser.error("stride and frame-step must be >= 1 and fraction in (0, 1]")
+    return sampling
+
+
+def main(argv=None):
+    parser = create_argument_parser()
+    args = parser.parse_args(argv)
+
+    _, basepath, image_pass = parse_dataset(parser, args)
+    estimate_dirs = dict()
+    parameter_list = list()
+    if args.max_memory is not None and args.max_memory <= 0:
+        parser.error("--max-memory must be positive")
+    sampling = parse_sampling(parser, args)
+    output_name = RESULT_NAME if sampling is None else SAMPLED_RESULT_NAME
+    result_filename = output_name + ".pb" if args.result is None else args.result
+    latex_filename = output_name + ".tex" if args.latex is None else args.latex
+    for name, directory in args.methods:
+        if name in estimate_dirs:
+            parser.error("method '{}' is given more than once".format(name))
+        estimate_dirs[name] = directory
+        parameter_list.append({"flow_method": name})
+
+    evaluate(basepath, "", parameter_list, result_filename, latex_filename, args.workers, args.chunk_size,
+             batch_size=args.batch_size, gt_cache_dir=args.gt_cache, store_filename=args.store,
+             table_filename=args.table, prefetch_depth=args.prefetch, index_dir=args.index_dir,
+             profile_filename=args.profile, image_pass=image_pass, estimate_dirs=estimate_dirs,
+             extended=args.extended,
+             max_memory=None if args.max_memory is None else int(args.max_memory * 2 ** 20),
+             dataset=args.dataset_name, sampling=sampling, full_filename=args.full, ci_filename=args.ci)
 
 
 if __name__ == '__main__':
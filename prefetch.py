@@ -0,0 +1,66 @@
+# ---------------------------------------------------------------------
+# Copyright (c) 2018 TU Berlin, Communication Systems Group
+# Written by Tobias Senst <senst@nue.tu-berlin.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# ---------------------------------------------------------------------
+import collections
+import concurrent.futures
+
+import numpy as np
+
+
+def nbytes(data):
+    """
+    Number of bytes of all numpy arrays contained in data (array, tuple, list or dict)
+    """
+    if isinstance(data, np.ndarray):
+        return data.nbytes
+    if isinstance(data, dict):
+        data = list(data.values())
+    if isinstance(data, (tuple, list)):
+        return sum(nbytes(item) for item in data)
+    return 0
+
+
+def prefetch(load_fn, items, depth=4, num_threads=2, max_bytes=512 * 2 ** 20):
+    """
+    Generator returning load_fn(item) for every item in order. While the caller processes one item, the
+    following ones are loaded by a thread pool.
+    :param load_fn: function reading the data of one item from disk
+    :param items: iterable of items
+    :param depth: maximal number of items loaded ahead
+    :param num_threads: number of loader threads
+    :param max_bytes: memory cap of the loaded but not yet returned items, estimated from the largest item seen
+    :return: generator of load_fn(item)
+    """
+    items = iter(items)
+    pending = collections.deque()
+    item_bytes = 0
+    exhausted = False
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, num_threads)) as pool:
+        while True:
+            while not exhausted and len(pending) < max(1, depth) \
+                    and (len(pending) == 0 or (len(pending) + 1) * item_bytes <= max_bytes):
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending.append(pool.submit(load_fn, item))
+            if len(pending) == 0:
+                return
+            data = pending.popleft().result()
+            item_bytes = max(item_bytes, nbytes(data))
+            yield data
@@ -0,0 +1,151 @@
+# ---------------------------------------------------------------------
+# Copyright (c) 2018 TU Berlin, Communication Systems Group
+# Written by Tobias Senst <senst@nue.tu-berlin.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# ---------------------------------------------------------------------
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+class Event(dict):
+    """
+    Measurements of one stage: name, start, duration, pid, tid, bytes read, allocated bytes and arrays, args
+    """
+
+    def read(self, nbytes):
+        self["bytes_read"] += int(nbytes)
+
+    def alloc(self, *arrays):
+        for array in arrays:
+            if array is not None:
+                self["alloc_bytes"] += int(array.nbytes)
+                self["arrays"] += 1
+
+
+class NullEvent:
+    """
+    Event of a disabled profiler, all measurements are dropped
+    """
+
+    def read(self, nbytes):
+        pass
+
+    def alloc(self, *arrays):
+        pass
+
+
+NULL_EVENT = NullEvent()
+
+
+class Profiler:
+    """
+    Opt-in instrumentation of the evaluation stages. Every stage() records wall time, bytes read and the arrays
+    allocated for its result. A disabled profiler only costs a function call per stage.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.events = list()
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name, **args):
+        """
+        Measure the enclosed block as stage name, args (e.g. sequence and frame) are stored with the event
+        :return: context manager yielding the Event, use Event.read and Event.alloc to add measurements
+        """
+        if not self.enabled:
+            yield NULL_EVENT
+            return
+        event = Event(name=name, pid=os.getpid(), tid=threading.get_ident(), bytes_read=0, alloc_bytes=0, arrays=0,
+                      args=args)
+        event["start"] = time.perf_counter()
+        try:
+            yield event
+        finally:
+            event["duration"] = time.perf_counter() - event["start"]
+            with self.lock:
+                self.events.append(event)
+
+    def take_events(self):
+        """
+        Return and clear the recorded events, used to send the events of a worker process to the main process
+        """
+        with self.lock:
+            events, self.events = self.events, list()
+        return events
+
+    def extend(self, events):
+        with self.lock:
+            self.events.extend(events)
+
+    def summary(self):
+        """
+        :return: {stage: {"count", "seconds", "bytes_read", "alloc_bytes", "arrays"}}
+        """
+        stages = dict()
+        for event in self.events:
+            stage = stages.setdefault(event["name"], {"count": 0, "seconds": 0.0, "bytes_read": 0, "alloc_bytes": 0,
+                                                      "arrays": 0})
+            stage["count"] += 1
+            stage["seconds"] += event["duration"]
+            for key in ("bytes_read", "alloc_bytes", "arrays"):
+                stage[key] += event[key]
+        return stages
+
+    def summary_table(self):
+        lines = ["{:<16} {:>8} {:>11} {:>11} {:>12} {:>12}".format("stage", "count", "total [s]", "mean [ms]",
+                                                                 "read [MB]", "alloc [MB]")]
+        for name, stage in sorted(self.summary().items(), key=lambda item: -item[1]["seconds"]):
+            lines.append("{:<16} {:>8} {:>11.3f} {:>11.3f} {:>12.1f} {:>12.1f}".format(
+                name, stage["count"], stage["seconds"], 1000.0 * stage["seconds"] / stage["count"],
+                stage["bytes_read"] / 2.0 ** 20, stage["alloc_bytes"] / 2.0 ** 20))
+        return "\n".join(lines)
+
+    def chrome_trace(self):
+        """
+        Events in the Chrome trace event format, viewable in chrome://tracing or Perfetto
+        """
+        trace = list()
+        for event in self.events:
+            args = dict(event["args"])
+            args.update({key: event[key] for key in ("bytes_read", "alloc_bytes", "arrays")})
+            trace.append({"name": event["name"], "ph": "X", "ts": event["start"] * 1e6, "dur": event["duration"] * 1e6,
+                          "pid": event["pid"], "tid": event["tid"], "args": args})
+        return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+    def dump(self, filename):
+        """
+        Write the Chrome trace timeline and the per-stage summary as JSON
+        """
+        data = self.chrome_trace()
+        data["summary"] = self.summary()
+        with open(filename, "w") as f:
+            json.dump(data, f)
+
+
+# profiler of the current process
+profiler = Profiler()
+
+
+def enable(enabled=True):
+    profiler.enabled = enabled
+
+
+def stage(name, **args):
+    return profiler.stage(name, **args)
@@ -0,0 +1,238 @@
+# ---------------------------------------------------------------------
+# Copyright (c) 2018 TU Berlin, Communication Systems Group
+# Written by Tobias Senst <senst@nue.tu-berlin.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# ---------------------------------------------------------------------
+import pickle
+import sys
+
+import numpy as np
+
+import aggregation as ag
+import result_store as rs
+import result_table as rt
+import util as ut
+
+
+def get_sequence_measures(result_list):
+    """
+    将计算结果按照方法、类别生成list
+    :param result_list:
+    :param parameter_str: 计算光流所使用的方法
+    :param seq_name: 存放连续帧图片的文件夹
+    :return: sequence_list
+    """
+    sequence_list = dict()
+    for item in result_list:
+        parameter_str = ut.parameter_to_string(item[0]["parameter"])  # 获取计算光流所使用的方法
+        if "dir" in item[0]["files"]:
+            seq_name = item[0]["files"]["dir"]  # 获取当前光流所处的父文件夹
+        else:
+            seq_name = "None"
+
+        if seq_name.find("_dyn") >= 0:
+            continue
+
+        if parameter_str not in sequence_list:
+            sequence_list[parameter_str] = dict()
+
+        if seq_name not in sequence_list[parameter_str]:
+            sequence_list[parameter_str][seq_name] = list()
+
+        sequence_list[parameter_str][seq_name].append(item[1])
+
+    return sequence_list
+
+
+def avg_sequence(src):
+    """
+    计算每一个类别中FG、BG、Total的ee、R1、R2、R3
+    :param src: {sequence: [result, ...]}, see get_sequence_measures
+    :return: {sequence: {"FG": {"ee", "R1", "R2", "R3" per point, "noPoints"}, "BG": ..., "Total": ...}}
+    """
+    sequence_result = dict()
+    for seq_keys in src.keys():  # 遍历类别
+        means = ag.sequence_means(ag.stack_items(src[seq_keys], ut.REGIONS).sum(axis=0))
+        sequence_result[seq_keys] = ut.error_sums_to_dict(means)
+    return sequence_result
+
+
+def avg_sequences(sequence_list, use_type):
+    """
+    计算整个数据集在FG、BG、Total下的ee、R2
+    :param sequence_list: result of avg_sequence
+    :param use_type: 0 static sequences, 1 dynamic sequences (_hDyn), 2 all sequences
+    :return: FG ee, FG R2[%], BG ee, BG R2[%], Total ee, Total R2[%]
+    """
+    seq_names = list(sequence_list.keys())
+    means = ag.stack_items([sequence_list[seq_name] for seq_name in seq_names], ut.REGIONS)
+    dynamic = np.array([seq_name.find(ag.DYNAMIC_PATTERN) >= 0 for seq_name in seq_names], dtype=bool)
+    selected = {0: ~dynamic, 1: dynamic}.get(use_type, np.ones(len(seq_names), dtype=bool))
+    return sequences_to_tuple(ag.mean_over_sequences(means[None], selected[None])[0])
+
+
+def sequences_to_tuple(means):
+    """
+    Convert averaged FG/BG/Total means (len(ut.REGIONS), len(ut.MEASURES)) into the tuple returned by avg_sequences
+    """
+    ee = ut.MEASURES.index("ee")
+    r2 = ut.MEASURES.index("R2")
+    return means[0, ee], 100 * means[0, r2], means[1, ee], 100 * means[1, r2], means[2, ee], 100 * means[2, r2]
+
+
+def load_results(filename):
+    """
+    Load the list of (config_item, result) from a pickled result file, a result store or a columnar table
+    """
+    if filename.endswith(rs.STORE_EXTENSION):
+        return rs.ResultStore(filename).results()
+    if filename.endswith(rt.TABLE_EXTENSION):
+        return rt.results_from_table(rt.load_result_table(filename))
+    with open(filename, "rb") as f:
+        return pickle.load(f)["result"]
+
+
+def getLatexTable(filename):
+    str_result = "\\begin{table} \n \\centering " \
+                 "\\begin{tabular}{l|crcr|crcr|crcrcr|r} \n" \
+                 "\\hline \n " \
+                 "\\multicolumn{1}{c|}{} & \\multicolumn{2}{|c}{FG (Static) } & \\multicolumn{2}{c|} { BG (Static)} & " \
+                 "\\multicolumn{2}{|c}{FG (Dynamic)} & \\multicolumn{2}{c|}{ BG (Dynamic)} & " \
+                 "\\multicolumn{2}{c}{FG($\\varnothing$)}&\multicolumn{2}{c}{BG ($\\varnothing$)} & " \
+                 "\\multicolumn{2}{c|}{$\\varnothing$}  \\\\ \n " \
+                 "\\multicolumn{1}{c|}{}& EPE & R2[\\%] & EPE & R2[\\%]& EPE & R2[\\%]& EPE & R2[\\%]" \
+                 "& EPE & R2[\\%]& EPE & R2[\\%]& EPE & R2[\\%] \\\\ \n "
+    result = ag.aggregate_file(filename)
+    regions = [result["regions"].index(region) for region in ut.REGIONS]
+    for m, method_key in enumerate(result["methods"]):
+        if not result["evaluated"][m]:
+            continue
+
+        ret_static = sequences_to_tuple(result["static"][m, regions])
+        ret_dynamic = sequences_to_tuple(result["dynamic"][m, regions])
+        ret_total = sequences_to_tuple(result["overall"][m, regions])
+        name = method_key.replace("/", "")
+        name = name.replace("_", "")
+        str_out = name \
+                  + " & {:.3f}".format(ret_static[0]) \
+                  + " & {:.2f}".format(ret_static[1]) \
+                  + " & {:.3f}".format(ret_static[2]) \
+                  + " & {:.2f}".format(ret_static[3]) \
+                  + " & {:.3f}".format(ret_dynamic[0]) \
+                  + " & {:.2f}".format(ret_dynamic[1]) \
+                  + " & {:.3f}".format(ret_dynamic[2]) \
+                  + " & {:.2f}".format(ret_dynamic[3]) \
+                  + " & {:.3f}".format(ret_total[0]) \
+                  + " & {:.3f}".format(ret_total[1]) \
+                  + " & {:.3f}".format(ret_total[2]) \
+                  + " & {:.2f}".format(ret_total[3]) \
+                  + " & {:.3f}".format(ret_total[4]) \
+                  + " & {:.2f}".format(ret_total[5]) \
+                  + " \\\ "
+        str_result = str_result + str_out + "\n"
+
+    str_result = str_result + "\end{tabular} \n " \
+                              "\\vspace{0.1cm} \n" \
+                              "\\caption{Evaluation results common optical flow metrics. " \
+                              "Dynamic comprised sequences with and static without camera motion, " \
+                              "BG - background motion vectors and FG - motion vectors located at persons of the crowd.} \n" \
+                              "\\end{table}"
+    if all(region in result["regions"] for region in ut.EXTENDED_REGIONS):
+        str_result = str_result + "\n" + getExtendedLatexTable(result)
+    return str_result
+
+
+def getExtendedLatexTable(result):
+    """
+    Latex table of the mean EPE of the official Sintel breakdown (ut.EXTENDED_REGIONS) over all sequences
+    :param result: aggregation.aggregate of results computed with the extended regions
+    """
+    columns = ("Total", "matched", "unmatched", "d0-10", "d10-60", "d60-140", "s0-10", "s10-40", "s40+")
+    regions = [result["regions"].index(region) for region in columns]
+    ee = ut.MEASURES.index("ee")
+    str_result = "\\begin{table} \n \\centering " \
+                 "\\begin{tabular}{l|c|cc|ccc|ccc} \n" \
+                 "\\hline \n " \
+                 "\\multicolumn{1}{c|}{} & EPE all & EPE matched & EPE unmatched & d0-10 & d10-60 & d60-140 & " \
+                 "s0-10 & s10-40 & s40+ \\\\ \n "
+    for m, method_key in enumerate(result["methods"]):
+        if not result["evaluated"][m]:
+            continue
+        name = method_key.replace("/", "").replace("_", "")
+        str_result = str_result + name + "".join(" & {:.3f}".format(result["overall"][m, r, ee]) for r in regions) \
+            + " \\\\ \n"
+    str_result = str_result + "\\end{tabular} \n " \
+                              "\\vspace{0.1cm} \n" \
+                              "\\caption{Endpoint error of matched and unmatched (occluded) pixels, of pixels within " \
+                              "0-10, 10-60 and 60-140 pixels of the nearest occlusion boundary and of pixels with a " \
+                              "ground truth speed of 0-10, 10-40 and more than 40 pixels per frame.} \n" \
+                              "\\end{table}"
+    return str_result
+
+
+def avg_measures(src):
+    """
+    计算数据集的ee、R1、R2、R3
+    :param src: {sequence: [result, ...]}, see get_sequence_measures
+    :return: {region: {"ee", "R1", "R2", "R3"}} averaged over the per-sequence means
+    """
+    seq_names = list(src.keys())
+    if len(seq_names) == 0:
+        return dict()
+    regions = [key for key in src[seq_names[0]][0].keys() if key != "time"]
+    means = np.stack([ag.sequence_means(ag.stack_items(src[seq_name], regions).sum(axis=0))
+                      for seq_name in seq_names])
+    total = ag.mean_over_sequences(means[None], np.ones((1, len(seq_names)), dtype=bool))[0]
+    return {region: {measure: float(total[r, m]) for m, measure in enumerate(ut.MEASURES[:-1])}
+            for r, region in enumerate(regions)}
+
+
+def avg_measures_no_dict(src):
+    """
+    Same as avg_measures for flat results {"ee", "R1", "R2", "R3", "no_points"}
+    """
+    measures = ("ee", "R1", "R2", "R3", "no_points")
+    seq_names = list(src.keys())
+    if len(seq_names) == 0:
+        return dict()
+    means = np.stack([ag.sequence_means(ag.stack_items([{"": item} for item in src[seq_name]], [""], measures)
+                                        .sum(axis=0)) for seq_name in seq_names])
+    total = ag.mean_over_sequences(means[None], np.ones((1, len(seq_names)), dtype=bool))[0]
+    return {measure: float(total[0, m]) for m, measure in enumerate(measures[:-1])}
+
+
+def avg_measures_test(filename):
+    result_list = load_results(filename)
+    method_result_list = get_sequence_measures(result_list)
+    for method_key in method_result_list.keys():
+        avg_measures(method_result_list[method_key])
+        # avg_measures_no_dict(method_result_list[method_key])
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) < 1:
+        print("Usage: python report.py result_file [latex_file]")
+        return 1
+    result_str = getLatexTable(argv[0])
+    print(result_str)
+    if len(argv) > 1:
+        with open(argv[1], "w") as f:
+            f.write(result_str)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
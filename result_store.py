@@ -0,0 +1,114 @@
+# ---------------------------------------------------------------------
+# Copyright (c) 2018 TU Berlin, Communication Systems Group
+# Written by Tobias Senst <senst@nue.tu-berlin.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# ---------------------------------------------------------------------
+import hashlib
+import json
+import os
+
+import util as ut
+
+STORE_EXTENSION = ".jsonl"
+
+
+def file_digest(filename, block_size=2 ** 20):
+    """
+    Content hash of a file, used to detect changed estimates. A frame of a flow container is hashed like the
+    equivalent .flo file
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    if ut.split_flow_path(filename)[1] is not None:
+        flow = ut.readFlowFiles(filename)
+        digest.update(ut.flow_header(flow.shape[1], flow.shape[0]))
+        digest.update(flow.tobytes())
+        return digest.hexdigest()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def result_key(config_item, digest):
+    """
+    Key of a scored frame pair: (method, sequence, frame, estimate-file hash)
+    """
+    files = config_item["files"]
+    return (ut.parameter_to_string(config_item["parameter"]), files.get("dir", "None"), files["filename"], digest)
+
+
+class ResultStore:
+    """
+    Append-only per-frame result store. Every scored frame pair is written as one JSON line and flushed
+    immediately, so an interrupted run keeps everything scored so far. A truncated last line, left by a crash
+    while writing, is ignored on loading. If an estimate changes, the newer record replaces the old one.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.records = dict()
+        self.latest = dict()
+        self.valid_size = 0
+        if os.path.exists(filename):
+            self.load()
+        self.file = None
+
+    def load(self):
+        with open(self.filename, "rb") as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("incomplete line")
+                    record = json.loads(line.decode("utf-8"))
+                except ValueError:
+                    break  # incomplete record of an interrupted run, dropped on the next append
+                self.add(tuple(record["key"]), record["config"], record["result"])
+                self.valid_size += len(line)
+
+    def add(self, key, config_item, result):
+        self.records[key] = (config_item, result)
+        self.latest[key[:3]] = key
+
+    def __contains__(self, key):
+        return key in self.records
+
+    def __len__(self):
+        return len(self.latest)
+
+    def get(self, key):
+        return self.records[key]
+
+    def append(self, key, config_item, result):
+        """
+        Add a scored frame pair and write it to disk
+        """
+        if self.file is None:
+            self.file = open(self.filename, "ab")
+            self.file.truncate(self.valid_size)
+        line = json.dumps({"key": list(key), "config": config_item, "result": result}) + "\n"
+        self.file.write(line.encode("utf-8"))
+        self.file.flush()
+        self.add(key, config_item, result)
+
+    def results(self):
+        """
+        Return the latest result of every (method, sequence, frame) as list of (config_item, result)
+        """
+        return [self.records[key] for key in self.latest.values()]
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,170 @@
+# ---------------------------------------------------------------------
+# Copyright (c) 2018 TU Berlin, Communication Systems Group
+# Written by Tobias Senst <senst@nue.tu-berlin.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# ---------------------------------------------------------------------
+import json
+import sys
+
+import numpy as np
+
+import util as ut
+
+TABLE_EXTENSION = ".npz"
+
+PATH_KEYS = ("gt_flow", "estflow", "mask")
+
+
+class StringTable:
+    """
+    Interns strings and maps them to consecutive ids
+    """
+
+    def __init__(self):
+        self.ids = dict()
+        self.strings = list()
+
+    def __call__(self, value):
+        if value not in self.ids:
+            self.ids[value] = len(self.strings)
+            self.strings.append(value)
+        return self.ids[value]
+
+    def array(self):
+        return np.array(self.strings, dtype=np.str_)
+
+
+def table_from_results(result_list):
+    """
+    Convert a list of (config_item, result) into a columnar table with one row per (method, sequence, frame,
+    region). Strings are stored once in string tables and referenced by id, paths are split into an interned
+    directory prefix and file name.
+    :param result_list: list of (config_item, result), see opticalflow_evaluate.run_parameter
+    :return: dict of numpy arrays
+    """
+    methods = StringTable()
+    method_parameters = list()
+    sequences = StringTable()
+    frames = StringTable()
+    paths = StringTable()
+    regions = StringTable()
+
+    columns = {"method": [], "sequence": [], "frame": [], "file_index": [], "region": []}
+    for key in PATH_KEYS:
+        columns[key + "_prefix"] = []
+        columns[key + "_name"] = []
+    values = list()
+    for config_item, result in result_list:
+        files = config_item["files"]
+        method_str = ut.parameter_to_string(config_item["parameter"])
+        method = methods(method_str)
+        if method == len(method_parameters):
+            method_parameters.append(json.dumps(config_item["parameter"], sort_keys=True))
+        frame_columns = {"method": method,
+                         "sequence": sequences(files.get("dir", "None")),
+                         "frame": frames(files["filename"]),
+                         "file_index": config_item["file_index"]}
+        for key in PATH_KEYS:
+            # directories repeat for every frame of a sequence and file names for every sequence
+            prefix, sep, name = files.get(key, "").rpartition("/")
+            frame_columns[key + "_prefix"] = paths(prefix + sep)
+            frame_columns[key + "_name"] = paths(name)
+        for region in result.keys():
+            if region == "time":
+                continue
+            for key, value in frame_columns.items():
+                columns[key].append(value)
+            columns["region"].append(regions(region))
+            values.append([result[region][measure] for measure in ut.MEASURES])
+
+    table = {key: np.array(value, dtype=np.int32) for key, value in columns.items()}
+    table["region"] = table["region"].astype(np.int16)
+    table["values"] = np.array(values, dtype=np.float64).reshape(-1, len(ut.MEASURES))
+    table["methods"] = methods.array()
+    table["method_parameters"] = np.array(method_parameters, dtype=np.str_)
+    table["sequences"] = sequences.array()
+    table["frames"] = frames.array()
+    table["paths"] = paths.array()
+    table["regions"] = regions.array()
+    table["measures"] = np.array(ut.MEASURES, dtype=np.str_)
+    return table
+
+
+def save_result_table(filename, result_list, sampling=None):
+    """
+    Write a list of (config_item, result) as columnar .npz file
+    :param sampling: sampling of an approximate evaluation, see fast_eval.DEFAULT_SAMPLING, stored as JSON string
+    under "sampling"
+    """
+    table = table_from_results(result_list)
+    if sampling is not None:
+        table["sampling"] = np.array(json.dumps(sampling))
+    np.savez(filename, **table)
+
+
+def load_result_table(filename):
+    """
+    Load a columnar result table. Only plain numeric and string arrays are read, nothing is unpickled.
+    :return: dict of numpy arrays, see table_from_results
+    """
+    with np.load(filename, allow_pickle=False) as data:
+        return {key: data[key] for key in data.files}
+
+
+def results_from_table(table):
+    """
+    Rebuild the list of (config_item, result) of a columnar table for the dict based functions of util
+    """
+    parameters = [json.loads(value) for value in table["method_parameters"]]
+    measures = [str(measure) for measure in table["measures"]]
+    result_list = list()
+    last_key = None
+    for row in range(len(table["region"])):
+        key = (table["method"][row], table["file_index"][row], table["sequence"][row], table["frame"][row])
+        if key != last_key:
+            files = {"dir": str(table["sequences"][key[2]]), "filename": str(table["frames"][key[3]])}
+            for path_key in PATH_KEYS:
+                files[path_key] = str(table["paths"][table[path_key + "_prefix"][row]]) \
+                    + str(table["paths"][table[path_key + "_name"][row]])
+            config_item = {"files": files, "parameter": dict(parameters[key[0]]), "file_index": int(key[1])}
+            result_list.append((config_item, dict()))
+            last_key = key
+        region = str(table["regions"][table["region"][row]])
+        result_list[-1][1][region] = {measure: float(value) for measure, value in zip(measures,
+                                                                                     table["values"][row])}
+    return result_list
+
+
+def group_sums(table, keys):
+    """
+    Sum the measure columns over all rows sharing the same values of the given key columns
+    :param table: columnar result table
+    :param keys: key columns, e.g. ("method", "sequence", "region")
+    :return: array of shape (number of distinct values of each key, ..., len(MEASURES))
+    """
+    shape = tuple(len(table[{"method": "methods", "sequence": "sequences", "frame": "frames",
+                             "region": "regions"}[key]]) for key in keys)
+    group = np.ravel_multi_index(tuple(table[key] for key in keys), shape)
+    sums = np.zeros((int(np.prod(shape)), table["values"].shape[1]), dtype=np.float64)
+    for m in range(table["values"].shape[1]):
+        sums[:, m] = np.bincount(group, weights=table["values"][:, m], minlength=len(sums))
+    return sums.reshape(shape + (table["values"].shape[1],))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("Usage: python result_table.py short_term_results.pb short_term_results.npz")
+    else:
+        save_result_table(sys.argv[2], ut.load_results(sys.argv[1]))
@@ -0,0 +1,247 @@
+# Benchmark of the evaluation hot paths on a synthetic dataset laid out like MPI-Sintel.
+# Usage: python tools/benchmark.py [--sequences 4] [--frames 10] [--output bench.json] [--baseline old.json]
+# Exits with 1 if the throughput of a stage dropped by more than --tolerance compared to the baseline.
+# Every stage runs in a fresh process so the reported peak RSS belongs to that stage only. Fails if the evaluation
+# with threaded prefetching differs from the serial one.
+import argparse
+import contextlib
+import filecmp
+import io
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import traceback
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import file_parser as fp  # noqa: E402
+import opticalflow_evaluate as oe  # noqa: E402
+import util as ut  # noqa: E402
+
+METHOD = "bench"
+
+
+def make_synthetic_dataset(root, sequences=4, frames=10, h=436, w=1024, seed=0):
+    """
+    Write a synthetic dataset with the MPI-Sintel layout (training/clean, flow, occlusions) and one estimate
+    :return: (basepath, estpath) as used by opticalflow_evaluate.evaluate
+    """
+    # not imported at module level, the stage processes have to start without cv2 like a fresh evaluation run
+    import cv2
+    rng = np.random.default_rng(seed)
+    basepath = os.path.join(root, "training") + "/"
+    estpath = os.path.join(root, "estimate") + "/"
+    image = np.zeros((h, w, 3), dtype=np.uint8)
+    for s in range(sequences):
+        seq = "seq_{}".format(s) if s % 2 == 0 else "seq_{}_hDyn".format(s)
+        for sub in ("clean", "flow", "occlusions"):
+            os.makedirs(os.path.join(basepath, sub, seq), exist_ok=True)
+        os.makedirs(os.path.join(estpath, METHOD, seq), exist_ok=True)
+        for f in range(1, frames + 1):
+            name = "frame_{:04d}".format(f)
+            cv2.imwrite(os.path.join(basepath, "clean", seq, name + ".png"), image)
+            if f == frames:
+                continue
+            gt_flow = (rng.standard_normal((h, w, 2)) * 8).astype(np.float32)
+            est_flow = (gt_flow + rng.standard_normal((h, w, 2))).astype(np.float32)
+            occlusion = ((rng.random((h, w)) > 0.9) * 255).astype(np.uint8)
+            ut.writeFlowFile(os.path.join(basepath, "flow", seq, name + ".flo"), gt_flow)
+            ut.writeFlowFile(os.path.join(estpath, METHOD, seq, name + ".flo"), est_flow)
+            cv2.imwrite(os.path.join(basepath, "occlusions", seq, name + ".png"), occlusion)
+    return basepath, estpath
+
+
+def basepath_dict(basepath, estpath):
+    return {"basepath": basepath,
+            "images": basepath + "clean/",
+            "gt_flow": basepath + "flow/",
+            "estimate": estpath + METHOD + "/",
+            "masks": basepath + "occlusions/",
+            }
+
+
+def stage_index(basepath, estpath, workdir):
+    return len(fp.create_filename_list(basepath_dict(basepath, estpath)))
+
+
+def stage_read_flo(basepath, estpath, workdir):
+    filenames = fp.create_filename_list(basepath_dict(basepath, estpath))
+    for item in filenames:
+        np.array(ut.readFlowFiles(item["gt_flow"]))
+    return len(filenames)
+
+
+def load_frames(basepath, estpath, count=8):
+    filenames = fp.create_filename_list(basepath_dict(basepath, estpath))[:count]
+    return [(np.array(ut.readFlowFiles(item["estflow"])), np.array(ut.readFlowFiles(item["gt_flow"])),
+             ut.readMask(item["mask"])) for item in filenames]
+
+
+def stage_compute_error(basepath, estpath, workdir, frames=None):
+    for est_flow, gt_flow, mask_rgb in frames:
+        ut.compute_error(est_flow, gt_flow, mask_rgb)
+    return len(frames)
+
+
+def stage_flow2rgb(basepath, estpath, workdir, frames=None):
+    for est_flow, gt_flow, mask_rgb in frames:
+        ut.flow2RGB(est_flow)
+    return len(frames)
+
+
+def stage_end_to_end(basepath, estpath, workdir):
+    result_filename = os.path.join(workdir, "bench_results.pb")
+    oe.evaluate(basepath, estpath, [{"flow_method": METHOD}], result_filename)
+    return len(ut.load_results(result_filename))
+
+
+def stage_end_to_end_prefetch(basepath, estpath, workdir):
+    # the first cv2 use happens concurrently in the prefetch threads
+    result_filename = os.path.join(workdir, "bench_results_prefetch.pb")
+    oe.evaluate(basepath, estpath, [{"flow_method": METHOD}], result_filename, batch_size=1, prefetch_depth=2)
+    return len(ut.load_results(result_filename))
+
+
+def check_prefetch(basepath, estpath, workdir):
+    """
+    :return: True if the threaded prefetching results are byte-identical to the serial ones
+    """
+    serial_filename = os.path.join(workdir, "bench_results.pb")
+    if not os.path.exists(serial_filename):
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            stage_end_to_end(basepath, estpath, workdir)
+    return filecmp.cmp(serial_filename, os.path.join(workdir, "bench_results_prefetch.pb"), shallow=False)
+
+
+def stage_aggregation(basepath, estpath, workdir):
+    result_filename = os.path.join(workdir, "bench_results.pb")
+    if not os.path.exists(result_filename):
+        stage_end_to_end(basepath, estpath, workdir)
+    for n in range(10):
+        ut.getLatexTable(result_filename)
+    return 10 * len(ut.load_results(result_filename))
+
+
+# name: (function, needs preloaded frames)
+STAGES = {"index": (stage_index, False),
+          "read_flo": (stage_read_flo, False),
+          "compute_error": (stage_compute_error, True),
+          "flow2RGB": (stage_flow2rgb, True),
+          "end_to_end": (stage_end_to_end, False),
+          "end_to_end_prefetch": (stage_end_to_end_prefetch, False),
+          "aggregation": (stage_aggregation, False),
+          }
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # not available on Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2.0 ** 20 if sys.platform == "darwin" else rss / 2.0 ** 10
+
+
+def run_stage(name, basepath, estpath, workdir, measure_alloc, repeat, queue):
+    try:
+        queue.put(measure_stage(name, basepath, estpath, workdir, measure_alloc, repeat))
+    except Exception:
+        queue.put({"error": traceback.format_exc()})
+
+
+def measure_stage(name, basepath, estpath, workdir, measure_alloc, repeat):
+    function, needs_frames = STAGES[name]
+    kwargs = {"frames": load_frames(basepath, estpath)} if needs_frames else dict()
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        seconds = None
+        for n in range(max(1, repeat)):
+            start = time.perf_counter()
+            items = function(basepath, estpath, workdir, **kwargs)
+            seconds = min(time.perf_counter() - start, seconds if seconds is not None else float("inf"))
+        result = {"seconds": seconds, "items": items, "items_per_second": items / seconds, "peak_rss_mb": peak_rss_mb()}
+        if measure_alloc:
+            # second run with allocation tracing, slower and therefore not timed
+            tracemalloc.start()
+            function(basepath, estpath, workdir, **kwargs)
+            current, peak = tracemalloc.get_traced_memory()
+            result["alloc_peak_mb"] = peak / 2.0 ** 20
+            result["alloc_blocks"] = len(tracemalloc.take_snapshot().traces)
+            tracemalloc.stop()
+    return result
+
+
+def run_benchmark(basepath, estpath, workdir, stages, measure_alloc=True, repeat=3):
+    context = multiprocessing.get_context("spawn")
+    results = dict()
+    for name in stages:
+        queue = context.Queue()
+        process = context.Process(target=run_stage, args=(name, basepath, estpath, workdir, measure_alloc, repeat,
+                                                                queue))
+        process.start()
+        results[name] = queue.get()
+        process.join()
+        if "error" in results[name]:
+            raise RuntimeError("Stage {} failed:\n{}".format(name, results[name]["error"]))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    :return: list of stages whose throughput dropped by more than tolerance compared to the baseline
+    """
+    regressions = list()
+    for name, result in results["stages"].items():
+        if name not in baseline.get("stages", {}):
+            continue
+        old = baseline["stages"][name]["items_per_second"]
+        if result["items_per_second"] < old * (1.0 - tolerance):
+            regressions.append((name, old, result["items_per_second"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the evaluation hot paths on synthetic data")
+    parser.add_argument("--sequences", type=int, default=4)
+    parser.add_argument("--frames", type=int, default=10, help="images per sequence")
+    parser.add_argument("--stages", nargs="+", default=list(STAGES.keys()), choices=list(STAGES.keys()))
+    parser.add_argument("--workdir", default=None, help="dataset directory, a temporary one by default")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the fastest one is reported")
+    parser.add_argument("--no-alloc", action="store_true", help="skip the allocation tracing run")
+    parser.add_argument("--output", default=None, help="write the results as JSON")
+    parser.add_argument("--baseline", default=None, help="JSON of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="accepted relative throughput drop")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = args.workdir if args.workdir is not None else tmpdir
+        basepath, estpath = make_synthetic_dataset(workdir, args.sequences, args.frames)
+        results = {"config": {"sequences": args.sequences, "frames": args.frames, "height": 436, "width": 1024},
+                   "stages": run_benchmark(basepath, estpath, workdir, args.stages, not args.no_alloc,
+                                               args.repeat)}
+        prefetch_matches = "end_to_end_prefetch" not in args.stages or check_prefetch(basepath, estpath, workdir)
+
+    for name, result in results["stages"].items():
+        print("{:<20} {:>10.4f} s {:>10.1f} items/s  peak RSS {:.1f} MB".format(
+            name, result["seconds"], result["items_per_second"], result["peak_rss_mb"] or 0.0))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if not prefetch_matches:
+        print("Results of end_to_end_prefetch differ from the serial evaluation")
+        sys.exit(1)
+    if args.baseline is not None:
+        with open(args.baseline, "r") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for name, old, new in regressions:
+            print("Regression in {}: {:.1f} -> {:.1f} items/s".format(name, old, new))
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+# Regression check of the fused error kernel util.compute_error against the OpenCV reference implementation.
+# Usage: python tools/errorKernelCheck.py [gt.flo est.flo mask.png]
+import os
+import sys
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import util as ut  # noqa: E402
+
+
+def check(est_flow, gt_flow, mask_rgb):
+    fused = ut.compute_error(est_flow, gt_flow, mask_rgb)
+    reference = ut.compute_error_reference(est_flow, gt_flow, mask_rgb)
+    for region in ut.REGIONS:
+        for measure in ut.MEASURES:
+            if not np.isclose(fused[region][measure], reference[region][measure], rtol=1e-9, atol=1e-6):
+                raise AssertionError("{} {}: fused {} != reference {}".format(
+                    region, measure, fused[region][measure], reference[region][measure]))
+
+
+def random_frame(rng, h=436, w=1024):
+    gt_flow = (rng.standard_normal((h, w, 2)) * 10).astype(np.float32)
+    gt_flow[rng.random((h, w)) > 0.999] = 1000  # out of range vectors
+    est_flow = (gt_flow + rng.standard_normal((h, w, 2)) * 2).astype(np.float32)
+    mask_rgb = np.repeat(((rng.random((h, w)) > 0.8) * 255).astype(np.uint8)[:, :, None], 3, axis=2)
+    return est_flow, gt_flow, mask_rgb
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4:
+        check(ut.readFlowFiles(sys.argv[2]), ut.readFlowFiles(sys.argv[1]), cv2.imread(sys.argv[3]))
+    else:
+        rng = np.random.default_rng(0)
+        for n in range(5):
+            check(*random_frame(rng))
+    print("fused error kernel matches the reference")
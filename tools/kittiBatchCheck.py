@@ -0,0 +1,58 @@
+# Checks that the evaluation of a synthetic KITTI dataset, whose frames differ in size and are therefore padded in
+# a batch, gives byte-identical results from the command line for every batch size, prefetching, worker and
+# memory option. Every run uses a fresh interpreter, so the first cv2 use happens in the prefetch threads.
+# Usage: python tools/kittiBatchCheck.py [output_dir]
+import filecmp
+import os
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from syntheticDataset import make_kitti  # noqa: E402
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# options of every run, the first one of a group is the reference
+RUNS = (("--batch-size", "1", "--prefetch", "0"),
+        ("--batch-size", "1"),
+        ("--batch-size", "8"),
+        ("--batch-size", "8", "--prefetch", "0"),
+        ("--batch-size", "3", "--workers", "2"),
+        ("--batch-size", "8", "--gt-cache", "{tmp_dir}/gt_cache"),
+        ("--batch-size", "8", "--max-memory", "1"),
+        )
+
+
+def evaluate_cli(root, estimate_dirs, result_filename, options):
+    methods = ["{}={}".format(name, directory) for name, directory in sorted(estimate_dirs.items())]
+    process = subprocess.run([sys.executable, "opticalflow_evaluate.py", root] + methods +
+                             ["--dataset", "kitti", "--result", result_filename, "--latex", ""] + list(options),
+                             cwd=ROOT, capture_output=True, text=True)
+    if process.returncode != 0:
+        print(process.stderr)
+        raise AssertionError("evaluation with {} failed".format(" ".join(options)))
+
+
+def check(tmp_dir):
+    estimate_dirs = make_kitti(tmp_dir)
+    for extended in (False, True):
+        reference = None
+        for n, run in enumerate(RUNS):
+            options = [option.format(tmp_dir=tmp_dir) for option in run] + (["--extended"] if extended else [])
+            result_filename = os.path.join(tmp_dir, "result_{}_{}.pb".format(int(extended), n))
+            evaluate_cli(tmp_dir, estimate_dirs, result_filename, options)
+            if reference is None:
+                reference = result_filename
+            elif not filecmp.cmp(reference, result_filename, shallow=False):
+                raise AssertionError("results of {} differ from {}".format(" ".join(options), " ".join(RUNS[0])))
+            print("{:<50} ok".format(" ".join(run + (("--extended",) if extended else ()))))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        check(sys.argv[1])
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            check(tmp_dir)
+    print("KITTI results match for all options")
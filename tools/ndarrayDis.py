@@ -1,3 +1,25 @@
-import matplotlib.pyplot as plt
-plt.imshow()
-plt.show()
\ No newline at end of file
+# Display a flow field (.flo) color coded or a numpy array (.npy) as image.
+# Usage: python tools/ndarrayDis.py file.flo|file.npy
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import util as ut  # noqa: E402
+
+
+def show(array):
+    import matplotlib.pyplot as plt
+    plt.imshow(array)
+    plt.show()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: python tools/ndarrayDis.py file.flo|file.npy")
+        sys.exit(1)
+    if sys.argv[1].endswith(".npy"):
+        show(np.load(sys.argv[1]))
+    else:
+        show(ut.flow2RGB(ut.readFlowFiles(sys.argv[1]), -1)[:, :, ::-1])
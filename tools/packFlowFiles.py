@@ -0,0 +1,29 @@
+# Pack the .flo files of every sequence directory of an estimate directory into one flow container per sequence.
+# The evaluator reads a container only if the sequence directory is absent, so remove the .flo directories after
+# packing in place or pack into a new estimate directory.
+# Usage: python tools/packFlowFiles.py estimate_dir [output_dir]
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import file_parser as fp  # noqa: E402
+import util as ut  # noqa: E402
+
+
+def pack_estimates(estimate_dir, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    sequences, _ = fp.scan_dir(estimate_dir)
+    for sequence in sequences:
+        seq_path = os.path.join(estimate_dir, sequence)
+        names = sorted(name[:-4] for name in fp.scan_dir(seq_path)[1] if name.endswith(".flo"))
+        pack_filename = os.path.join(output_dir, sequence + ut.FLOW_PACK_EXTENSION)
+        ut.writeFlowPack(pack_filename, names, [ut.readFlowFiles(os.path.join(seq_path, name + ".flo"))
+                                                for name in names])
+        print("{}: {} frames".format(pack_filename, len(names)))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: python tools/packFlowFiles.py estimate_dir [output_dir]")
+        sys.exit(1)
+    pack_estimates(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else sys.argv[1])
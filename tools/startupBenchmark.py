@@ -0,0 +1,86 @@
+# Startup time of short commands, each measured in a fresh interpreter. Fails if rebuilding the report from stored
+# results takes longer than the budget or loads cv2, or if an evaluation whose first cv2 use happens in the prefetch
+# threads differs from the serial one.
+# Usage: python tools/startupBenchmark.py [result_file] [--repeat N] [--budget SECONDS]
+import argparse
+import filecmp
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from syntheticDataset import make_sintel  # noqa: E402
+
+COMMANDS = {
+    "python": "pass",
+    "import numpy": "import numpy",
+    "import util": "import util",
+    "import report": "import report",
+    "import opticalflow_evaluate": "import opticalflow_evaluate",
+    "import cv2": "import cv2",
+    # cv2 is imported lazily on first use
+    "report": "import report, sys; report.getLatexTable({result!r})\n"
+              "assert 'cv2' not in sys.modules, 'cv2 was loaded'",
+}
+
+
+def evaluate_cli(root, estimate_dirs, result_filename, *options):
+    """
+    Evaluate the synthetic dataset with opticalflow_evaluate.py in a fresh interpreter
+    """
+    methods = ["{}={}".format(name, directory) for name, directory in sorted(estimate_dirs.items())]
+    process = subprocess.run([sys.executable, "opticalflow_evaluate.py", root] + methods +
+                             ["--result", result_filename, "--latex", ""] + list(options),
+                             cwd=ROOT, capture_output=True, text=True)
+    if process.returncode != 0:
+        print(process.stderr)
+        raise AssertionError("evaluation with {} failed".format(" ".join(options)))
+
+
+def check_threaded_prefetch(repeat):
+    """
+    In a fresh interpreter the first cv2 use happens concurrently in the prefetch threads. Every run has to give
+    the same results as the serial evaluation.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        estimate_dirs = make_sintel(tmp_dir)
+        serial_filename = os.path.join(tmp_dir, "serial.pb")
+        evaluate_cli(tmp_dir, estimate_dirs, serial_filename, "--prefetch", "0", "--batch-size", "1")
+        threaded_filename = os.path.join(tmp_dir, "threaded.pb")
+        times = list()
+        for _ in range(repeat):
+            start = time.perf_counter()
+            evaluate_cli(tmp_dir, estimate_dirs, threaded_filename, "--prefetch", "2", "--batch-size", "1")
+            times.append(time.perf_counter() - start)
+            if not filecmp.cmp(serial_filename, threaded_filename, shallow=False):
+                raise AssertionError("threaded prefetch results differ from the serial evaluation")
+    return min(times)
+
+
+def run(code, repeat):
+    times = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("result", nargs="?", default=os.path.join(ROOT, "short_term_results.pb"))
+    parser.add_argument("--repeat", type=int, default=5, help="runs per command, the fastest one is reported")
+    parser.add_argument("--budget", type=float, default=1.0, help="maximal seconds of the report command")
+    args = parser.parse_args()
+
+    timings = dict()
+    for name, code in COMMANDS.items():
+        timings[name] = run(code.format(result=os.path.abspath(args.result)), args.repeat)
+        print("{:<30} {:8.3f} s".format(name, timings[name]))
+    print("{:<30} {:8.3f} s".format("evaluate prefetch 2", check_threaded_prefetch(args.repeat)))
+    if timings["report"] > args.budget:
+        print("report took {:.3f} s, budget {:.3f} s".format(timings["report"], args.budget))
+        sys.exit(1)
@@ -0,0 +1,85 @@
+# Small synthetic datasets in the MPI-Sintel and KITTI layouts with estimates of two methods, used by the checks in
+# tools/ to run the evaluator from the command line without the real datasets.
+# Usage: python tools/syntheticDataset.py sintel|kitti output_dir
+import os
+import sys
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import util as ut  # noqa: E402
+
+SINTEL_SEQUENCES = ("seq_0", "seq_1_hDyn", "seq_2")
+# KITTI frames differ slightly in size, so batches have to be padded
+KITTI_SIZES = ((75, 248), (76, 247), (74, 244), (75, 248), (73, 246), (75, 248))
+# noise of the estimates of every method
+METHOD_NOISE = {"A": 1.0, "B": 3.0}
+
+
+def write_estimates(out_dir, relative_name, gt_flow, rng):
+    """
+    Write the estimates of all methods of METHOD_NOISE below out_dir/estimate/<method>/
+    """
+    base = np.where(np.abs(gt_flow) > 900, 0, gt_flow)
+    for method, noise in METHOD_NOISE.items():
+        filename = os.path.join(out_dir, "estimate", method, relative_name)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        ut.writeFlowFile(filename, base + noise * rng.standard_normal(base.shape).astype(np.float32))
+
+
+def make_sintel(out_dir, frames=4, size=(64, 96), seed=0):
+    """
+    MPI-Sintel layout below out_dir/training/ with the estimates in out_dir/estimate/<method>/
+    :return: dict of method name to estimate directory
+    """
+    rng = np.random.default_rng(seed)
+    h, w = size
+    for sequence in SINTEL_SEQUENCES:
+        for key in ("clean", "flow", "occlusions"):
+            os.makedirs(os.path.join(out_dir, "training", key, sequence), exist_ok=True)
+        for n in range(1, frames + 2):
+            name = "frame_{:04d}".format(n)
+            cv2.imwrite(os.path.join(out_dir, "training", "clean", sequence, name + ".png"),
+                        (rng.random((h, w, 3)) * 255).astype(np.uint8))
+            if n > frames:
+                continue
+            gt_flow = (rng.standard_normal((h, w, 2)) * 10).astype(np.float32)
+            gt_flow[rng.random((h, w)) > 0.99] = 1000
+            ut.writeFlowFile(os.path.join(out_dir, "training", "flow", sequence, name + ".flo"), gt_flow)
+            cv2.imwrite(os.path.join(out_dir, "training", "occlusions", sequence, name + ".png"),
+                        ((rng.random((h, w)) > 0.8) * 255).astype(np.uint8))
+            write_estimates(out_dir, os.path.join(sequence, name + ".flo"), gt_flow, rng)
+    return {method: os.path.join(out_dir, "estimate", method) for method in METHOD_NOISE}
+
+
+def make_kitti(out_dir, sizes=KITTI_SIZES, seed=0):
+    """
+    KITTI layout below out_dir/training/ with the estimates in out_dir/estimate/<method>/
+    :return: dict of method name to estimate directory
+    """
+    rng = np.random.default_rng(seed)
+    training = os.path.join(out_dir, "training")
+    for key in ("image_2", "flow_occ", "flow_noc"):
+        os.makedirs(os.path.join(training, key), exist_ok=True)
+    for i, (h, w) in enumerate(sizes):
+        name = "{:06d}_10".format(i)
+        for suffix in ("_10", "_11"):
+            cv2.imwrite(os.path.join(training, "image_2", "{:06d}{}.png".format(i, suffix)),
+                        (rng.random((h, w, 3)) * 255).astype(np.uint8))
+        flow = (rng.standard_normal((h, w, 2)) * 20).astype(np.float32)
+        flow[rng.random((h, w)) > 0.6] = np.nan
+        ut.writeKittiFlow(os.path.join(training, "flow_occ", name + ".png"), flow)
+        # the left border is occluded
+        flow[:, :w // 5] = np.nan
+        ut.writeKittiFlow(os.path.join(training, "flow_noc", name + ".png"), flow)
+        write_estimates(out_dir, name + ".flo", ut.readKittiFlow(os.path.join(training, "flow_occ", name + ".png")),
+                        rng)
+    return {method: os.path.join(out_dir, "estimate", method) for method in METHOD_NOISE}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3 or sys.argv[1] not in ("sintel", "kitti"):
+        print("Usage: python tools/syntheticDataset.py sintel|kitti output_dir")
+    else:
+        print({"sintel": make_sintel, "kitti": make_kitti}[sys.argv[1]](sys.argv[2]))
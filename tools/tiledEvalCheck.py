@@ -0,0 +1,75 @@
+# Checks that the tiled evaluation util.compute_error_tiled of memory-mapped frames is bit-identical to the
+# whole-frame kernel, that its traced peak memory stays within the budget and that too small budgets are rejected.
+# Usage: python tools/tiledEvalCheck.py [height width]
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import util as ut  # noqa: E402
+from errorKernelCheck import random_frame  # noqa: E402
+
+BUDGETS_MB = (16, 64, 128, 256)
+
+
+def whole_frame_sums(est_flow, gt_flow, mask_rgb, extended):
+    if extended:
+        labels, num_labels = ut.compute_extended_labels(gt_flow, mask_rgb), ut.NUM_EXTENDED_LABELS
+    else:
+        labels, num_labels = ut.compute_labels(gt_flow, mask_rgb), ut.NUM_LABELS
+    ee = ut.compute_ee(est_flow, gt_flow)
+    return ut.reduce_block_sums(*ut.compute_block_sums(ee[None], labels[None], num_labels=num_labels))[0]
+
+
+def check(h, w):
+    rng = np.random.default_rng(0)
+    est_flow, gt_flow, mask_rgb = random_frame(rng, h, w)
+    # a single large occluded area, so every boundary distance bin is populated
+    mask_rgb[:] = 0
+    mask_rgb[h // 4:3 * h // 4, w // 4:3 * w // 4] = 255
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        gt_filename = os.path.join(tmp_dir, "gt.flo")
+        est_filename = os.path.join(tmp_dir, "est.flo")
+        ut.writeFlowFile(gt_filename, gt_flow)
+        ut.writeFlowFile(est_filename, est_flow)
+        for extended in (False, True):
+            expected = whole_frame_sums(est_flow, gt_flow, mask_rgb, extended)
+            for budget_mb in BUDGETS_MB:
+                max_bytes = budget_mb * 2 ** 20
+                try:
+                    band_rows, estimate = ut.tiled_memory(h, w, max_bytes, extended)
+                except ValueError as e:
+                    try:
+                        ut.compute_error_tiled(est_flow, gt_flow, mask_rgb, max_bytes, extended)
+                    except ValueError:
+                        print("extended={:<5} budget {:4d} MB: rejected, {}".format(str(extended), budget_mb, e))
+                        continue
+                    raise AssertionError("extended={} budget {} MB: compute_error_tiled accepted a budget "
+                                         "tiled_memory rejects".format(extended, budget_mb))
+                tracemalloc.start()
+                start = time.perf_counter()
+                sums = ut.compute_error_tiled(ut.readFlowFiles(est_filename), ut.readFlowFiles(gt_filename),
+                                              mask_rgb, max_bytes, extended)
+                elapsed = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                if not np.array_equal(sums, expected):
+                    raise AssertionError("extended={} budget {} MB: tiled sums differ".format(extended, budget_mb))
+                if estimate > max_bytes or peak > max_bytes:
+                    raise AssertionError("extended={} budget {} MB: peak exceeds the budget".format(extended,
+                                                                                                 budget_mb))
+                print("extended={:<5} budget {:4d} MB: {:4d} rows/band, estimated {:6.1f} MB, traced peak {:6.1f} MB,"
+                      " {:.2f} s".format(str(extended), budget_mb, band_rows, estimate / 2 ** 20, peak / 2 ** 20,
+                                         elapsed))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3:
+        check(int(sys.argv[1]), int(sys.argv[2]))
+    else:
+        check(2160, 3840)
+    print("tiled evaluation matches the whole-frame kernel")
@@ -16,12 +16,61 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 # ---------------------------------------------------------------------
 import copy
-import pickle
+import functools
+import importlib.util
+import os
+import sys
+import threading
 
-import cv2
 import numpy as np
 
 
+class LazyModule:
+    """
+    Module imported on first attribute access, so commands that never need it do not pay its import time. Unlike
+    importlib.util.LazyLoader the import is guarded by a lock, so threads using the module for the first time at
+    the same moment, e.g. the prefetch threads, all see it fully initialized
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+def lazy_import(name):
+    """
+    Import a module on first attribute access, see LazyModule
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    if importlib.util.find_spec(name) is None:
+        raise ImportError("No module named '{}'".format(name))
+    return LazyModule(name)
+
+
+cv2 = lazy_import("cv2")
+
+# reporting functions moved to report, still available from util
+REPORT_FUNCTIONS = ("get_sequence_measures", "avg_sequence", "avg_sequences", "sequences_to_tuple", "load_results",
+                    "getLatexTable", "getExtendedLatexTable", "avg_measures", "avg_measures_no_dict",
+                    "avg_measures_test")
+
+
+def __getattr__(name):
+    if name in REPORT_FUNCTIONS:
+        import report
+        return getattr(report, name)
+    raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name))
+
+
 def create_config(parameter, filelist):
     """
     Return the filelist, method, index
@@ -31,7 +80,7 @@ def create_config(parameter, filelist):
     """
     config_list = list()
     for id, f in enumerate(filelist):
-        file_list = copy.deepcopy(f)
+        file_list = dict(f)  # values are strings, a shallow copy is enough
         config_list.append({"files": file_list, "parameter": copy.deepcopy(parameter), "file_index": id})
 
     return config_list
@@ -59,7 +108,10 @@ def computer_errors(ee_base, mask):
     return result
 
 
-def compute_error(est_flow, gt_flow, invalid_mask):
+def compute_error_reference(est_flow, gt_flow, invalid_mask):
+    """
+    Multi-pass OpenCV implementation of compute_error, kept as reference for the fused kernel
+    """
     mag_flow = cv2.sqrt(gt_flow[:, :, 0] * gt_flow[:, :, 0] + gt_flow[:, :, 1] * gt_flow[:, :, 1])
     ret, mask_to_large = cv2.threshold(src=mag_flow, thresh=900, maxval=1, type=cv2.THRESH_BINARY_INV)
 
@@ -76,292 +128,743 @@ def compute_error(est_flow, gt_flow, invalid_mask):
     return result
 
 
-def readFlowFiles(filename):
-    with open(filename, 'rb') as f:
-        magic = np.fromfile(f, np.float32, count=1)
-        if 202021.25 != magic:
-            print("Magic number incorrect. Invalid .flo file")
+REGIONS = ("FG", "BG", "Total")
+MEASURES = ("ee", "R1", "R2", "R3", "noPoints")
+THRESHOLDS = (1, 2, 3)
+
+LABEL_FG = 0
+LABEL_BG = 1
+LABEL_INVALID = 2
+NUM_LABELS = 3
+
+# regions of the official Sintel breakdown: matched (FG) and unmatched (BG) pixels, ground truth speed bins and
+# bins of the distance to the nearest occlusion boundary, see compute_extended_labels
+EXTENDED_REGIONS = ("matched", "unmatched", "s0-10", "s10-40", "s40+", "d0-10", "d10-60", "d60-140")
+SPEED_EDGES = (10, 40)
+DISTANCE_EDGES = (10, 60, 140)
+# label, speed bin and distance bin (the last one beyond DISTANCE_EDGES) combined into one label
+NUM_EXTENDED_LABELS = NUM_LABELS * (len(SPEED_EDGES) + 1) * (len(DISTANCE_EDGES) + 1)
+
+# rows accumulated into one partial sum, see compute_block_sums
+BLOCK_ROWS = 16
+
+
+def compute_labels(gt_flow, invalid_mask):
+    """
+    Create the region label image of a frame pair or of a stack of frame pairs
+    :param gt_flow: ground truth optical flow (h, w, 2) or stack (N, h, w, 2)
+    :param invalid_mask: mask image (h, w, 3) / (h, w) or stack, pixels > 0 belong to the BG region
+    :return: uint8 image with LABEL_FG, LABEL_BG or LABEL_INVALID (ground truth magnitude > 900)
+    """
+    mag_flow = np.sqrt(gt_flow[..., 0] * gt_flow[..., 0] + gt_flow[..., 1] * gt_flow[..., 1])
+    if invalid_mask.ndim == gt_flow.ndim:
+        gray = cv2.cvtColor(invalid_mask.reshape(-1, invalid_mask.shape[-2], 3), cv2.COLOR_BGR2GRAY)
+        invalid_mask = gray.reshape(invalid_mask.shape[:-1])
+    labels = (invalid_mask > 0.5).astype(np.uint8)
+    labels[mag_flow > 900] = LABEL_INVALID
+    return labels
+
+
+def compute_boundary_distance(invalid_mask):
+    """
+    Distance of every pixel to the nearest boundary of the occlusion mask
+    :param invalid_mask: mask image (h, w, 3) or (h, w), pixels > 0 are occluded
+    :return: float32 distance image (h, w)
+    """
+    if invalid_mask.ndim == 3:
+        invalid_mask = cv2.cvtColor(invalid_mask, cv2.COLOR_BGR2GRAY)
+    occluded = (invalid_mask > 0.5).astype(np.uint8)
+    boundary = cv2.morphologyEx(occluded, cv2.MORPH_GRADIENT, np.ones((3, 3), dtype=np.uint8))
+    return cv2.distanceTransform((boundary == 0).astype(np.uint8), cv2.DIST_L2, cv2.DIST_MASK_PRECISE)
+
+
+def compute_extended_labels(gt_flow, invalid_mask, distance_bin=None):
+    """
+    Create the combined label image of the FG/BG label, the ground truth speed bin and the boundary distance bin
+    of a frame pair or of a stack of frame pairs. Compute it once per ground truth frame, e.g. with the GTCache.
+    :param gt_flow: ground truth optical flow (h, w, 2) or stack (N, h, w, 2)
+    :param invalid_mask: mask image (h, w, 3) / (h, w) or stack, pixels > 0 belong to the BG region
+    :param distance_bin: optional precomputed distance bins of the same rows, e.g. when labeling row bands
+    :return: uint8 image label + NUM_LABELS * (speed bin + (len(SPEED_EDGES) + 1) * distance bin), see
+    compute_labels
+    """
+    labels = compute_labels(gt_flow, invalid_mask)
+    mag_flow = np.sqrt(gt_flow[..., 0] * gt_flow[..., 0] + gt_flow[..., 1] * gt_flow[..., 1])
+    speed_bin = np.digitize(mag_flow, SPEED_EDGES).astype(np.uint8)
+    if distance_bin is None and gt_flow.ndim == 3:
+        distance_bin = np.digitize(compute_boundary_distance(invalid_mask), DISTANCE_EDGES).astype(np.uint8)
+    elif distance_bin is None:
+        distance = np.stack([compute_boundary_distance(mask) for mask in invalid_mask])
+        distance_bin = np.digitize(distance, DISTANCE_EDGES).astype(np.uint8)
+    speed_bin += np.uint8(len(SPEED_EDGES) + 1) * distance_bin
+    labels += np.uint8(NUM_LABELS) * speed_bin
+    return labels
+
+
+def compute_ee(est_flow, gt_flow):
+    """
+    Endpoint error image of a frame pair (h, w, 2) or of a stack of frame pairs (N, h, w, 2)
+    """
+    diff_flow = est_flow - gt_flow
+    return np.sqrt(diff_flow[..., 0] * diff_flow[..., 0] + diff_flow[..., 1] * diff_flow[..., 1])
+
+
+def compute_block_sums(ee, labels, row_start=0, num_labels=NUM_LABELS):
+    """
+    Accumulate ee sums and threshold counts per frame, block of BLOCK_ROWS rows and label. Partial sums are
+    kept per block so any split of a frame into bands aligned to BLOCK_ROWS yields bit-identical totals
+    :param ee: endpoint error images (N, rows, w)
+    :param labels: label images (N, rows, w) created by compute_labels or compute_extended_labels
+    :param row_start: index of the first row within the frame, must be a multiple of BLOCK_ROWS
+    :param num_labels: number of distinct labels, NUM_EXTENDED_LABELS for compute_extended_labels
+    :return: ee sums (N, blocks, num_labels) and counts (N, blocks, num_labels, len(THRESHOLDS) + 1) indexed by
+    exceeded thresholds
+    """
+    n, rows = ee.shape[:2]
+    blocks = (rows + BLOCK_ROWS - 1) // BLOCK_ROWS
+    index_type = np.uint32 if n * blocks * num_labels * 4 < 2 ** 32 else np.intp
+    block_index = np.arange(rows, dtype=index_type) // index_type(BLOCK_ROWS)
+    block_index = (np.arange(n, dtype=index_type)[:, None] * index_type(blocks) + block_index)[:, :, None]
+    # number of exceeded thresholds per pixel, combined with block and label into one histogram bin
+    level = (ee > THRESHOLDS[0]).view(np.uint8)
+    for thresh in THRESHOLDS[1:]:
+        level = level + (ee > thresh).view(np.uint8)
+    block_label = block_index * index_type(num_labels) + labels
+    counts = np.bincount((block_label * index_type(4) + level).ravel(), minlength=num_labels * 4 * n * blocks)
+    ee_sums = np.bincount(block_label.ravel(), weights=ee.ravel(), minlength=num_labels * n * blocks)
+    return ee_sums.reshape(n, blocks, num_labels), counts.reshape(n, blocks, num_labels, 4)
+
+
+def counts_to_measures(ee_sums, counts, out):
+    """
+    Fill out (..., len(MEASURES)) with the ee sums (...) and the measures of the threshold counts (..., 4)
+    """
+    out[..., 0] = ee_sums
+    for k in range(len(THRESHOLDS)):
+        out[..., k + 1] = counts[..., k + 1:].sum(axis=-1)
+    out[..., 4] = counts.sum(axis=-1)
+    return out
+
+
+def reduce_block_sums(ee_sums, counts):
+    """
+    Reduce the per block sums of compute_block_sums to the error measures of every frame
+    :return: float64 array of shape (N, len(REGIONS), len(MEASURES)), extended by EXTENDED_REGIONS for sums of
+    compute_extended_labels
+    """
+    if ee_sums.shape[2] == NUM_EXTENDED_LABELS:
+        return reduce_extended_block_sums(ee_sums, counts)
+    ee_sums = ee_sums[:, :, :2].sum(axis=1)
+    counts = counts[:, :, :2].sum(axis=1)
+    sums = np.zeros((len(ee_sums), len(REGIONS), len(MEASURES)), dtype=np.float64)
+    counts_to_measures(ee_sums, counts, sums[:, :2])
+    sums[:, 2] = sums[:, 0] + sums[:, 1]
+    return sums
+
+
+def reduce_extended_block_sums(ee_sums, counts):
+    """
+    Reduce the per block sums of compute_block_sums over compute_extended_labels to the error measures of
+    REGIONS and EXTENDED_REGIONS of every frame
+    :return: float64 array of shape (N, len(REGIONS) + len(EXTENDED_REGIONS), len(MEASURES))
+    """
+    n = len(ee_sums)
+    bins = (n, len(DISTANCE_EDGES) + 1, len(SPEED_EDGES) + 1, NUM_LABELS)
+    # valid pixels per (distance bin, speed bin, FG/BG label)
+    ee_sums = ee_sums.sum(axis=1).reshape(bins)[..., :2]
+    counts = counts.sum(axis=1).reshape(bins + (4,))[..., :2, :]
+    sums = np.zeros((n, len(REGIONS) + len(EXTENDED_REGIONS), len(MEASURES)), dtype=np.float64)
+    counts_to_measures(ee_sums.sum(axis=(1, 2)), counts.sum(axis=(1, 2)), sums[:, :2])
+    sums[:, 2] = sums[:, 0] + sums[:, 1]
+    # matched and unmatched are the FG and BG pixels of the occlusion mask
+    sums[:, 3:5] = sums[:, 0:2]
+    speed = 5
+    counts_to_measures(ee_sums.sum(axis=(1, 3)), counts.sum(axis=(1, 3)), sums[:, speed:speed + len(SPEED_EDGES) + 1])
+    distance = speed + len(SPEED_EDGES) + 1
+    counts_to_measures(ee_sums.sum(axis=(2, 3))[:, :len(DISTANCE_EDGES)],
+                       counts.sum(axis=(2, 3))[:, :len(DISTANCE_EDGES)],
+                       sums[:, distance:distance + len(DISTANCE_EDGES)])
+    return sums
+
+
+def compute_error_sums_batch(ee, labels):
+    """
+    Accumulate all error measures of a stack of frame pairs in a single pass over the label images
+    :param ee: endpoint error images (N, h, w)
+    :param labels: label images (N, h, w) created by compute_labels
+    :return: float64 array of shape (N, len(REGIONS), len(MEASURES))
+    """
+    return reduce_block_sums(*compute_block_sums(ee, labels))
+
+
+def compute_error_sums(ee, labels):
+    """
+    Accumulate all error measures of one frame pair in a single pass over the label image
+    :param ee: endpoint error image
+    :param labels: label image created by compute_labels
+    :return: float64 array of shape (len(REGIONS), len(MEASURES))
+    """
+    return compute_error_sums_batch(ee[None], labels[None])[0]
+
+
+def error_sums_to_dict(sums):
+    """
+    Convert an array created by compute_error_sums into the {"FG": {"ee": ...}, ...} result layout, extended sums
+    additionally contain the EXTENDED_REGIONS
+    """
+    return {region: {measure: float(sums[r, m]) for m, measure in enumerate(MEASURES)}
+            for r, region in enumerate((REGIONS + EXTENDED_REGIONS)[:len(sums)])}
+
+
+def compute_error(est_flow, gt_flow, invalid_mask):
+    """
+    Compute ee, R1, R2, R3 and the number of points for the FG, BG and Total region of a frame pair
+    :param est_flow: estimated optical flow (h, w, 2)
+    :param gt_flow: ground truth optical flow (h, w, 2)
+    :param invalid_mask: mask image, pixels > 0 belong to the BG region
+    :return: {"FG": {"ee", "R1", "R2", "R3", "noPoints"}, "BG": {...}, "Total": {...}}
+    """
+    return compute_error_labels(est_flow, gt_flow, compute_labels(gt_flow, invalid_mask))
+
+
+def compute_error_labels(est_flow, gt_flow, labels, extended=False):
+    """
+    Same as compute_error for an already computed label image, see compute_labels
+    :param extended: labels were created by compute_extended_labels, the result then contains EXTENDED_REGIONS
+    """
+    ee = compute_ee(est_flow, gt_flow)
+    if extended:
+        return error_sums_to_dict(reduce_block_sums(*compute_block_sums(ee[None], labels[None],
+                                                                         num_labels=NUM_EXTENDED_LABELS))[0])
+    return error_sums_to_dict(compute_error_sums(ee, labels))
+
+
+def compute_error_extended(est_flow, gt_flow, invalid_mask):
+    """
+    Same as compute_error, additionally with the matched/unmatched, speed and boundary distance regions of
+    EXTENDED_REGIONS, all accumulated in one pass over the endpoint error image
+    """
+    return compute_error_labels(est_flow, gt_flow, compute_extended_labels(gt_flow, invalid_mask), extended=True)
+
+
+def compute_error_batch(est_flows, gt_flows, invalid_masks=None, chunk_pixels=2 ** 16, labels=None, gt_index=None,
+                        extended=False):
+    """
+    Compute the error measures of a stack of frame pairs. The stack is processed in chunks of whole frames or,
+    for large frames, of row bands so temporaries stay bounded by chunk_pixels
+    :param est_flows: estimated optical flow (N, h, w, 2)
+    :param gt_flows: ground truth optical flow (N, h, w, 2)
+    :param invalid_masks: mask images (N, h, w, 3) or (N, h, w)
+    :param chunk_pixels: number of pixels processed at once
+    :param labels: precomputed label images (N, h, w), replaces invalid_masks
+    :param gt_index: optional (N,) index of the ground truth of every estimate. Ground truth, masks and labels then
+    hold one entry per distinct frame pair, e.g. to score several methods against the same ground truth
+    :param extended: also compute EXTENDED_REGIONS, labels then must be created by compute_extended_labels. The
+    boundary distance needs whole frames, so masks are labeled before banding
+    :return: float64 array of shape (N, len(REGIONS), len(MEASURES)), see error_sums_to_dict
+    """
+    n, h, w = est_flows.shape[:3]
+    if gt_index is None:
+        gt_index = np.arange(n)
+    num_labels = NUM_LABELS
+    if extended:
+        num_labels = NUM_EXTENDED_LABELS
+        if labels is None:
+            labels = compute_extended_labels(gt_flows, invalid_masks)
+    blocks = (h + BLOCK_ROWS - 1) // BLOCK_ROWS
+    ee_sums = np.zeros((n, blocks, num_labels), dtype=np.float64)
+    counts = np.zeros((n, blocks, num_labels, len(THRESHOLDS) + 1), dtype=np.intp)
+    frames = max(1, chunk_pixels // (h * w))
+    band_rows = h if frames > 1 else max(BLOCK_ROWS, (chunk_pixels // w) // BLOCK_ROWS * BLOCK_ROWS)
+    for start in range(0, n, frames):
+        stop = min(n, start + frames)
+        frame_index = gt_index[start:stop]
+        for row in range(0, h, band_rows):
+            gt_flow = gt_flows[frame_index, row:row + band_rows]
+            if labels is None:
+                band_labels = compute_labels(gt_flow, invalid_masks[frame_index, row:row + band_rows])
+            else:
+                band_labels = labels[frame_index, row:row + band_rows]
+            ee = compute_ee(est_flows[start:stop, row:row + band_rows], gt_flow)
+            block = row // BLOCK_ROWS
+            band_ee_sums, band_counts = compute_block_sums(ee, band_labels, row, num_labels)
+            ee_sums[start:stop, block:block + band_ee_sums.shape[1]] = band_ee_sums
+            counts[start:stop, block:block + band_ee_sums.shape[1]] = band_counts
+    return reduce_block_sums(ee_sums, counts)
+
+
+# upper bound of the band temporaries of compute_error_tiled per pixel: flow copies, difference, endpoint error,
+# labels, histogram indices and the float64 weights of np.bincount
+TILE_BYTES_PER_PIXEL = 96
+# full-frame buffers of compute_error_tiled per pixel: color and gray mask, for extended regions also the
+# boundary distance transform and the temporaries of compute_boundary_distance
+TILE_FRAME_BYTES_PER_PIXEL = 4
+TILE_FRAME_BYTES_PER_PIXEL_EXTENDED = 12
+
+
+def tiled_memory(h, w, max_bytes=2 ** 26, extended=False):
+    """
+    Band height and estimated peak memory of compute_error_tiled for a frame of size (h, w)
+    :param max_bytes: memory budget, the estimated peak never exceeds it
+    :return: (band rows, estimated peak bytes)
+    :raises ValueError: if the full-frame buffers and a band of BLOCK_ROWS rows exceed max_bytes
+    """
+    frame_bytes = (TILE_FRAME_BYTES_PER_PIXEL_EXTENDED if extended else TILE_FRAME_BYTES_PER_PIXEL) * h * w
+    blocks = (h + BLOCK_ROWS - 1) // BLOCK_ROWS
+    block_bytes = blocks * (NUM_EXTENDED_LABELS if extended else NUM_LABELS) * (len(THRESHOLDS) + 2) * 8
+    min_bytes = frame_bytes + block_bytes + BLOCK_ROWS * w * TILE_BYTES_PER_PIXEL
+    if min_bytes > max_bytes:
+        raise ValueError("The tiled evaluation{} of {}x{} frames needs a memory budget of at least {:.1f} MB, got "
+                         "{:.1f} MB".format(" with extended regions" if extended else "", w, h, min_bytes / 2 ** 20,
+                                            max_bytes / 2 ** 20))
+    band_rows = (max_bytes - frame_bytes - block_bytes) // (TILE_BYTES_PER_PIXEL * w) // BLOCK_ROWS * BLOCK_ROWS
+    band_rows = int(min(band_rows, blocks * BLOCK_ROWS))
+    return band_rows, frame_bytes + block_bytes + band_rows * w * TILE_BYTES_PER_PIXEL
+
+
+def compute_error_tiled(est_flow, gt_flow, invalid_mask, max_bytes=2 ** 26, extended=False):
+    """
+    Compute the error measures of one frame pair in row bands aligned to BLOCK_ROWS, e.g. for high resolution
+    frames. The flow fields are best memory-mapped (see readFlowFiles), so only the current band is read into
+    memory. The sums are bit-identical to compute_error_sums of the whole frame.
+    :param est_flow: estimated optical flow (h, w, 2)
+    :param gt_flow: ground truth optical flow (h, w, 2)
+    :param invalid_mask: mask image (h, w, 3) or (h, w), pixels > 0 belong to the BG region
+    :param max_bytes: memory budget of the temporaries, see tiled_memory
+    :param extended: also compute EXTENDED_REGIONS
+    :return: float64 array of shape (len(REGIONS), len(MEASURES)), extended by EXTENDED_REGIONS
+    :raises ValueError: if max_bytes is too small for the frame size, see tiled_memory
+    """
+    h, w = gt_flow.shape[:2]
+    if invalid_mask.ndim == 3:
+        invalid_mask = cv2.cvtColor(invalid_mask, cv2.COLOR_BGR2GRAY)
+    distance = compute_boundary_distance(invalid_mask) if extended else None
+    num_labels = NUM_EXTENDED_LABELS if extended else NUM_LABELS
+    band_rows = tiled_memory(h, w, max_bytes, extended)[0]
+    blocks = (h + BLOCK_ROWS - 1) // BLOCK_ROWS
+    ee_sums = np.zeros((1, blocks, num_labels), dtype=np.float64)
+    counts = np.zeros((1, blocks, num_labels, len(THRESHOLDS) + 1), dtype=np.intp)
+    for row in range(0, h, band_rows):
+        gt_band = np.asarray(gt_flow[row:row + band_rows])
+        if extended:
+            distance_bin = np.digitize(distance[row:row + band_rows], DISTANCE_EDGES).astype(np.uint8)
+            labels = compute_extended_labels(gt_band, invalid_mask[row:row + band_rows], distance_bin)
         else:
-            w = np.fromfile(f, np.int32, count=1)[0]
-            h = np.fromfile(f, np.int32, count=1)[0]
-            data = np.fromfile(f, np.float32, count=2 * w * h)
-            # Reshape data into 3D array (columns, rows, bands)
-            data2D = np.resize(data, (h, w, 2))
-    return data2D
+            labels = compute_labels(gt_band, invalid_mask[row:row + band_rows])
+        ee = compute_ee(np.asarray(est_flow[row:row + band_rows]), gt_band)
+        del gt_band
+        band_ee_sums, band_counts = compute_block_sums(ee[None], labels[None], row, num_labels)
+        block = row // BLOCK_ROWS
+        ee_sums[:, block:block + band_ee_sums.shape[1]] = band_ee_sums
+        counts[:, block:block + band_ee_sums.shape[1]] = band_counts
+    return reduce_block_sums(ee_sums, counts)[0]
+
+
+FLOW_TAG_FLOAT = 202021.25
+FLOW_HEADER_SIZE = 12
+
+# sequence container: magic, int32 frames, height, width and name size, the zero padded frame names and, aligned
+# to FLOW_PACK_ALIGN bytes, the contiguous float32 frames. Frames of a container are addressed as
+# <sequence>.flopack#<frame name>
+FLOW_PACK_EXTENSION = ".flopack"
+FLOW_PACK_MAGIC = b"FLOPACK1"
+FLOW_PACK_HEADER_SIZE = 24
+FLOW_PACK_ALIGN = 64
+FLOW_PACK_SEPARATOR = "#"
+
+# KITTI flow: 16-bit PNG with the channels (u, v, valid) stored as RGB, flow = (value - KITTI_FLOW_OFFSET) /
+# KITTI_FLOW_SCALE. Pixels without ground truth are set to UNKNOWN_FLOW, so compute_labels marks them invalid
+KITTI_FLOW_EXTENSION = ".png"
+KITTI_FLOW_OFFSET = 2 ** 15
+KITTI_FLOW_SCALE = 64.0
+UNKNOWN_FLOW = 1e10
+
+
+def readFlowHeader(filename):
+    """
+    Read and validate the header of a .flo file
+    :param filename: path to the .flo file
+    :return: (width, height)
+    """
+    with open(filename, 'rb') as f:
+        header = f.read(FLOW_HEADER_SIZE)
+        file_size = os.fstat(f.fileno()).st_size
+    if len(header) < FLOW_HEADER_SIZE:
+        raise ValueError("Invalid .flo file {}: truncated header".format(filename))
+    magic = np.frombuffer(header, np.float32, count=1, offset=0)[0]
+    if magic != FLOW_TAG_FLOAT:
+        raise ValueError("Invalid .flo file {}: magic number incorrect ({})".format(filename, magic))
+    w, h = np.frombuffer(header, np.int32, count=2, offset=4)
+    if w <= 0 or h <= 0:
+        raise ValueError("Invalid .flo file {}: bad size {}x{}".format(filename, w, h))
+    expected_size = FLOW_HEADER_SIZE + 8 * int(w) * int(h)
+    if file_size != expected_size:
+        raise ValueError("Invalid .flo file {}: expected {} bytes for {}x{}, found {}".format(
+            filename, expected_size, w, h, file_size))
+    return int(w), int(h)
+
+
+def readFlowFiles(filename, rows=None, roi=None):
+    """
+    Read a .flo file as a memory-mapped (h, w, 2) float32 array. Nothing is copied, pixels are only read from
+    disk when they are accessed. Frames of a flow container and KITTI flow PNGs (see readKittiFlow) are accepted
+    as well
+    :param filename: path to the .flo file
+    :param rows: optional (start, stop) range of rows to return
+    :param roi: optional (y0, y1, x0, x1) region to return
+    :return: flow view of shape (h, w, 2)
+    """
+    pack_filename, frame = split_flow_path(filename)
+    if frame is not None:
+        frame_index, flows = readFlowPack(pack_filename)
+        if frame not in frame_index:
+            raise ValueError("Flow container {} has no frame {}".format(pack_filename, frame))
+        flow = flows[frame_index[frame]]
+    elif filename.endswith(KITTI_FLOW_EXTENSION):
+        flow = readKittiFlow(filename)
+    else:
+        w, h = readFlowHeader(filename)
+        flow = np.memmap(filename, dtype=np.float32, mode='r', offset=FLOW_HEADER_SIZE, shape=(h, w, 2))
+    if rows is not None:
+        flow = flow[rows[0]:rows[1]]
+    if roi is not None:
+        flow = flow[roi[0]:roi[1], roi[2]:roi[3]]
+    return flow
+
+
+def readFlowFilesBatch(filenames, roi=None):
+    """
+    Read several .flo files of the same size into one stacked array
+    :param filenames: list of paths to .flo files
+    :param roi: optional (y0, y1, x0, x1) region to read from every file
+    :return: array of shape (N, h, w, 2)
+    """
+    out = None
+    for n, filename in enumerate(filenames):
+        flow = readFlowFiles(filename, roi=roi)
+        if out is None:
+            out = np.empty((len(filenames),) + flow.shape, dtype=np.float32)
+        elif flow.shape != out.shape[1:]:
+            raise ValueError("Flow file {} has shape {}, expected {}".format(filename, flow.shape, out.shape[1:]))
+        out[n] = flow
+    if out is None:
+        out = np.empty((0, 0, 0, 2), dtype=np.float32)
+    return out
+
+
+def validate_flow(flow, filename=""):
+    """
+    Check that flow is a (h, w, 2) floating point field and return it as contiguous little-endian float32 array
+    """
+    flow = np.asarray(flow)
+    if flow.ndim != 3 or flow.shape[2] != 2 or flow.shape[0] == 0 or flow.shape[1] == 0:
+        raise ValueError("Invalid flow for {}: expected shape (h, w, 2), got {}".format(filename, flow.shape))
+    if flow.dtype.kind != "f":
+        raise ValueError("Invalid flow for {}: expected floating point values, got {}".format(filename, flow.dtype))
+    return np.ascontiguousarray(flow, dtype="<f4")
+
+
+def flow_header(width, height):
+    """
+    Header of a .flo file: tag, width and height
+    """
+    return np.array([FLOW_TAG_FLOAT], dtype="<f4").tobytes() + np.array([width, height], dtype="<i4").tobytes()
 
 
 def writeFlowFile(filename, flow):
-    TAG_STRING = np.array(202021.25, dtype=np.float32)
-    assert flow.shape[2] == 2
-    h = np.array(flow.shape[0], dtype=np.int32)
-    w = np.array(flow.shape[1], dtype=np.int32)
+    """
+    Write a .flo file, flow is converted to float32
+    :param flow: array of shape (h, w, 2)
+    """
+    flow = validate_flow(flow, filename)
     with open(filename, 'wb') as f:
-        f.write(TAG_STRING.tobytes())
-        f.write(w.tobytes())
-        f.write(h.tobytes())
-        f.write(flow.tobytes())
+        f.write(flow_header(flow.shape[1], flow.shape[0]))
+        f.write(flow.data)
+
+
+def writeFlowFiles(filenames, flows, num_threads=4):
+    """
+    Write several .flo files in parallel, the file system calls of the threads overlap
+    :param filenames: list of paths
+    :param flows: (N, h, w, 2) array or list of (h, w, 2) arrays
+    """
+    if len(filenames) != len(flows):
+        raise ValueError("Got {} filenames for {} flow fields".format(len(filenames), len(flows)))
+    import concurrent.futures
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, num_threads)) as pool:
+        for future in [pool.submit(writeFlowFile, filename, flow) for filename, flow in zip(filenames, flows)]:
+            future.result()
+
+
+def readKittiImage(filename):
+    """
+    Read a 16-bit KITTI flow PNG
+    :return: uint16 array (h, w, 3) in OpenCV channel order (valid, v, u)
+    """
+    image = cv2.imread(filename, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError("Could not read KITTI flow {}".format(filename))
+    if image.dtype != np.uint16 or image.ndim != 3 or image.shape[2] != 3:
+        raise ValueError("Invalid KITTI flow {}: expected a 16-bit 3 channel PNG, got {} {}".format(
+            filename, image.dtype, image.shape))
+    return image
+
+
+def readKittiFlow(filename):
+    """
+    Decode a KITTI flow PNG, pixels without ground truth are set to UNKNOWN_FLOW
+    :return: float32 flow (h, w, 2)
+    """
+    image = readKittiImage(filename)
+    flow = (image[:, :, 2:0:-1].astype(np.float32) - KITTI_FLOW_OFFSET) / KITTI_FLOW_SCALE
+    flow[image[:, :, 0] == 0] = UNKNOWN_FLOW
+    return flow
+
+
+def writeKittiFlow(filename, flow):
+    """
+    Write flow as KITTI flow PNG, pixels with a magnitude > 900 or non-finite values are stored as invalid
+    """
+    flow = validate_flow(flow, filename)
+    valid = np.isfinite(flow).all(axis=2) & (np.hypot(flow[:, :, 0], flow[:, :, 1]) <= 900)
+    image = np.zeros(flow.shape[:2] + (3,), dtype=np.uint16)
+    values = np.clip(np.where(valid[:, :, None], flow, 0) * KITTI_FLOW_SCALE + KITTI_FLOW_OFFSET, 0, 2 ** 16 - 1)
+    image[:, :, 2:0:-1] = np.rint(values).astype(np.uint16)
+    image[:, :, 0] = valid
+    if not cv2.imwrite(filename, image):
+        raise ValueError("Could not write KITTI flow {}".format(filename))
+
+
+def readMask(filename, shape=None):
+    """
+    Read the occlusion mask of a frame pair, pixels > 0 belong to the BG region
+    :param filename: mask image. A 16-bit KITTI flow PNG of the non-occluded pixels (flow_noc) marks all pixels
+    without valid flow as occluded, an empty filename stands for a dataset without occlusion masks
+    :param shape: (h, w) of the mask of an empty filename
+    :return: mask (h, w, 3) or (h, w)
+    :raises ValueError: if the file could not be read
+    """
+    if len(filename) == 0:
+        return np.zeros(shape, dtype=np.uint8)
+    # a single decode, gray masks stay single channel
+    image = cv2.imread(filename, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError("Could not read mask {}".format(filename))
+    if image.ndim == 2:
+        return image
+    if image.dtype == np.uint16 and filename.endswith(KITTI_FLOW_EXTENSION):
+        return (image[:, :, 0] == 0).astype(np.uint8) * np.uint8(255)
+    return image[:, :, :3]
+
+
+def stack_padded(arrays, fill_value=0):
+    """
+    Stack arrays of possibly different height and width, smaller arrays are padded at the bottom and right with
+    fill_value
+    :param arrays: list of arrays (h, w, ...) with equal trailing dimensions
+    :return: array (N, max h, max w, ...)
+    """
+    shapes = set(array.shape for array in arrays)
+    if len(shapes) <= 1:
+        return np.stack(arrays)
+    h = max(shape[0] for shape in shapes)
+    w = max(shape[1] for shape in shapes)
+    out = np.full((len(arrays), h, w) + arrays[0].shape[2:], fill_value, dtype=arrays[0].dtype)
+    for n, array in enumerate(arrays):
+        out[n, :array.shape[0], :array.shape[1]] = array
+    return out
+
+
+def split_flow_path(filename):
+    """
+    Split a frame path <sequence>.flopack#<frame name> of a flow container
+    :return: (container filename, frame name), (filename, None) for other files
+    """
+    pack_filename, separator, frame = filename.rpartition(FLOW_PACK_SEPARATOR)
+    if separator and pack_filename.endswith(FLOW_PACK_EXTENSION):
+        return pack_filename, frame
+    return filename, None
+
+
+def flow_pack_path(pack_filename, frame):
+    """
+    Path of a frame of a flow container, accepted by readFlowFiles
+    """
+    return pack_filename + FLOW_PACK_SEPARATOR + frame
+
+
+def readFlowPackHeader(filename):
+    """
+    Read and validate the header and the frame index of a flow container
+    :return: (frame names, height, width, offset of the first frame)
+    """
+    with open(filename, 'rb') as f:
+        header = f.read(FLOW_PACK_HEADER_SIZE)
+        if len(header) < FLOW_PACK_HEADER_SIZE or header[:8] != FLOW_PACK_MAGIC:
+            raise ValueError("Invalid flow container {}: bad header".format(filename))
+        frames, h, w, name_size = (int(v) for v in np.frombuffer(header, "<i4", count=4, offset=8))
+        if frames < 0 or h <= 0 or w <= 0 or name_size <= 0:
+            raise ValueError("Invalid flow container {}: bad header".format(filename))
+        names_bytes = f.read(frames * name_size)
+        file_size = os.fstat(f.fileno()).st_size
+    if len(names_bytes) != frames * name_size:
+        raise ValueError("Invalid flow container {}: truncated frame index".format(filename))
+    names = [names_bytes[n * name_size:(n + 1) * name_size].rstrip(b"\0").decode("utf-8") for n in range(frames)]
+    offset = -(-(FLOW_PACK_HEADER_SIZE + frames * name_size) // FLOW_PACK_ALIGN) * FLOW_PACK_ALIGN
+    expected_size = offset + frames * h * w * 8
+    if file_size != expected_size:
+        raise ValueError("Invalid flow container {}: expected {} bytes for {} frames of {}x{}, found {}".format(
+            filename, expected_size, frames, w, h, file_size))
+    return names, h, w, offset
+
+
+@functools.lru_cache(maxsize=64)
+def open_flow_pack(filename, stamp):
+    names, h, w, offset = readFlowPackHeader(filename)
+    flows = np.memmap(filename, dtype="<f4", mode='r', offset=offset, shape=(len(names), h, w, 2)) \
+        if len(names) > 0 else np.empty((0, h, w, 2), dtype=np.float32)
+    return {name: n for n, name in enumerate(names)}, flows
+
+
+def readFlowPack(filename):
+    """
+    Memory-map a flow container. Open containers are cached, so reading its frames one by one costs a stat call
+    per frame instead of opening a file.
+    :return: (dict of frame name to index, memory-mapped frames of shape (N, h, w, 2))
+    """
+    st = os.stat(filename)
+    return open_flow_pack(filename, (st.st_mtime_ns, st.st_size))
+
+
+def writeFlowPack(filename, names, flows):
+    """
+    Write the frames of a sequence into one flow container. The container is written to a temporary file and
+    renamed, so readers never see a partial file.
+    :param names: frame names, e.g. frame_0001
+    :param flows: (N, h, w, 2) array or list of (h, w, 2) arrays of the same size
+    """
+    names = [str(name) for name in names]
+    if len(names) != len(flows):
+        raise ValueError("Got {} names for {} frames".format(len(names), len(flows)))
+    if len(set(names)) != len(names):
+        raise ValueError("Frame names of {} are not unique".format(filename))
+    if any(FLOW_PACK_SEPARATOR in name for name in names):
+        raise ValueError("Frame names of {} must not contain {}".format(filename, FLOW_PACK_SEPARATOR))
+    encoded = [name.encode("utf-8") for name in names]
+    name_size = max([len(name) for name in encoded] + [1])
+    shape = validate_flow(flows[0], filename).shape if len(flows) > 0 else (1, 1, 2)
+    header = FLOW_PACK_MAGIC + np.array([len(names), shape[0], shape[1], name_size], dtype="<i4").tobytes() + \
+        b"".join(name.ljust(name_size, b"\0") for name in encoded)
+    header = header.ljust(-(-len(header) // FLOW_PACK_ALIGN) * FLOW_PACK_ALIGN, b"\0")
+
+    tmp_filename = "{}.{}.tmp".format(filename, os.getpid())
+    try:
+        with open(tmp_filename, 'wb') as f:
+            f.write(header)
+            for name, flow in zip(names, flows):
+                flow = validate_flow(flow, flow_pack_path(filename, name))
+                if flow.shape != shape:
+                    raise ValueError("Frame {} of {} has shape {}, expected {}".format(name, filename, flow.shape,
+                                                                                      shape))
+                f.write(flow.data)
+        os.replace(tmp_filename, filename)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+
+@functools.lru_cache(maxsize=1)
+def flow_color_lut():
+    """
+    Color wheel lookup table of flow2RGB. The BGR color of OpenCV's uint8 hue (half a degree per step) and
+    saturation at full value is looked up with index degrees * 256 + saturation, degrees in 0..360
+    :return: read-only uint32 array of shape (361 * 256,) holding the BGR colors padded to 4 bytes
+    """
+    hue, saturation = np.meshgrid((np.arange(361) // 2 % 180).astype(np.uint8), np.arange(256, dtype=np.uint8),
+                                  indexing="ij")
+    hsv_mat = np.dstack([hue, saturation, np.full_like(hue, 255)])
+    bgra = cv2.cvtColor(cv2.cvtColor(hsv_mat, cv2.COLOR_HSV2BGR), cv2.COLOR_BGR2BGRA)
+    lut = np.ascontiguousarray(bgra).view(np.uint32).ravel()
+    lut.flags.writeable = False
+    return lut
+
+
+def max_flow_magnitude(flows, max_valid=900):
+    """
+    Maximal magnitude of one or several optical flow fields, e.g. to normalize all frames of a sequence alike
+    :param flows: array of shape [..., 2] or iterable of such arrays
+    :param max_valid: vectors of larger magnitude are invalid and ignored
+    """
+    if isinstance(flows, np.ndarray):
+        flows = [flows]
+    max_mag = 0.0
+    for flow in flows:
+        mag = np.hypot(flow[..., 0], flow[..., 1])
+        mag = mag[mag <= max_valid]
+        if mag.size > 0:
+            max_mag = max(max_mag, float(mag.max()))
+    return max_mag
 
 
 def flow2RGB(flow, max_flow_mag=5):
     """
-        Color-coded visualization of optical flow fields
+        Color-coded visualization of optical flow fields. The direction selects the hue and the magnitude the
+        saturation of the color wheel, see flow_color_lut
 
         # Arguments
             flow: array of shape [:,:,2] containing optical flow
             max_flow_mag: maximal expected flow magnitude used to normalize. If max_flow_mag < 0 the maximal
             magnitude of the optical flow field will be used
     """
-    hsv_mat = np.ones(shape=(flow.shape[0], flow.shape[1], 3), dtype=np.float32) * 255
-    ee = cv2.sqrt(flow[:, :, 0] * flow[:, :, 0] + flow[:, :, 1] * flow[:, :, 1])
-    angle = np.arccos(flow[:, :, 0] / ee)
-    angle[flow[:, :, 0] == 0] = 0
-    angle[flow[:, :, 1] == 0] = 6.2831853 - angle[flow[:, :, 1] == 0]
-    angle = angle * 180 / 3.141
-    hsv_mat[:, :, 0] = angle
+    flow_x, flow_y = cv2.split(np.asarray(flow[:, :, :2], dtype=np.float32))
+    mag, angle = cv2.cartToPolar(flow_x, flow_y, angleInDegrees=True)
     if max_flow_mag < 0:
-        max_flow_mag = ee.max()
-    hsv_mat[:, :, 1] = ee * 220.0 / max_flow_mag
-    ret, hsv_mat[:, :, 1] = cv2.threshold(src=hsv_mat[:, :, 1], maxval=255, thresh=255, type=cv2.THRESH_TRUNC)
-    rgb_mat = cv2.cvtColor(hsv_mat.astype(np.uint8), cv2.COLOR_HSV2BGR)
-    return rgb_mat
+        max_flow_mag = mag.max()
+    max_flow_mag = max(float(max_flow_mag), 1e-6)
 
+    index = angle.astype(np.int32)
+    index *= 256
+    mag *= np.float32(220.0 / max_flow_mag)
+    np.minimum(mag, 255, out=mag)
+    index += mag.astype(np.int32)
+    bgra = np.take(flow_color_lut(), index, mode="clip").view(np.uint8).reshape(index.shape + (4,))
+    return cv2.cvtColor(bgra, cv2.COLOR_BGRA2BGR)
 
-def drawFlowField(filename, flow):
-    cv2.imwrite(filename=filename, img=flow2RGB(flow))
 
-
-def parameter_to_string(parameter_dict):
+def error2RGB(ee, max_error=10):
     """
-    将计算光流所使用的方法全部取出生成字符串
-    :param parameter_dict: parameter_dict
-    :return: out_str
+    Heat map of an endpoint error image, errors of max_error or more saturate
+    :param ee: array of shape [:,:] containing the endpoint errors
     """
+    scaled = np.minimum(ee * (255.0 / max_error), 255).astype(np.uint8)
+    return cv2.applyColorMap(scaled, cv2.COLORMAP_JET)
+
+
+def drawFlowField(filename, flow, max_flow_mag=5):
+    cv2.imwrite(filename=filename, img=flow2RGB(flow, max_flow_mag))
+
+
+@functools.lru_cache(maxsize=1024)
+def parameter_items_to_string(parameter_items):
     out_str = str()
-    for key in sorted(parameter_dict.keys()):
+    for key, value in parameter_items:
         try:
-            str_value = str(parameter_dict[key])
+            str_value = str(value)
         except TypeError:
-            str_value = parameter_dict[key]
+            str_value = value
 
         out_str = out_str + str_value + "_"
     return out_str
 
 
-def get_sequence_measures(result_list):
+def parameter_to_string(parameter_dict):
     """
-    将计算结果按照方法、类别生成list
-    :param result_list:
-    :param parameter_str: 计算光流所使用的方法
-    :param seq_name: 存放连续帧图片的文件夹
-    :return: sequence_list
+    将计算光流所使用的方法全部取出生成字符串
+    :param parameter_dict: parameter_dict
+    :return: out_str
     """
-    sequence_list = dict()
-    for item in result_list:
-        parameter_str = parameter_to_string(item[0]["parameter"])  # 获取计算光流所使用的方法
-        if "dir" in item[0]["files"]:
-            seq_name = item[0]["files"]["dir"]  # 获取当前光流所处的父文件夹
-        else:
-            seq_name = "None"
-
-        if seq_name.find("_dyn") >= 0:
-            continue
-
-        if parameter_str not in sequence_list:
-            sequence_list[parameter_str] = dict()
-
-        if seq_name not in sequence_list[parameter_str]:
-            sequence_list[parameter_str][seq_name] = list()
-
-        sequence_list[parameter_str][seq_name].append(item[1])
-
-    return sequence_list
-
-
-def avg_sequence(src):
-    """
-    计算每一个类别中FG、BG、Total的ee、R1、R2、R3
-    :param src:
-    :return:
-    """
-    sequence_result = dict()
-    for seq_keys in src.keys():  # 遍历类别
-        result = dict()
-        for item in src[seq_keys]:  # 遍历类内的连续帧
-            for key in item.keys():  # 遍历FG、BG、Total
-                if key != "FG" and key != "BG" and key != "Total":
-                    continue
-                if key not in result:
-                    result[key] = item[key]
-                else:
-                    for key1 in item[key].keys():  # 遍历ee、R1、R2、R3、noPoints
-                        result[key][key1] += item[key][key1]
-
-        for key in result.keys():  # 遍历FG、BG、Total
-            result[key]["ee"] = result[key]["ee"] / result[key]["noPoints"]
-            result[key]["R1"] = result[key]["R1"] / result[key]["noPoints"]
-            result[key]["R2"] = result[key]["R2"] / result[key]["noPoints"]
-            result[key]["R3"] = result[key]["R3"] / result[key]["noPoints"]
-        sequence_result[seq_keys] = copy.deepcopy(result)
-    return sequence_result
-
-
-def avg_sequences(sequence_list, use_type):
-    """
-    计算整个数据集在FG、BG、Total下的ee、R2
-    :param sequence_list:
-    :param use_type:
-    :return:
-    """
-    res_FG_ee = []
-    res_FG_R2 = []
-    res_BG_ee = []
-    res_BG_R2 = []
-    res_total_ee = []
-    res_total_R2 = []
-    for seq_name in sequence_list.keys():  # 遍历类别
-        if use_type == 0 and seq_name.find("_hDyn") >= 0:
-            continue
-        if use_type == 1 and seq_name.find("_hDyn") == -1:
-            continue
-
-        res_FG_ee.append(sequence_list[seq_name]["FG"]["ee"])
-        res_FG_R2.append(sequence_list[seq_name]["FG"]["R2"])
-        res_BG_ee.append(sequence_list[seq_name]["BG"]["ee"])
-        res_BG_R2.append(sequence_list[seq_name]["BG"]["R2"])
-        res_total_ee.append(sequence_list[seq_name]["Total"]["ee"])
-        res_total_R2.append(sequence_list[seq_name]["Total"]["R2"])
-
-    return np.mean(res_FG_ee), 100 * np.mean(res_FG_R2), \
-        np.mean(res_BG_ee), 100 * np.mean(res_BG_R2), \
-        np.mean(res_total_ee), 100 * np.mean(res_total_R2)
-
-
-def getLatexTable(filename):
-    data = pickle.load(open(filename, "rb"))
-
-    str_result = "\\begin{table} \n \\centering " \
-                 "\\begin{tabular}{l|crcr|crcr|crcrcr|r} \n" \
-                 "\\hline \n " \
-                 "\\multicolumn{1}{c|}{} & \\multicolumn{2}{|c}{FG (Static) } & \\multicolumn{2}{c|} { BG (Static)} & " \
-                 "\\multicolumn{2}{|c}{FG (Dynamic)} & \\multicolumn{2}{c|}{ BG (Dynamic)} & " \
-                 "\\multicolumn{2}{c}{FG($\\varnothing$)}&\multicolumn{2}{c}{BG ($\\varnothing$)} & " \
-                 "\\multicolumn{2}{c|}{$\\varnothing$}  \\\\ \n " \
-                 "\\multicolumn{1}{c|}{}& EPE & R2[\\%] & EPE & R2[\\%]& EPE & R2[\\%]& EPE & R2[\\%]" \
-                 "& EPE & R2[\\%]& EPE & R2[\\%]& EPE & R2[\\%] \\\\ \n "
-    result_list = data["result"]
-    method_result_list = get_sequence_measures(result_list)
-    for method_key in method_result_list.keys():
-        sequence_result = avg_sequence(method_result_list[method_key])
-
-        ret_static = avg_sequences(sequence_result, 0)
-        ret_dynamic = avg_sequences(sequence_result, 1)
-        ret_total = avg_sequences(sequence_result, 2)
-        name = method_key.replace("/", "")
-        name = name.replace("_", "")
-        str_out = name \
-                  + " & {:.3f}".format(ret_static[0]) \
-                  + " & {:.2f}".format(ret_static[1]) \
-                  + " & {:.3f}".format(ret_static[2]) \
-                  + " & {:.2f}".format(ret_static[3]) \
-                  + " & {:.3f}".format(ret_dynamic[0]) \
-                  + " & {:.2f}".format(ret_dynamic[1]) \
-                  + " & {:.3f}".format(ret_dynamic[2]) \
-                  + " & {:.2f}".format(ret_dynamic[3]) \
-                  + " & {:.3f}".format(ret_total[0]) \
-                  + " & {:.3f}".format(ret_total[1]) \
-                  + " & {:.3f}".format(ret_total[2]) \
-                  + " & {:.2f}".format(ret_total[3]) \
-                  + " & {:.3f}".format(ret_total[4]) \
-                  + " & {:.2f}".format(ret_total[5]) \
-                  + " \\\ "
-        str_result = str_result + str_out + "\n"
-
-    str_result = str_result + "\end{tabular} \n " \
-                              "\\vspace{0.1cm} \n" \
-                              "\\caption{Evaluation results common optical flow metrics. " \
-                              "Dynamic comprised sequences with and static without camera motion, " \
-                              "BG - background motion vectors and FG - motion vectors located at persons of the crowd.} \n" \
-                              "\\end{table}"
-    return str_result
-
-
-def avg_measures(src):
-    """
-    计算数据集的ee、R1、R2、R3
-    :param src:
-    :return:
-    """
-    total_result = dict()
-    for seq_keys in src.keys():  # 遍历类别
-        result = dict()
-        for item in src[seq_keys]:  # 遍历类内的连续帧
-            for key in item.keys():  # 遍历FG、BG、Total
-                if key == "time":
-                    continue
-                if key not in result:
-                    result[key] = item[key]
-                else:
-                    for key1 in item[key].keys():  # 遍历ee、R1、R2、R3、noPoints
-                        result[key][key1] += int(item[key][key1])
-
-        for key in result.keys():  # 遍历FG、BG、Total
-            result[key]["ee"] = result[key]["ee"] / result[key]["noPoints"]
-            result[key]["R1"] = result[key]["R1"] / result[key]["noPoints"]
-            result[key]["R2"] = result[key]["R2"] / result[key]["noPoints"]
-            result[key]["R3"] = result[key]["R3"] / result[key]["noPoints"]
-
-        if len(total_result) == 0:
-            for key in result.keys():  # 遍历FG、BG、Total
-                total_result[key] = dict()
-                total_result[key]["ee"] = result[key]["ee"] / len(src)
-                total_result[key]["R1"] = result[key]["R1"] / len(src)
-                total_result[key]["R2"] = result[key]["R2"] / len(src)
-                total_result[key]["R3"] = result[key]["R3"] / len(src)
-        else:
-            for key in result.keys():  # 遍历FG、BG、Total
-                total_result[key]["ee"] += result[key]["ee"] / len(src)
-                total_result[key]["R1"] += result[key]["R1"] / len(src)
-                total_result[key]["R2"] += result[key]["R2"] / len(src)
-                total_result[key]["R3"] += result[key]["R3"] / len(src)
-    return total_result
-
-
-def avg_measures_no_dict(src):
-    total_result = dict()
-    for seq_keys in src.keys():  # 遍历类别
-        result = dict()
-        for item in src[seq_keys]:  # 遍历连续帧
-            for key in item.keys():  # 遍历FG、BG、Total
-                if key not in result:
-                    result[key] = item[key]
-                else:
-                    result[key] += item[key]    # 此处运算存在Bug，需要转换为List
-
-        result["ee"] = result["ee"] / result["no_points"]
-        result["R1"] = result["R1"] / result["no_points"]
-        result["R2"] = result["R2"] / result["no_points"]
-        result["R3"] = result["R3"] / result["no_points"]
-
-        if len(total_result) == 0:
-            for key in result.keys():
-                total_result = dict()
-                total_result["ee"] = result["ee"] / len(src)
-                total_result["R1"] = result["R1"] / len(src)
-                total_result["R2"] = result["R2"] / len(src)
-                total_result["R3"] = result["R3"] / len(src)
-        else:
-            for key in result.keys():
-                total_result["ee"] += result["ee"] / len(src)
-                total_result["R1"] += result["R1"] / len(src)
-                total_result["R2"] += result["R2"] / len(src)
-                total_result["R3"] += result["R3"] / len(src)
-    return total_result
-
-
-def avg_measures_test(filename):
-    data = pickle.load(open(filename, "rb"))
-    result_list = data["result"]
-    method_result_list = get_sequence_measures(result_list)
-    for method_key in method_result_list.keys():
-        avg_measures(method_result_list[method_key])
-        # avg_measures_no_dict(method_result_list[method_key])
+    parameter_items = tuple(sorted(parameter_dict.items()))
+    try:
+        return parameter_items_to_string(parameter_items)
+    except TypeError:  # unhashable parameter values are not cached
+        return parameter_items_to_string.__wrapped__(parameter_items)
@@ -0,0 +1,158 @@
+# ---------------------------------------------------------------------
+# Copyright (c) 2018 TU Berlin, Communication Systems Group
+# Written by Tobias Senst <senst@nue.tu-berlin.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# ---------------------------------------------------------------------
+import argparse
+import collections
+import concurrent.futures
+import os
+
+import cv2
+import numpy as np
+
+import file_parser as fp
+import opticalflow_evaluate as oe
+import util as ut
+
+# ground truth vectors of larger magnitude are invalid, see util.compute_labels
+MAX_VALID_FLOW = 900
+
+
+def group_frames(filenames_by_method):
+    """
+    Group the filename dicts of all methods by frame pair
+    :param filenames_by_method: dict of method name to list of filename dicts, see file_parser.create_filename_list
+    :return: OrderedDict of (dir, filename) to list of (method, filename_dict), in dataset order
+    """
+    frames = collections.OrderedDict()
+    for method, filenames in filenames_by_method.items():
+        for filename_dict in filenames:
+            frames.setdefault((filename_dict["dir"], filename_dict["filename"]), list()).append(
+                (method, filename_dict))
+    return frames
+
+
+def sequence_max_magnitudes(frames, pool):
+    """
+    Maximal valid ground truth flow magnitude of every sequence
+    :return: dict of sequence to maximal magnitude
+    """
+    keys = list(frames.keys())
+    gt_files = [frames[key][0][1]["gt_flow"] for key in keys]
+    magnitudes = pool.map(lambda gt_file: ut.max_flow_magnitude(ut.readFlowFiles(gt_file), MAX_VALID_FLOW), gt_files)
+    max_mags = dict()
+    for (sequence, _), max_mag in zip(keys, magnitudes):
+        max_mags[sequence] = max(max_mags.get(sequence, 0.0), max_mag)
+    return max_mags
+
+
+def write_image(image, png_compression, out_dir, *parts):
+    filename = os.path.join(out_dir, *parts)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    cv2.imwrite(filename, image, [cv2.IMWRITE_PNG_COMPRESSION, png_compression])
+
+
+def render_frame(frame_items, out_dir, max_flow_mag, max_error, write_gt=True, png_compression=1):
+    """
+    Write the color coded ground truth and, for every method, the color coded estimate and the endpoint error
+    heat map of one frame pair. The ground truth is read once for all methods. Pixels without valid ground truth,
+    e.g. of the sparse KITTI ground truth, are black in the ground truth image and have no error.
+    :param frame_items: list of (method, filename_dict) of the same frame pair
+    :param out_dir: output directory, images are written to <out_dir>/<gt|method>/<dir>/<filename>[_epe].png
+    :param max_flow_mag: flow magnitude of full saturation, see util.flow2RGB
+    :param max_error: endpoint error of full heat, see util.error2RGB
+    :param png_compression: zlib level 0-9, encoding dominates the render time
+    :return: number of images written
+    """
+    filename_dict = frame_items[0][1]
+    sequence, name = filename_dict["dir"], filename_dict["filename"]
+    gt_flow = ut.readFlowFiles(filename_dict["gt_flow"])
+    labels = ut.compute_labels(gt_flow, ut.readMask(filename_dict["mask"], gt_flow.shape[:2]))
+    invalid = labels == ut.LABEL_INVALID
+    written = 0
+    if write_gt:
+        gt_rgb = ut.flow2RGB(np.where(invalid[..., None], 0, gt_flow), max_flow_mag)
+        gt_rgb[invalid] = 0
+        write_image(gt_rgb, png_compression, out_dir, "gt", sequence, name + ".png")
+        written += 1
+    for method, filename_dict in frame_items:
+        est_flow = ut.readFlowFiles(filename_dict["estflow"])
+        write_image(ut.flow2RGB(est_flow, max_flow_mag), png_compression, out_dir, method, sequence, name + ".png")
+        ee = ut.compute_ee(est_flow, gt_flow)
+        ee[invalid] = 0
+        write_image(ut.error2RGB(ee, max_error), png_compression, out_dir, method, sequence, name + "_epe.png")
+        written += 2
+    return written
+
+
+def export_visualizations(filenames_by_method, out_dir, max_flow_mag=None, max_error=10, num_threads=8,
+                          write_gt=True, png_compression=1):
+    """
+    Render the ground truth, the estimates and the endpoint error heat maps of whole sequences with a thread pool.
+    Decoding, color coding and PNG encoding release the GIL, so the frames are rendered in parallel.
+    :param filenames_by_method: dict of method name to list of filename dicts, see file_parser.create_filename_list
+    :param out_dir: output directory
+    :param max_flow_mag: fixed flow magnitude of full saturation, None normalizes every sequence by the maximal
+    magnitude of its ground truth
+    :param max_error: endpoint error of full heat
+    :param num_threads: number of render threads
+    :param write_gt: also write the color coded ground truth
+    :param png_compression: zlib level 0-9 of the written images
+    :return: number of images written
+    """
+    frames = group_frames(filenames_by_method)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, num_threads)) as pool:
+        max_mags = sequence_max_magnitudes(frames, pool) if max_flow_mag is None else None
+        futures = [pool.submit(render_frame, frame_items, out_dir,
+                               max_flow_mag if max_mags is None else max_mags[sequence], max_error, write_gt,
+                               png_compression)
+                   for (sequence, _), frame_items in frames.items()]
+        return sum(future.result() for future in futures)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export color coded ground truth, estimates and endpoint error "
+                                                 "heat maps of the training set of MPI-Sintel, KITTI or "
+                                                 "FlyingChairs.")
+    oe.add_dataset_arguments(parser)
+    parser.add_argument("output", help="output directory")
+    parser.add_argument("methods", nargs="+", type=oe.parse_method, metavar="method",
+                        help="estimate directory of a method as name=directory or directory, the method is then "
+                             "named after the directory")
+    parser.add_argument("--max-flow", type=float, default=None,
+                        help="flow magnitude of full saturation, by default the maximal ground truth magnitude "
+                             "of each sequence")
+    parser.add_argument("--max-error", type=float, default=10,
+                        help="endpoint error of full heat (default: %(default)s)")
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1,
+                        help="number of render threads (default: %(default)s)")
+    parser.add_argument("--png-compression", type=int, choices=range(10), default=1, metavar="0-9",
+                        help="zlib level of the written images (default: %(default)s)")
+    parser.add_argument("--no-gt", action="store_true", help="do not write the color coded ground truth")
+    args = parser.parse_args(argv)
+
+    plugin, basepath, image_pass = oe.parse_dataset(parser, args)
+    filenames_by_method = collections.OrderedDict()
+    for name, directory in args.methods:
+        filenames_by_method[name] = fp.create_filename_list(
+            plugin.basepaths(basepath, os.path.join(directory, ""), image_pass), parser=plugin)
+    written = export_visualizations(filenames_by_method, args.output, args.max_flow, args.max_error, args.threads,
+                                    not args.no_gt, args.png_compression)
+    print("Wrote {} images to {}".format(written, args.output))
+
+
+if __name__ == '__main__':
+    main()